@@ -0,0 +1,127 @@
+"""
+<Program Name>
+  benchmark_fileread.py
+
+<Purpose>
+  Measures how many small readat calls per second emulfile can serve at
+  random offsets of a large file (as a program that indexes a read-mostly
+  data file would do), once through the file object and once through a memory
+  mapping of the file (see repy_constants.FILE_MMAP_MIN_SIZE).   For each, it
+  also shows how much the memory use of the process (as resource_monitor
+  measures it) grew.
+
+  Both must read the same data and must have been charged the same fileread.
+
+  The file is written to a temporary directory which is removed afterwards.
+
+<Usage>
+  python benchmark_fileread.py [reads] [readsize] [filesize]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import repyportability
+import nanny
+import emulfile
+import nonportable
+import repy_constants
+
+
+
+# The fileread charged for each way of reading
+charges = {}
+
+def count_fileread(resource, quantity):
+  if resource == 'fileread':
+    charges[current_name[0]] = charges.get(current_name[0], 0) + quantity
+
+current_name = [None]
+
+
+
+def get_memory_use():
+  pid = os.getpid()
+  nonportable.os_api.get_process_cpu_time(pid)
+  return nonportable._get_memory_use(pid, nonportable.mapped_file_bytes)
+
+
+
+# returns the number of readat calls per second, the growth of the memory use
+# and the data that was read
+def time_reads(name, offsets, readsize):
+  current_name[0] = name
+  fileobj = emulfile.emulated_open("data", False)
+
+  memorybefore = get_memory_use()
+  datalist = []
+  start = time.time()
+  for offset in offsets:
+    datalist.append(fileobj.readat(readsize, offset))
+  rate = len(offsets) / (time.time() - start)
+  memorygrowth = get_memory_use() - memorybefore
+
+  fileobj.close()
+  return rate, memorygrowth, datalist
+
+
+
+def main():
+  reads = 200000
+  readsize = 100
+  filesize = 256 * 1024 * 1024
+  if len(sys.argv) > 1:
+    reads = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    readsize = int(sys.argv[2])
+  if len(sys.argv) > 3:
+    filesize = int(sys.argv[3])
+
+  if nonportable.mapped_files_count_as_memory():
+    print "ERROR: emulfile doesn't use memory mappings on this system!"
+    sys.exit(1)
+
+  tempdirectory = tempfile.mkdtemp()
+  repy_constants.REPY_CURRENT_DIR = tempdirectory
+  nanny.tattle_quantity_batched = count_fileread
+
+  try:
+    datafileobj = open(os.path.join(tempdirectory, "data"), "wb")
+    chunk = os.urandom(1024 * 1024)
+    for count in xrange(filesize / len(chunk)):
+      datafileobj.write(chunk)
+    datafileobj.close()
+
+    offsets = [random.randrange(filesize - readsize) for count in xrange(reads)]
+
+    minsize = repy_constants.FILE_MMAP_MIN_SIZE
+    repy_constants.FILE_MMAP_MIN_SIZE = None
+    results = [("file object",) + time_reads("file object", offsets, readsize)]
+    repy_constants.FILE_MMAP_MIN_SIZE = minsize
+    results.append(("memory mapping",) + time_reads("memory mapping", offsets, readsize))
+  finally:
+    shutil.rmtree(tempdirectory)
+
+  if results[0][3] != results[1][3]:
+    print "ERROR: the memory mapping read other data than the file object!"
+    sys.exit(1)
+  if charges["file object"] != charges["memory mapping"]:
+    print "ERROR: the memory mapping was charged", charges["memory mapping"], \
+        "fileread instead of", charges["file object"]
+    sys.exit(1)
+
+  print "readat calls per second (%d reads of %d bytes from a %d MB file)" % \
+      (reads, readsize, filesize / (1024 * 1024))
+  print "%-16s %10s %20s" % ("", "reads/s", "memory growth (KB)")
+  for name, rate, memorygrowth, datalist in results:
+    print "%-16s %10.0f %20d" % (name, rate, memorygrowth / 1024)
+  print "%-16s %9.1fx" % ("speedup", results[1][1] / results[0][1])
+
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+"""
+<Program Name>
+  benchmark_filewrite.py
+
+<Purpose>
+  Measures how many small writeat calls per second emulfile can serve, when
+  a program appends records to a file (as a log or a key-value store would).
+  The records are written once to a file without a write buffer, where each
+  writeat writes and flushes, and once to a file with a write-behind buffer
+  (see emulfile.start_write_buffer_flusher).
+
+  Afterwards the files must have the same contents and size, and both must
+  have been charged the same filewrite.
+
+  The files are written to a temporary directory which is removed afterwards.
+
+<Usage>
+  python benchmark_filewrite.py [writes] [recordsize]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import repyportability
+import nanny
+import emulfile
+import repy_constants
+
+
+
+# The filewrite charged for each file
+charges = {}
+
+def count_filewrite(resource, quantity):
+  if resource == 'filewrite':
+    charges[current_file[0]] = charges.get(current_file[0], 0) + quantity
+
+current_file = [None]
+
+
+
+# returns the number of writeat calls per second
+def time_writes(filename, writes, recordsize):
+  current_file[0] = filename
+  fileobj = emulfile.emulated_open(filename, True)
+
+  record = "x" * (recordsize - 1) + "\n"
+  start = time.time()
+  offset = 0
+  for count in xrange(writes):
+    fileobj.writeat(record, offset)
+    offset = offset + recordsize
+  fileobj.close()
+  return writes / (time.time() - start)
+
+
+
+def main():
+  writes = 1000000
+  recordsize = 16
+  if len(sys.argv) > 1:
+    writes = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    recordsize = int(sys.argv[2])
+
+  tempdirectory = tempfile.mkdtemp()
+  repy_constants.REPY_CURRENT_DIR = tempdirectory
+  nanny.tattle_quantity_batched = count_filewrite
+
+  try:
+    unbuffered = time_writes("unbuffered", writes, recordsize)
+    emulfile.start_write_buffer_flusher()
+    buffered = time_writes("buffered", writes, recordsize)
+
+    contents = []
+    for filename in ["unbuffered", "buffered"]:
+      fileobj = open(os.path.join(tempdirectory, filename), "rb")
+      contents.append(fileobj.read())
+      fileobj.close()
+  finally:
+    shutil.rmtree(tempdirectory)
+
+  if contents[0] != contents[1] or len(contents[0]) != writes * recordsize:
+    print "ERROR: the buffered file differs from the unbuffered one!"
+    sys.exit(1)
+  if charges["unbuffered"] != charges["buffered"]:
+    print "ERROR: the buffered file was charged", charges["buffered"], \
+        "filewrite instead of", charges["unbuffered"]
+    sys.exit(1)
+
+  print "writeat calls per second (%d writes of %d bytes)" % (writes, recordsize)
+  print "%-28s %10.0f" % ("unbuffered", unbuffered)
+  print "%-28s %10.0f" % ("write buffer of " + str(repy_constants.FILE_WRITE_BUFFER_SIZE) + " bytes", buffered)
+  print "%-28s %9.1fx" % ("speedup", buffered / unbuffered)
+
+
+
+if __name__ == '__main__':
+  main()
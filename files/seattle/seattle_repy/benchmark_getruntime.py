@@ -0,0 +1,76 @@
+"""
+<Program Name>
+  benchmark_getruntime.py
+
+<Purpose>
+  Measures how many calls per second nonportable.getruntime can serve, first
+  using the uptime / time.time() reconciliation (which takes a lock and reads
+  /proc/uptime on every call) and then using the monotonic clock.   The
+  measurement is done with one thread and with several concurrent threads,
+  since the nanny calls getruntime from every thread that consumes resources.
+
+<Usage>
+  python benchmark_getruntime.py [calls_per_thread] [threadcount]
+"""
+
+import sys
+import time
+import threading
+
+import nonportable
+
+
+
+def call_getruntime(calls):
+  getruntime = nonportable.getruntime
+  for count in xrange(calls):
+    getruntime()
+
+
+
+# returns the number of getruntime calls per second using threadcount threads
+def measure_calls_per_second(calls, threadcount):
+  threadlist = []
+  for threadnumber in range(threadcount):
+    threadlist.append(threading.Thread(target=call_getruntime, args=(calls,)))
+
+  start = time.time()
+  for thread in threadlist:
+    thread.start()
+  for thread in threadlist:
+    thread.join()
+  elapsed = time.time() - start
+
+  return calls * threadcount / elapsed
+
+
+
+def main():
+  calls = 100000
+  threadcount = 4
+  if len(sys.argv) > 1:
+    calls = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    threadcount = int(sys.argv[2])
+
+  nonportable.init_getruntime(use_monotonic_clock=False)
+  oldsingle = measure_calls_per_second(calls, 1)
+  oldthreaded = measure_calls_per_second(calls, threadcount)
+
+  nonportable.init_getruntime()
+  if nonportable.monotonic_starttime is None:
+    print "ERROR: no monotonic clock is available on this system!"
+    sys.exit(1)
+  newsingle = measure_calls_per_second(calls, 1)
+  newthreaded = measure_calls_per_second(calls, threadcount)
+
+  print "getruntime calls per second"
+  print "                     1 thread    ", threadcount, "threads"
+  print "uptime and time():  %10.0f  %10.0f" % (oldsingle, oldthreaded)
+  print "monotonic clock:    %10.0f  %10.0f" % (newsingle, newthreaded)
+  print "speedup:            %9.1fx  %9.1fx" % (newsingle / oldsingle, newthreaded / oldthreaded)
+
+
+
+if __name__ == '__main__':
+  main()
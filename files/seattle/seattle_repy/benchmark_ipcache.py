@@ -0,0 +1,108 @@
+"""
+<Program Name>
+  benchmark_ipcache.py
+
+<Purpose>
+  Measures how many UDP messages per second sendmessage can send when repy
+  is restricted to an interface (like repy.py --iface eth0 --nootherips).
+  Every call checks that the local IP is allowed, which used to look up the
+  addresses of the interface by running ifconfig each time.   The rate is
+  measured
+
+    - looking up the addresses with ifconfig on every call (as before),
+    - looking up the addresses with an ioctl on every call, and
+    - using the cache of allowed IP's (refreshed every
+      IP_CACHE_REFRESH_FREQ seconds or when the addresses change).
+
+  The messages are sent from the address of the interface to a socket on
+  the loopback address.
+
+<Usage>
+  python benchmark_ipcache.py [interface] [messages]
+"""
+
+import sys
+import time
+import socket
+import subprocess
+
+import repyportability
+import emulcomm
+import nonportable
+
+
+
+# Looks up the addresses of an interface the way linux_api did before
+def get_interface_ip_addresses_ifconfig(interfacename):
+  ifconfigprocess = subprocess.Popen(["/sbin/ifconfig", interfacename],
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  ifconfigoutput, _ = ifconfigprocess.communicate()
+
+  ipaddresslist = []
+  for line in ifconfigoutput.split("\n"):
+    words = line.replace("addr:", "").split()
+    if len(words) > 1 and words[0] == "inet":
+      ipaddresslist.append(words[1])
+  return ipaddresslist
+
+
+
+# returns the number of messages sent per second.   If refresh is True, the
+# cache is expired before each message.
+def time_sendmessage(localip, destport, messages, refresh):
+  start = time.time()
+  for count in xrange(messages):
+    if refresh:
+      emulcomm.ip_cache_expiration = None
+    emulcomm.sendmessage("127.0.0.1", destport, "hello", localip, 63100)
+  return messages / (time.time() - start)
+
+
+
+def main():
+  interfacename = "eth0"
+  messages = 10000
+  if len(sys.argv) > 1:
+    interfacename = sys.argv[1]
+  if len(sys.argv) > 2:
+    messages = int(sys.argv[2])
+
+  iplist = nonportable.os_api.get_interface_ip_addresses(interfacename)
+  if not iplist:
+    print "ERROR: the interface", interfacename, "has no IPv4 address!"
+    sys.exit(1)
+  localip = iplist[0]
+
+  # This is what repy.py does for --iface and --nootherips
+  emulcomm.user_ip_interface_preferences = True
+  emulcomm.allow_nonspecified_ips = False
+  emulcomm.user_specified_ip_interface_list = [(False, interfacename)]
+
+  # Receives (and drops) the messages
+  receiversock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  receiversock.bind(("127.0.0.1", 0))
+  destport = receiversock.getsockname()[1]
+
+  ioctllookup = nonportable.os_api.get_interface_ip_addresses
+  results = []
+  try:
+    nonportable.os_api.get_interface_ip_addresses = get_interface_ip_addresses_ifconfig
+    results.append(("ifconfig on every call",
+        time_sendmessage(localip, destport, max(messages / 100, 1), True)))
+    nonportable.os_api.get_interface_ip_addresses = ioctllookup
+    results.append(("ioctl on every call",
+        time_sendmessage(localip, destport, messages, True)))
+    results.append(("cached allowed IP's",
+        time_sendmessage(localip, destport, messages, False)))
+  finally:
+    nonportable.os_api.get_interface_ip_addresses = ioctllookup
+    receiversock.close()
+
+  print "sendmessage calls per second from", localip, "(--iface " + interfacename + ")"
+  for name, rate in results:
+    print "%-25s %10.0f %7.1fx" % (name, rate, rate / results[0][1])
+
+
+
+if __name__ == '__main__':
+  main()
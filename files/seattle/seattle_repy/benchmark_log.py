@@ -0,0 +1,105 @@
+"""
+<Program Name>
+  benchmark_log.py
+
+<Purpose>
+  Measures how many log writes per second the circular logger that repy.py
+  uses for --logfile can serve (this is where log() and print output of the
+  sandbox goes).   The lines are written once to a logger without a buffer,
+  which writes and flushes the log file on every write, and once to a logger
+  with a buffer of repy_constants.LOG_BUFFER_SIZE bytes (see
+  loggingrepy_core.circular_logger_core).
+
+  Afterwards both logs must have the same .old and .new files, and both must
+  have been charged the same lograte.
+
+  The logs are written to a temporary directory which is removed afterwards.
+
+<Usage>
+  python benchmark_log.py [writes] [linesize]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import repyportability
+import nanny
+import loggingrepy
+import repy_constants
+
+
+
+# The lograte charged for each log
+charges = {}
+
+def count_lograte(resource, quantity):
+  if resource == 'lograte':
+    charges[current_log[0]] = charges.get(current_log[0], 0) + quantity
+
+current_log = [None]
+
+
+
+# returns the number of writes per second
+def time_writes(logname, buffersize, writes, linesize):
+  current_log[0] = logname
+  logger = loggingrepy.circular_logger(logname, buffersize=buffersize)
+
+  start = time.time()
+  for count in xrange(writes):
+    # this is what print does for a line
+    logger.write(str(count).rjust(linesize - 1))
+    logger.write("\n")
+  logger.flush()
+  return writes / (time.time() - start)
+
+
+
+def main():
+  writes = 200000
+  linesize = 40
+  if len(sys.argv) > 1:
+    writes = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    linesize = int(sys.argv[2])
+
+  tempdirectory = tempfile.mkdtemp()
+  nanny.tattle_quantity = lambda resource, quantity: None
+  nanny.tattle_quantity_batched = count_lograte
+
+  try:
+    unbuffered = time_writes(os.path.join(tempdirectory, "unbuffered"), 0,
+        writes, linesize)
+    buffered = time_writes(os.path.join(tempdirectory, "buffered"),
+        repy_constants.LOG_BUFFER_SIZE, writes, linesize)
+
+    contents = []
+    for logname in ["unbuffered", "buffered"]:
+      logcontents = []
+      for suffix in [".old", ".new"]:
+        fileobj = open(os.path.join(tempdirectory, logname + suffix), "rb")
+        logcontents.append(fileobj.read())
+        fileobj.close()
+      contents.append(logcontents)
+  finally:
+    shutil.rmtree(tempdirectory)
+
+  if contents[0] != contents[1]:
+    print "ERROR: the buffered log differs from the unbuffered one!"
+    sys.exit(1)
+  if charges.values()[0] != charges.values()[1]:
+    print "ERROR: the logs were charged different lograte:", charges
+    sys.exit(1)
+
+  print "print calls per second (%d lines of %d bytes)" % (writes, linesize)
+  print "%-28s %10.0f" % ("unbuffered", unbuffered)
+  print "%-28s %10.0f" % ("log buffer of " + str(repy_constants.LOG_BUFFER_SIZE) + " bytes", buffered)
+  print "%-28s %9.1fx" % ("speedup", buffered / unbuffered)
+
+
+
+if __name__ == '__main__':
+  main()
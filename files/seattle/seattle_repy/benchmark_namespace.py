@@ -0,0 +1,123 @@
+"""
+<Program Name>
+  benchmark_namespace.py
+
+<Purpose>
+  Measures the overhead the namespace layer adds to repy API calls.   Each
+  signature is wrapped with a NamespaceAPIFunctionWrapper around a trivial
+  function and called through the generic wrapped_function() method and
+  through the function from make_specialized_function() (which is what
+  sandboxed code calls).
+
+  It also measures how long namespace._copy takes to copy large arguments,
+  such as a context passed to VirtualNamespace.evaluate.
+
+<Usage>
+  python benchmark_namespace.py [calls] [copyelements]
+"""
+
+import sys
+import time
+
+import namespace
+
+
+
+# Stands in for an object whose method is wrapped by name (like a lock) or
+# that is passed as "self" (like a socket)
+class BenchmarkObject(object):
+  def recv(self, bytes):
+    return 'x'
+
+
+
+def sendmessage(destip, destport, message, localip, localport):
+  return len(message)
+
+
+
+def getruntime():
+  return 1.0
+
+
+
+# Each entry has a name, the wrapper info, whether it is a method and the
+# arguments to call it with
+BENCHMARKS = [
+  ('getruntime()',
+   {'func' : getruntime, 'args' : [], 'return' : namespace.Float()},
+   False, ()),
+  ('sendmessage(ip, port, msg, ip, port)',
+   {'func' : sendmessage,
+    'args' : [namespace.Str(), namespace.Int(), namespace.Str(), namespace.Str(), namespace.Int()],
+    'return' : namespace.Int()},
+   False, ('127.0.0.1', 12345, 'hello', '127.0.0.1', 12346)),
+  ('socket.recv(bytes)',
+   {'func' : 'recv', 'args' : [namespace.Int(min=1)], 'return' : namespace.Str()},
+   True, (BenchmarkObject(), 1024)),
+]
+
+
+
+# returns the number of calls per second
+def time_calls(function, args, calls):
+  start = time.time()
+  for count in xrange(calls):
+    function(*args)
+  return calls / (time.time() - start)
+
+
+
+# Each entry has a name and a function that builds an object with about
+# the given number of elements
+COPY_BENCHMARKS = [
+  ('context dict of str -> int',
+   lambda elements: dict([('var' + str(i), i) for i in xrange(elements)])),
+  ('list of str',
+   lambda elements: ['item' + str(i) for i in xrange(elements)]),
+  ('list of (str, int) tuples',
+   lambda elements: [('item', i) for i in xrange(elements)]),
+  ('list of small dicts',
+   lambda elements: [{'name' : 'x', 'values' : [i, i]} for i in xrange(elements / 4)]),
+]
+
+
+
+# returns the average time to copy obj
+def time_copy(obj, repetitions):
+  start = time.time()
+  for count in xrange(repetitions):
+    namespace._copy(obj)
+  return (time.time() - start) / repetitions
+
+
+
+def main():
+  calls = 100000
+  copyelements = 100000
+  if len(sys.argv) > 1:
+    calls = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    copyelements = int(sys.argv[2])
+
+  print "API calls per second (%d calls each)" % calls
+  print "%-40s %12s %12s %8s" % ("call", "generic", "specialized", "speedup")
+  for name, wrapperinfo, is_method, args in BENCHMARKS:
+    wrapperobj = namespace.NamespaceAPIFunctionWrapper(wrapperinfo, is_method)
+    generic = time_calls(wrapperobj.wrapped_function, args, calls)
+    specialized = time_calls(wrapperobj.make_specialized_function(), args, calls)
+    print "%-40s %12.0f %12.0f %7.1fx" % (name, generic, specialized, specialized / generic)
+
+  print
+  print "namespace._copy of %d elements" % copyelements
+  for name, buildfunction in COPY_BENCHMARKS:
+    obj = buildfunction(copyelements)
+    if namespace._copy(obj) != obj:
+      print "ERROR: the copy of the", name, "differs from the original!"
+      sys.exit(1)
+    print "%-40s %10.4f seconds" % (name, time_copy(obj, 5))
+
+
+
+if __name__ == '__main__':
+  main()
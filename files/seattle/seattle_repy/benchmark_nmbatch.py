@@ -0,0 +1,113 @@
+"""
+<Program Name>
+  benchmark_nmbatch.py
+
+<Purpose>
+  Measures how long it takes to deploy a program to a vessel of a (local)
+  node manager, first with one signed request per call and then with a single
+  VesselBatch request.   Each deploy uploads the program's files and then
+  lists the files in the vessel.   The uploaded files are removed afterwards.
+
+<Usage>
+  python benchmark_nmbatch.py nmIP nmport vesselname publickeyfile
+      privatekeyfile [numberoffiles] [filesize] [repetitions]
+
+  The keys must be the owner or a user key of the vessel.
+"""
+
+import sys
+import time
+
+import fastnmclient
+
+from repyportability import *
+_context = locals()
+add_dy_support(_context)
+
+rsa = dy_import_module("rsa.r2py")
+
+
+
+def deploy_one_at_a_time(nmhandle, filelist):
+  for filename, filedata in filelist:
+    fastnmclient.nmclient_signedsaytovessel(nmhandle, 'AddFileToVessel', filename, filedata)
+  fastnmclient.nmclient_signedsaytovessel(nmhandle, 'ListFilesInVessel')
+
+
+
+def deploy_batch(nmhandle, filelist):
+  calllist = []
+  for filename, filedata in filelist:
+    calllist.append(('AddFileToVessel', filename, filedata))
+  calllist.append(('ListFilesInVessel',))
+  fastnmclient.nmclient_signedbatchtovessel(nmhandle, calllist)
+
+
+
+def remove_files(nmhandle, filelist):
+  calllist = []
+  for filename, filedata in filelist:
+    calllist.append(('DeleteFileInVessel', filename))
+  fastnmclient.nmclient_signedbatchtovessel(nmhandle, calllist)
+
+
+
+# returns the average time a deploy function takes
+def time_deploy(deployfunction, nmhandle, filelist, repetitions):
+  totaltime = 0.0
+  for count in range(repetitions):
+    start = time.time()
+    deployfunction(nmhandle, filelist)
+    totaltime = totaltime + time.time() - start
+    remove_files(nmhandle, filelist)
+  return totaltime / repetitions
+
+
+
+def main():
+  if len(sys.argv) < 6:
+    print __doc__
+    sys.exit(1)
+
+  nmIP = sys.argv[1]
+  nmport = int(sys.argv[2])
+  vesselname = sys.argv[3]
+  publickey = rsa.rsa_file_to_publickey(sys.argv[4])
+  privatekey = rsa.rsa_file_to_privatekey(sys.argv[5])
+
+  numberoffiles = 10
+  filesize = 4096
+  repetitions = 3
+  if len(sys.argv) > 6:
+    numberoffiles = int(sys.argv[6])
+  if len(sys.argv) > 7:
+    filesize = int(sys.argv[7])
+  if len(sys.argv) > 8:
+    repetitions = int(sys.argv[8])
+
+  filelist = []
+  for filenumber in range(numberoffiles):
+    filelist.append(('benchmarkfile'+str(filenumber)+'.r2py', 'x' * filesize))
+
+  # signed requests are timestamped
+  fastnmclient.time.time_updatetime(34612)
+
+  nmhandle = fastnmclient.nmclient_createhandle(nmIP, nmport,
+      publickey=publickey, privatekey=privatekey, vesselid=vesselname)
+
+  try:
+    separatetime = time_deploy(deploy_one_at_a_time, nmhandle, filelist, repetitions)
+    batchtime = time_deploy(deploy_batch, nmhandle, filelist, repetitions)
+  finally:
+    fastnmclient.nmclient_destroyhandle(nmhandle)
+
+  print "Deploying", numberoffiles, "files of", filesize, "bytes (average of", repetitions, "runs)"
+  print "one request per call: %.4f seconds" % separatetime
+  print "one batch request:    %.4f seconds" % batchtime
+  if batchtime > 0:
+    print "speedup:              %.1fx" % (separatetime / batchtime)
+
+
+
+if __name__ == '__main__':
+  main()
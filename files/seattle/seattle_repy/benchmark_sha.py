@@ -0,0 +1,67 @@
+"""
+<Program Name>
+  benchmark_sha.py
+
+<Purpose>
+  Compares the speed of the two SHA-1 backends of sha.r2py: the pure Python
+  implementation (used inside the sandbox) and the native one (hashlib, used
+  outside of the sandbox through repyportability).   It also checks that
+  both produce the same digests.
+
+<Usage>
+  python benchmark_sha.py [datasize_in_bytes] [repetitions]
+"""
+
+import sys
+import time
+
+from repyportability import *
+_context = locals()
+add_dy_support(_context)
+
+sha = dy_import_module("sha.r2py")
+
+
+
+# returns the average time it took to hash data with hasher
+def time_hasher(newhasher, data, repetitions):
+  start = time.time()
+  for count in range(repetitions):
+    hasher = newhasher()
+    hasher.update(data)
+    hasher.hexdigest()
+  return (time.time() - start) / repetitions
+
+
+
+def main():
+  datasize = 1024 * 1024
+  repetitions = 3
+  if len(sys.argv) > 1:
+    datasize = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    repetitions = int(sys.argv[2])
+
+  data = randombytes() * (datasize / 1024 + 1)
+  data = data[:datasize]
+
+  purehasher = sha.sha()
+  purehasher.update(data)
+  nativehasher = sha.sha_new(data)
+  if purehasher.hexdigest() != nativehasher.hexdigest():
+    print "ERROR: the backends disagree about the digest!"
+    sys.exit(1)
+
+  puretime = time_hasher(sha.sha, data, repetitions)
+  nativetime = time_hasher(sha.sha_new, data, repetitions)
+
+  print "Hashing", datasize, "bytes (average of", repetitions, "runs)"
+  print "pure Python: %.6f seconds" % puretime
+  print "native:      %.6f seconds" % nativetime
+  if nativetime > 0:
+    print "speedup:     %.1fx" % (puretime / nativetime)
+
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,170 @@
+"""
+<Program Name>
+  benchmark_zygote.py
+
+<Purpose>
+  Measures the cold-start latency of vessels, first started the way the node
+  manager's StartVessel did before (a new repy.py process) and then through a
+  repy zygote (see repyzygote.py).   For each start it measures how long it
+  takes until the status file says "Started" (which is what StartVessel waits
+  for) and until the program has imported rsa.r2py (and the libraries it
+  imports) through dylink.
+
+  The vessel is a temporary directory which is removed afterwards.
+
+<Usage>
+  python benchmark_zygote.py [repetitions]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import repyzygote
+import statusstorage
+
+
+
+RESTRICTIONS = """resource cpu .50
+resource memory 150000000
+resource diskused 100000000
+resource events 100
+resource filewrite 100000
+resource fileread 1000000
+resource filesopened 50
+resource insockets 50
+resource outsockets 50
+resource netsend 100000
+resource netrecv 100000
+resource loopsend 1000000
+resource looprecv 1000000
+resource lograte 30000
+resource random 1000
+resource messport 12345
+resource connport 12345
+"""
+
+PROGRAM = """rsa = dy_import_module("rsa.r2py")
+donefileobj = openfile("done", True)
+donefileobj.writeat("done", 0)
+donefileobj.close()
+exitall()
+"""
+
+LIBRARIES = ['dylink.r2py', 'rsa.r2py', 'pycryptorsa.r2py', 'random.r2py', 'math.r2py']
+
+
+
+def wait_for(condition, timeout=30):
+  start = time.time()
+  while not condition():
+    if time.time() - start > timeout:
+      print "ERROR: timed out waiting for the vessel!"
+      sys.exit(1)
+    time.sleep(0.001)
+
+
+
+def process_exists(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError:
+    return False
+  return True
+
+
+
+# starts a vessel with startfunction and returns the time until it was
+# started and the time until its program imported rsa.r2py
+def time_start(startfunction, vesseldirectory, runnumber):
+  statusprefix = os.path.join(vesseldirectory, "..", "status" + str(runnumber))
+  donefilename = os.path.join(vesseldirectory, "done")
+  arguments = ["--logfile", os.path.join(vesseldirectory, "..", "log" + str(runnumber)),
+      "--status", statusprefix, "--cwd", vesseldirectory,
+      os.path.join(vesseldirectory, "..", "restrictions"),
+      "dylink.r2py", "program.r2py"]
+
+  start = time.time()
+  has_exited = startfunction(arguments)
+  wait_for(lambda: statusstorage.read_status(statusprefix)[0] is not None)
+  startedtime = time.time() - start
+  wait_for(lambda: os.path.exists(donefilename))
+  importedtime = time.time() - start
+
+  # Let the vessel exit before the next start
+  wait_for(has_exited)
+  os.remove(donefilename)
+  return startedtime, importedtime
+
+
+
+# These start a vessel and return a function that tells if it has exited
+
+def start_process(repydirectory, arguments):
+  # This is how StartVessel starts repy without a zygote
+  proc = subprocess.Popen([sys.executable, os.path.join(repydirectory, "repy.py")] + arguments)
+  return lambda: proc.poll() is not None
+
+
+
+def start_with_zygote(zygote, arguments):
+  pid = zygote.start_repy(arguments)
+  return lambda: not process_exists(pid)
+
+
+
+def main():
+  repetitions = 5
+  if len(sys.argv) > 1:
+    repetitions = int(sys.argv[1])
+
+  repydirectory = os.path.dirname(os.path.abspath(__file__))
+  tempdirectory = tempfile.mkdtemp()
+  vesseldirectory = os.path.join(tempdirectory, "vessel")
+  os.mkdir(vesseldirectory)
+
+  try:
+    restrictionsfileobj = open(os.path.join(tempdirectory, "restrictions"), "w")
+    restrictionsfileobj.write(RESTRICTIONS)
+    restrictionsfileobj.close()
+    programfileobj = open(os.path.join(vesseldirectory, "program.r2py"), "w")
+    programfileobj.write(PROGRAM)
+    programfileobj.close()
+    for library in LIBRARIES:
+      shutil.copy(os.path.join(repydirectory, library), vesseldirectory)
+
+    zygote = repyzygote.RepyZygote(repydirectory,
+        [os.path.join(repydirectory, library) for library in LIBRARIES])
+
+    results = []
+    runnumber = 0
+    for name, startfunction in [
+        ("new repy.py process", lambda arguments: start_process(repydirectory, arguments)),
+        ("repy zygote", lambda arguments: start_with_zygote(zygote, arguments))]:
+      startedtimes = []
+      importedtimes = []
+      for count in range(repetitions):
+        startedtime, importedtime = time_start(startfunction, vesseldirectory, runnumber)
+        runnumber = runnumber + 1
+        startedtimes.append(startedtime)
+        importedtimes.append(importedtime)
+      results.append((name, sum(startedtimes) / repetitions, sum(importedtimes) / repetitions))
+
+    zygote.stop()
+  finally:
+    shutil.rmtree(tempdirectory)
+
+  print "Vessel start latency in seconds (average of", repetitions, "starts)"
+  print "%-22s %10s %20s" % ("", "Started", "imported rsa.r2py")
+  for name, startedtime, importedtime in results:
+    print "%-22s %10.3f %20.3f" % (name, startedtime, importedtime)
+  print "%-22s %9.1fx %19.1fx" % ("speedup", results[0][1] / results[1][1],
+      results[0][2] / results[1][2])
+
+
+
+if __name__ == '__main__':
+  main()
@@ -15,6 +15,12 @@ import socket
 # Armon: Used to check if a socket is ready
 import select
 
+# Used by the readiness reactor for its wakeup pipe
+import os
+
+# Used by the readiness reactor to track waiter deadlines
+import heapq
+
 # socket uses getattr and setattr.   We need to make these available to it...
 socket.getattr = getattr
 socket.setattr = setattr
@@ -84,6 +90,16 @@ user_specified_ip_interface_list = []
 allowediplist = []
 cachelock = threading.Lock()  # This allows only a single simultaneous cache update
 
+# The allowed IP's as a set, for quick membership tests
+allowedipset = frozenset()
+
+# The runtime at which the cache must be refreshed (None before the first update).
+# Until then update_ip_cache does nothing unless the addresses change.
+ip_cache_expiration = None
+
+# Tells us when addresses change (if the OS supports it)
+ip_address_watch = None
+
 
 ##### Internal Functions
 
@@ -99,7 +115,7 @@ def _ip_is_allowed(ip):
   <Returns>
     True, if allowed. False, otherwise.
   """
-  global allowediplist
+  global allowedipset
   global user_ip_interface_preferences
   global allow_nonspecified_ips
   
@@ -108,8 +124,8 @@ def _ip_is_allowed(ip):
   if not user_ip_interface_preferences or allow_nonspecified_ips:
     return True
   
-  # Check the list of allowed IP's
-  return (ip in allowediplist)
+  # Check the set of allowed IP's
+  return (ip in allowedipset)
 
 
 # Only appends the elem to lst if the elem is unique
@@ -117,10 +133,27 @@ def _unique_append(lst, elem):
   if elem not in lst:
     lst.append(elem)
       
+# Tells if the addresses of the interfaces may have changed since the cache
+# was updated
+def _ip_cache_is_stale():
+  if ip_cache_expiration is None or nonportable.getruntime() >= ip_cache_expiration:
+    return True
+
+  if ip_address_watch is not None:
+    return nonportable.os_api.address_watch_has_changes(ip_address_watch)
+
+  return False
+
+
 # This function updates the allowed IP cache
 # It iterates through all possible IP's and stores ones which are bindable as part of the allowediplist
-def update_ip_cache():
+# The cache is only refreshed every IP_CACHE_REFRESH_FREQ seconds (or when the
+# addresses change), unless force is True.
+def update_ip_cache(force=False):
   global allowediplist
+  global allowedipset
+  global ip_cache_expiration
+  global ip_address_watch
   global user_ip_interface_preferences
   global user_specified_ip_interface_list
   global allow_nonspecified_ips
@@ -128,12 +161,19 @@ def update_ip_cache():
   # If there is no preference, this is a no-op
   if not user_ip_interface_preferences:
     return
+
+  if not force and not _ip_cache_is_stale():
+    return
     
   # Acquire the lock to update the cache
   cachelock.acquire()
   
   # If there is any exception release the cachelock
   try:  
+    # Start watching before looking at the interfaces, so that no change is missed
+    if ip_address_watch is None and hasattr(nonportable.os_api, "create_address_watch"):
+      ip_address_watch = nonportable.os_api.create_address_watch()
+
     # Stores the IP's
     allowed_list = []
   
@@ -174,6 +214,8 @@ def update_ip_cache():
   
     # Update the global cache
     allowediplist = bindable_list
+    allowedipset = frozenset(bindable_list)
+    ip_cache_expiration = nonportable.getruntime() + repy_constants.IP_CACHE_REFRESH_FREQ
   
   finally:      
     # Release the lock
@@ -684,7 +726,7 @@ def getmyip():
   # Update the cache and return the first allowed IP
   # Only if a preference is set
   if user_ip_interface_preferences:
-    update_ip_cache()
+    update_ip_cache(force=True)
     # Return the first allowed ip, there is always at least 1 element (loopback)
     return allowediplist[0]
 
@@ -802,6 +844,9 @@ def _cleanup_socket(self):
   if (sock == None):  
     # Already cleaned up
     return
+  # Wake any threads waiting for this socket before it goes away
+  _readiness_reactor.forget(sock)
+
   # Shutdown the socket for writing prior to close
   # to unblock any threads that are writing
   try:
@@ -929,9 +974,9 @@ def sendmessage(destip, destport, message, localip, localport):
 
     # Account for the resources
     if _is_loopback_ipaddr(destip):
-      nanny.tattle_quantity('loopsend', bytessent + 64)
+      nanny.tattle_quantity_batched('loopsend', bytessent + 64)
     else:
-      nanny.tattle_quantity('netsend', bytessent + 64)
+      nanny.tattle_quantity_batched('netsend', bytessent + 64)
 
     return bytessent
 
@@ -962,6 +1007,190 @@ def sendmessage(destip, destport, message, localip, localport):
 
 
 
+# Public interface!!!
+def sendmessages(messagelist, localip, localport):
+  """
+   <Purpose>
+      Send several messages from the same local IP and port.   This acts like
+      calling sendmessage for each message, but the arguments and the local
+      IP and port are checked once for the whole list and the resources are
+      charged once for each second's worth of the loopsend / netsend limit 
+      (this blocks like sendmessage until they are available).
+
+   <Arguments>
+      messagelist:
+         A list of (destip, destport, message) tuples
+      localhost:
+         The local IP to send the messages from
+      localport:
+         The local port to send the messages from
+
+   <Exceptions>
+      The same as sendmessage.   Nothing is sent if any of the messages is
+      not valid.   Errors while sending are only raised if no message could
+      be sent.
+
+   <Side Effects>
+      None.
+
+   <Resource Consumption>
+      This operation consumes 64 bytes + number of bytes of the message for
+      each message that was transmitted. This requires that the localport is
+      allowed.
+
+   <Returns>
+      The number of messages sent.   If sending fails part way through the
+      list (e.g. because the socket would block), this is the number of
+      messages at the start of the list that were sent.
+  """
+  # Check the input arguments (type)
+  if type(messagelist) is not list:
+    raise RepyArgumentError("Provided messagelist must be a list!")
+  if type(localip) is not str:
+    raise RepyArgumentError("Provided localip must be a string!")
+  if type(localport) is not int:
+    raise RepyArgumentError("Provided localport must be an int!")
+
+  # Check the input arguments (sanity)
+  if not _is_valid_ip_address(localip):
+    raise RepyArgumentError("Provided localip is not valid! IP: '"+localip+"'")
+  if not _is_valid_network_port(localport):
+    raise RepyArgumentError("Provided localport is not valid! Port: "+str(localport))
+
+  # Check every message before sending any of them.   This also notes which
+  # messages go to the loopback address.   The messages often go to a few
+  # hosts, so each destip is only checked once (this maps it to whether it
+  # is a loopback address).
+  checkedmessages = []
+  checkeddestips = {}
+  sends_on_loopback = False
+  sends_on_network = False
+  for item in messagelist:
+    if type(item) not in [tuple, list] or len(item) != 3:
+      raise RepyArgumentError("Provided messages must be (destip, destport, message) tuples!")
+    destip, destport, message = item
+
+    if type(destip) is not str:
+      raise RepyArgumentError("Provided destip must be a string!")
+    if type(destport) is not int:
+      raise RepyArgumentError("Provided destport must be an int!")
+    if type(message) is not str:
+      raise RepyArgumentError("Provided message must be a string!")
+
+    if destip in checkeddestips:
+      on_loopback = checkeddestips[destip]
+    else:
+      if not _is_valid_ip_address(destip):
+        raise RepyArgumentError("Provided destip is not valid! IP: '"+destip+"'")
+      on_loopback = _is_loopback_ipaddr(destip)
+      checkeddestips[destip] = on_loopback
+
+    if not _is_valid_network_port(destport):
+      raise RepyArgumentError("Provided destport is not valid! Port: "+str(destport))
+
+    if localip == destip and localport == destport:
+      raise RepyArgumentError("Local socket name cannot match destination socket name! Local/Dest IP and Port match.")
+
+    if on_loopback:
+      sends_on_loopback = True
+    else:
+      sends_on_network = True
+    checkedmessages.append((destip, destport, message, on_loopback))
+
+  # Check the input arguments (permission)
+  update_ip_cache()
+  if not _ip_is_allowed(localip):
+    raise ResourceForbiddenError("Provided localip is not allowed! IP: "+localip)
+
+  if not _is_allowed_localport("UDP", localport):
+    raise ResourceForbiddenError("Provided localport is not allowed! Port: "+str(localport))
+
+  if not checkedmessages:
+    return 0
+
+  # Wait for loopsend / netsend
+  if sends_on_loopback:
+    nanny.tattle_quantity('loopsend', 0)
+  if sends_on_network:
+    nanny.tattle_quantity('netsend', 0)
+
+  # The number of messages sent and the bytes to charge for them
+  sentcount = 0
+  loopsendbytes = 0
+  netsendbytes = 0
+
+  try:
+    sock = None
+
+    if ("UDP", localip, localport) in _BOUND_SOCKETS:
+      sock = _BOUND_SOCKETS[("UDP", localip, localport)]
+    else:
+      # Get the socket
+      sock = _get_udp_socket(localip, localport)
+      # Register this socket with nanny
+      nanny.tattle_add_item("outsockets", id(sock))
+
+    # Send the messages.   Once a second's worth of the limit was sent, it is
+    # charged right away (which waits until it drained), so a long list is
+    # not sent faster than the limit allows.
+    loopsendlimit = nanny.get_resource_limit('loopsend')
+    netsendlimit = nanny.get_resource_limit('netsend')
+    for destip, destport, message, on_loopback in checkedmessages:
+      bytessent = sock.sendto(message, (destip, destport))
+      sentcount = sentcount + 1
+      if on_loopback:
+        loopsendbytes = loopsendbytes + bytessent + 64
+        if loopsendbytes >= loopsendlimit:
+          chargedbytes = loopsendbytes
+          loopsendbytes = 0
+          nanny.tattle_quantity('loopsend', chargedbytes)
+      else:
+        netsendbytes = netsendbytes + bytessent + 64
+        if netsendbytes >= netsendlimit:
+          chargedbytes = netsendbytes
+          netsendbytes = 0
+          nanny.tattle_quantity('netsend', chargedbytes)
+
+    return sentcount
+
+  except Exception, e:
+    # Report how many messages were sent.   The caller can retry the rest,
+    # which will raise the error if it persists.
+    if sentcount > 0:
+      return sentcount
+
+    try:
+      # If we're borrowing the socket, closing is not appropriate.
+      if not ("UDP", localip, localport) in _BOUND_SOCKETS:
+        sock.close()
+    except:
+      pass
+
+    # Check if address is already in use
+    if _is_addr_in_use_exception(e):
+      raise DuplicateTupleError("Provided Local IP and Local Port is already in use!")
+
+    if _is_addr_unavailable_exception(e):
+      raise AddressBindingError("Cannot bind to the specified local ip, invalid!")
+    # Complain if the network is down for UDP, too
+    # (See SeattleTestbed/repy_v2#80 for details)
+    if _is_network_down_exception(e):
+      raise InternetConnectivityError("The network is down or cannot be reached from the local IP!")
+
+    # Unknown error...
+    else:
+      raise
+
+  finally:
+    # Account for the resources of the messages that were sent
+    if loopsendbytes:
+      nanny.tattle_quantity_batched('loopsend', loopsendbytes)
+    if netsendbytes:
+      nanny.tattle_quantity_batched('netsend', netsendbytes)
+
+
+
+
 # Public interface!!!
 def listenformessage(localip, localport):
   """
@@ -1593,6 +1822,437 @@ def _check_socket_state(realsock, waitfor="rw", timeout=0.0):
   return (realsock not in readable, realsock not in writeable)
 
 
+
+##### Socket readiness reactor
+
+# Threads that are waiting for a socket to become readable or writable
+# register with a single shared epoll object instead of each polling their
+# socket.   A reactor thread blocks in epoll and wakes the waiters of a socket
+# through the socket's condition as soon as the kernel reports readiness.
+# The reactor also owns the waiters' deadlines, so that waiters never need a
+# timed Condition.wait() (which polls in python 2).
+#
+# On platforms without epoll, waiters fall back to a blocking select() on
+# their own socket through _check_socket_state.
+
+if hasattr(select, "epoll"):
+  _EPOLL_READ = select.EPOLLIN | select.EPOLLPRI
+  _EPOLL_WRITE = select.EPOLLOUT
+  _EPOLL_ERROR = select.EPOLLERR | select.EPOLLHUP
+  _EPOLL_ONESHOT = select.EPOLLONESHOT
+  _epoll_available = True
+else:
+  _epoll_available = False
+
+# Once there are this many deadlines in the heap, and most of them belong to
+# waiters that are already done, the heap is rebuilt.
+_REACTOR_DEADLINE_COMPACT_SIZE = 64
+
+
+class _SocketReadinessWaiter(object):
+  """
+  A single thread waiting for readiness of a socket.
+  """
+  # Fields:
+  # entry: the _SocketReadinessEntry of the socket being waited on
+  # mask: the epoll events the thread is interested in
+  # deadline: the runtime at which the wait times out
+  # status: None while waiting, then "ready" or "timeout"
+  __slots__ = ["entry", "mask", "deadline", "status"]
+
+  def __init__(self, entry, mask, deadline):
+    self.entry = entry
+    self.mask = mask
+    self.deadline = deadline
+    self.status = None
+
+
+
+class _SocketReadinessEntry(object):
+  """
+  The per-socket state kept by the reactor.
+  """
+  # Fields:
+  # fd: the file descriptor of the socket
+  # condition: notified whenever a waiter of this socket is done
+  # waiters: list of _SocketReadinessWaiter objects still waiting
+  # registered: True if fd is registered with the epoll object
+  __slots__ = ["fd", "condition", "waiters", "registered"]
+
+  def __init__(self, fd):
+    self.fd = fd
+    self.condition = threading.Condition(threading.Lock())
+    self.waiters = []
+    self.registered = False
+
+
+
+class _SocketReadinessReactor(object):
+  """
+  <Purpose>
+    Shares one epoll object between all emulated sockets and wakes the
+    threads waiting on a socket as soon as it becomes ready.
+
+  <Side Effects>
+    Starts a daemon thread on the first call to start() or wait().
+  """
+  # Fields:
+  # poller: the shared select.epoll object
+  # entries: maps a file descriptor to its _SocketReadinessEntry
+  # deadlines: heap of (deadline, id, waiter) for the pending waiters
+  # pendingcount: the number of waiters that are not done yet
+  # lock: protects all of the above.   It must be acquired before the
+  #       condition of any entry, never after.
+  # wakeup_read, wakeup_write: a pipe used to interrupt the epoll wait
+  # wakeup_pending: True if a wakeup byte was written and not yet read
+  # thread: the reactor thread
+
+  def __init__(self):
+    self.poller = None
+    self.entries = {}
+    self.deadlines = []
+    self.pendingcount = 0
+    self.lock = threading.Lock()
+    self.wakeup_read = None
+    self.wakeup_write = None
+    self.wakeup_pending = False
+    self.thread = None
+
+
+  def start(self):
+    """
+    <Purpose>
+      Starts the reactor thread if it isn't running.   This is also needed
+      after a fork, since threads do not survive it.
+
+    <Returns>
+      None
+    """
+    if not _epoll_available:
+      return
+
+    self.lock.acquire()
+    try:
+      if self.thread is not None and self.thread.isAlive():
+        return
+
+      # Any state from before a fork is useless now
+      self.poller = select.epoll()
+      self.entries = {}
+      self.deadlines = []
+      self.pendingcount = 0
+      (self.wakeup_read, self.wakeup_write) = os.pipe()
+      self.wakeup_pending = False
+      self.poller.register(self.wakeup_read, select.EPOLLIN)
+
+      self.thread = threading.Thread(target=self._run, name="SocketReadinessReactor")
+      self.thread.setDaemon(True)
+      self.thread.start()
+    finally:
+      self.lock.release()
+
+
+  def wait(self, realsock, waitfor, timeout):
+    """
+    <Purpose>
+      Blocks until the given socket is ready, or the timeout expires.
+
+    <Arguments>
+      realsock:
+              A real socket.socket() object to wait for.
+
+      waitfor:
+              "r" to wait for the socket to be readable, "w" to wait for it
+              to be writable, and "rw" for either.
+
+      timeout:
+              The maximum number of seconds to wait.
+
+    <Exceptions>
+      As with socket.fileno() and select.epoll.modify().
+
+    <Returns>
+      True if the socket is ready (or has an error pending), False if the
+      timeout expired first.
+    """
+    if not _epoll_available:
+      (read_will_block, write_will_block) = _check_socket_state(realsock, waitfor, timeout)
+      return not (read_will_block and write_will_block)
+
+    mask = 0
+    if "r" in waitfor:
+      mask = mask | _EPOLL_READ
+    if "w" in waitfor:
+      mask = mask | _EPOLL_WRITE
+
+    fd = realsock.fileno()
+    self.start()
+
+    self.lock.acquire()
+    try:
+      entry = self.entries.get(fd)
+      if entry is None:
+        entry = _SocketReadinessEntry(fd)
+        self.entries[fd] = entry
+
+      waiter = _SocketReadinessWaiter(entry, mask, nonportable.getruntime() + timeout)
+      entry.waiters.append(waiter)
+      self.pendingcount = self.pendingcount + 1
+      heapq.heappush(self.deadlines, (waiter.deadline, id(waiter), waiter))
+
+      try:
+        self._arm(entry)
+      except:
+        self._finish(waiter, "ready")
+        raise
+
+      # The reactor has to recompute its timeout if we are the earliest
+      if self.deadlines[0][2] is waiter:
+        self._wakeup()
+    finally:
+      self.lock.release()
+
+    # Wait for the reactor to tell us we are done
+    condition = entry.condition
+    condition.acquire()
+    try:
+      while waiter.status is None:
+        condition.wait()
+    finally:
+      condition.release()
+
+    return waiter.status == "ready"
+
+
+  def forget(self, realsock):
+    """
+    <Purpose>
+      Stops watching a socket that is about to be closed.   Any threads
+      waiting on it are woken up as ready, so that their next operation
+      reports the close.
+
+    <Arguments>
+      realsock:
+              A real socket.socket() object that has not been closed yet.
+
+    <Returns>
+      None
+    """
+    if not _epoll_available or self.poller is None:
+      return
+
+    try:
+      fd = realsock.fileno()
+    except socket.error:
+      return
+
+    self.lock.acquire()
+    try:
+      entry = self.entries.get(fd)
+      if entry is None:
+        return
+      del self.entries[fd]
+
+      if entry.registered:
+        try:
+          self.poller.unregister(fd)
+        except (IOError, OSError):
+          pass
+
+      for waiter in entry.waiters[:]:
+        self._finish(waiter, "ready")
+    finally:
+      self.lock.release()
+
+
+  def _arm(self, entry):
+    # Re-enables the one-shot epoll registration of the entry with the
+    # union of the events its waiters want.   Called with self.lock held.
+    mask = 0
+    for waiter in entry.waiters:
+      mask = mask | waiter.mask
+
+    if mask == 0:
+      return
+
+    if entry.registered:
+      try:
+        self.poller.modify(entry.fd, mask | _EPOLL_ONESHOT)
+        return
+      except (IOError, OSError), e:
+        # If the descriptor was closed and reused behind our back, the
+        # kernel already dropped the old registration
+        if e.errno != errno.ENOENT:
+          raise
+        entry.registered = False
+
+    self.poller.register(entry.fd, mask | _EPOLL_ONESHOT)
+    entry.registered = True
+
+
+  def _finish(self, waiter, status):
+    # Marks a waiter as done and wakes it.   Called with self.lock held.
+    entry = waiter.entry
+    entry.condition.acquire()
+    try:
+      if waiter.status is not None:
+        return
+      waiter.status = status
+      entry.waiters.remove(waiter)
+      self.pendingcount = self.pendingcount - 1
+      entry.condition.notifyAll()
+    finally:
+      entry.condition.release()
+
+
+  def _wakeup(self):
+    # Interrupts the epoll wait of the reactor thread.   Called with
+    # self.lock held.
+    if not self.wakeup_pending:
+      self.wakeup_pending = True
+      os.write(self.wakeup_write, "x")
+
+
+  def _next_timeout(self, now):
+    # Returns the epoll timeout until the earliest pending deadline,
+    # discarding the deadlines of waiters that are done.   Called with
+    # self.lock held.
+    deadlines = self.deadlines
+
+    if len(deadlines) > _REACTOR_DEADLINE_COMPACT_SIZE and len(deadlines) > 2 * self.pendingcount:
+      compacted = []
+      for item in deadlines:
+        if item[2].status is None:
+          compacted.append(item)
+      heapq.heapify(compacted)
+      self.deadlines = deadlines = compacted
+
+    while deadlines and deadlines[0][2].status is not None:
+      heapq.heappop(deadlines)
+
+    if not deadlines:
+      return -1
+
+    return max(0.0, deadlines[0][0] - now)
+
+
+  def _run(self):
+    # The reactor loop
+    while True:
+      self.lock.acquire()
+      try:
+        poller = self.poller
+        timeout = self._next_timeout(nonportable.getruntime())
+      finally:
+        self.lock.release()
+
+      try:
+        events = poller.poll(timeout)
+      except (IOError, OSError), e:
+        if e.errno == errno.EINTR:
+          continue
+        raise
+
+      self.lock.acquire()
+      try:
+        for (fd, eventmask) in events:
+          if fd == self.wakeup_read:
+            os.read(self.wakeup_read, 1)
+            self.wakeup_pending = False
+            continue
+
+          entry = self.entries.get(fd)
+          if entry is None:
+            continue
+
+          # A socket with an error pending is ready for anything, like in
+          # _check_socket_state
+          if eventmask & _EPOLL_ERROR:
+            eventmask = eventmask | _EPOLL_READ | _EPOLL_WRITE
+
+          for waiter in entry.waiters[:]:
+            if waiter.mask & eventmask:
+              self._finish(waiter, "ready")
+
+          # The one-shot registration is disabled now.   Re-arm it for the
+          # waiters that are still interested in other events.
+          try:
+            self._arm(entry)
+          except (IOError, OSError):
+            for waiter in entry.waiters[:]:
+              self._finish(waiter, "ready")
+
+        # Time out the waiters whose deadline has passed
+        now = nonportable.getruntime()
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+          (deadline, waiterid, waiter) = heapq.heappop(deadlines)
+          self._finish(waiter, "timeout")
+
+      finally:
+        self.lock.release()
+
+
+
+# The reactor shared by all emulated sockets
+_readiness_reactor = _SocketReadinessReactor()
+
+
+def start_readiness_reactor():
+  """
+  <Purpose>
+    Starts the socket readiness reactor thread ahead of time.   repy.py
+    calls this before running the user program so that the reactor is not
+    counted as a pending event of the program.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    None
+  """
+  _readiness_reactor.start()
+
+
+def _wait_for_socket(emulsocket, waitfor, timeout):
+  """
+  <Purpose>
+    Blocks until the socket of an EmulatedSocket, UDPServerSocket or
+    TCPServerSocket is ready or the timeout expires.   No resources are
+    charged for waiting.
+
+  <Arguments>
+    emulsocket:
+              The emulated socket object.
+
+    waitfor:
+              "r" or "w", as with _SocketReadinessReactor.wait().
+
+    timeout:
+              The maximum number of seconds to wait.
+
+  <Exceptions>
+    SocketClosedLocal if the socket was closed locally.
+
+  <Returns>
+    True if the next operation on the socket may not block, False if the
+    timeout expired.
+  """
+  sock = emulsocket.socketobj
+  if sock is None:
+    raise SocketClosedLocal("The socket is closed!")
+
+  try:
+    return _readiness_reactor.wait(sock, waitfor, timeout)
+  except (socket.error, select.error, IOError, OSError):
+    # The socket was probably closed under us.   Let the next operation on
+    # it report what happened.
+    return True
+
+
 ##### Class Definitions
 
 # Public.   We pass these to the users for communication purposes
@@ -1786,11 +2446,11 @@ class EmulatedSocket:
         raise SocketClosedRemote("The socket has been closed remotely!")
 
       if self.on_loopback:
-        nanny.tattle_quantity('looprecv',data_length+64)
-        nanny.tattle_quantity('loopsend',64)
+        nanny.tattle_quantity_batched('looprecv',data_length+64)
+        nanny.tattle_quantity_batched('loopsend',64)
       else:
-        nanny.tattle_quantity('netrecv',data_length+64)
-        nanny.tattle_quantity('netsend',64)
+        nanny.tattle_quantity_batched('netrecv',data_length+64)
+        nanny.tattle_quantity_batched('netsend',64)
 
       return data_recieved
 
@@ -1885,11 +2545,11 @@ class EmulatedSocket:
       bytes_sent = sock.send(message)
       
       if self.on_loopback:
-        nanny.tattle_quantity('looprecv', 64)
-        nanny.tattle_quantity('loopsend', 64 + bytes_sent)
+        nanny.tattle_quantity_batched('looprecv', 64)
+        nanny.tattle_quantity_batched('loopsend', 64 + bytes_sent)
       else:
-        nanny.tattle_quantity('netrecv', 64)
-        nanny.tattle_quantity('netsend', 64 + bytes_sent)
+        nanny.tattle_quantity_batched('netrecv', 64)
+        nanny.tattle_quantity_batched('netsend', 64 + bytes_sent)
 
       # Return the number of bytes sent
       return bytes_sent
@@ -1919,6 +2579,62 @@ class EmulatedSocket:
       socket_lock.release()
 
 
+
+  def waitforrecv(self, timeout):
+    """
+      <Purpose>
+        Waits until a recv() on this socket would not block.   This is meant
+        to be called after recv() raised SocketWouldBlockError, instead of
+        sleeping and retrying.
+
+      <Arguments>
+        timeout:
+          The maximum number of seconds to wait.
+
+      <Exceptions>
+        SocketClosedLocal is raised if the socket was closed locally.
+
+      <Side Effects>
+        None.
+
+      <Resource Consumption>
+        None.   The following recv() is charged as usual.
+
+      <Returns>
+        True if recv() may now be called without blocking, False if the
+        timeout expired first.
+    """
+    return _wait_for_socket(self, "r", timeout)
+
+
+
+  def waitforsend(self, timeout):
+    """
+      <Purpose>
+        Waits until a send() on this socket would not block.   This is meant
+        to be called after send() raised SocketWouldBlockError, instead of
+        sleeping and retrying.
+
+      <Arguments>
+        timeout:
+          The maximum number of seconds to wait.
+
+      <Exceptions>
+        SocketClosedLocal is raised if the socket was closed locally.
+
+      <Side Effects>
+        None.
+
+      <Resource Consumption>
+        None.   The following send() is charged as usual.
+
+      <Returns>
+        True if send() may now be called without blocking, False if the
+        timeout expired first.
+    """
+    return _wait_for_socket(self, "w", timeout)
+
+
   def __del__(self):
     # Get the socket lock
     try:
@@ -2035,9 +2751,9 @@ class UDPServerSocket:
 
       # Do some resource accounting
       if self.on_loopback:
-        nanny.tattle_quantity('looprecv', 64 + len(message))
+        nanny.tattle_quantity_batched('looprecv', 64 + len(message))
       else:
-        nanny.tattle_quantity('netrecv', 64 + len(message))
+        nanny.tattle_quantity_batched('netrecv', 64 + len(message))
 
       # Return everything
       return (remote_ip, remote_port, message)
@@ -2066,6 +2782,136 @@ class UDPServerSocket:
 
 
 
+  def getmessages(self, maxcount):
+    """
+    <Purpose>
+        Obtains the incoming messages that are available, up to maxcount of
+        them.   This acts like calling getmessage until it would block, but
+        the lock is taken and the resources are charged once.   No more 
+        messages are received once they use a second's worth of the 
+        looprecv / netrecv limit, so that the next call waits for it.
+
+    <Arguments>
+        maxcount:
+            The maximum number of messages to return.
+
+    <Exceptions>
+        SocketClosedLocal if UDPServerSocket.close() was called.
+        Raises SocketWouldBlockError if no message is available.
+
+    <Side Effects>
+        None
+
+    <Resource Consumption>
+        This operation consumes 64 + size of message bytes of netrecv for
+        each message
+
+    <Returns>
+        A list of tuples consisting of the remote IP, remote port, and
+        message, in the order the messages were received.
+    """
+    if type(maxcount) is not int or maxcount < 1:
+      raise RepyArgumentError("Provided maxcount must be a positive int!")
+
+    # Get the socket lock
+    socket_lock = self.sock_lock
+    # Wait for netrecv resources
+    if self.on_loopback:
+      nanny.tattle_quantity('looprecv',0)
+    else:
+      nanny.tattle_quantity('netrecv',0)
+
+    # The received messages and the bytes to charge for them
+    messages = []
+    receivedbytes = 0
+    if self.on_loopback:
+      recvlimit = nanny.get_resource_limit('looprecv')
+    else:
+      recvlimit = nanny.get_resource_limit('netrecv')
+
+    # Acquire the lock
+    socket_lock.acquire()
+    try:
+      mysocketobj = self.socketobj
+      if mysocketobj is None:
+        raise KeyError # Indicates socket is closed
+
+      try:
+        while len(messages) < maxcount:
+          # (64K is the max that fits in the UDP header)
+          message, addr = mysocketobj.recvfrom(65535)
+          remote_ip, remote_port = addr
+          messages.append((remote_ip, remote_port, message))
+          receivedbytes = receivedbytes + 64 + len(message)
+          if receivedbytes >= recvlimit:
+            break
+
+      except Exception, e:
+        # Return the messages we have once no more are available
+        if not messages or not _is_recoverable_network_exception(e):
+          raise
+
+      return messages
+
+    except KeyError:
+      # Socket is closed
+      raise SocketClosedLocal("The socket has been closed!")
+
+    except RepyException:
+      # Let these through from the inner block
+      raise
+
+    except Exception, e:
+      # Check if this is a would-block error
+      if _is_recoverable_network_exception(e):
+        raise SocketWouldBlockError("No messages currently available!")
+
+      else:
+        # Unexpected, close the socket, and then raise SocketClosedLocal
+        _cleanup_socket(self)
+        raise SocketClosedLocal("Unexpected error, socket closed!")
+
+    finally:
+      # Do the resource accounting for the messages received
+      if receivedbytes:
+        if self.on_loopback:
+          nanny.tattle_quantity_batched('looprecv', receivedbytes)
+        else:
+          nanny.tattle_quantity_batched('netrecv', receivedbytes)
+
+      # Release the lock
+      socket_lock.release()
+
+
+
+  def waitformessage(self, timeout):
+    """
+    <Purpose>
+        Waits until a message is available for getmessage().   This is meant
+        to be called after getmessage() raised SocketWouldBlockError, instead
+        of sleeping and retrying.
+
+    <Arguments>
+        timeout:
+            The maximum number of seconds to wait.
+
+    <Exceptions>
+        SocketClosedLocal if UDPServerSocket.close() was called.
+
+    <Side Effects>
+        None
+
+    <Resource Consumption>
+        None.   The following getmessage() is charged as usual.
+
+    <Returns>
+        True if getmessage() may now be called without blocking, False if the
+        timeout expired first.
+    """
+    return _wait_for_socket(self, "r", timeout)
+
+
+
   def close(self):
     """
     <Purpose>
@@ -2261,6 +3107,30 @@ class TCPServerSocket (object):
       socket_lock.release()
 
 
+  def waitforconnection(self, timeout):
+    """
+    <Purpose>
+      Waits until an incoming connection is available for getconnection().
+      This is meant to be called after getconnection() raised
+      SocketWouldBlockError, instead of sleeping and retrying.
+
+    <Arguments>
+      timeout:
+        The maximum number of seconds to wait.
+
+    <Exceptions>
+      Raises SocketClosedLocal if close() has been called.
+
+    <Resource Consumption>
+      None.   The following getconnection() is charged as usual.
+
+    <Returns>
+      True if getconnection() may now be called without blocking, False if
+      the timeout expired first.
+    """
+    return _wait_for_socket(self, "r", timeout)
+
+
   def close(self):
     """
     <Purpose>
@@ -118,7 +118,8 @@ def createthread(function):
       tracebackrepy.handle_exception()
       harshexit.harshexit(30)
     finally: 
-      # Remove the event before I exit
+      # Charge what this thread used, and remove the event before I exit
+      nanny.flush_pending_charges()
       nanny.tattle_remove_item('events',eventhandle)
 
   # Create a thread object
@@ -65,6 +65,11 @@ time = dy_import_module("time.r2py")
 class NMClientException(Exception):
   pass
 
+# Thrown when the node manager didn't answer in time.   It may still be
+# working on the request.
+class NMClientTimeoutException(NMClientException):
+  pass
+
 # This holds all of the client handles.   A client handle is merely a 
 # string that is the key to this dict.   All of the information is stored in
 # the dictionary value (a dict with keys for IP, port, sessionID, timestamp,
@@ -77,19 +82,36 @@ nmclient_handledictlock = createlock()
 
 
 
-# Note: I open a new connection for every request.   Is this really what I want
-# to do?   It seemed easiest but likely has performance implications
+# Connections to a node manager are kept open after a request and reused for
+# later requests on the same handle.   This saves a TCP handshake (and a slot
+# in the node manager's accept queue) per request.   The node manager closes
+# connections that are idle for a few seconds, so we drop ours a bit sooner.
+#
+# This maps a handle to a list of idle connections.   Each entry is a list 
+# [connobject, IP, port, lastusedtime].
+nmclient_connectionpool = {}
+
+# protects nmclient_connectionpool
+nmclient_connectionpoollock = createlock()
+
+# Idle connections older than this (in seconds) are closed instead of reused.
+# This must be lower than the node manager's KEEPALIVE_IDLE_TIMEOUT (see
+# nmconnectionmanager).
+nmclient_connectionidletime = 2.0
+
+# The most idle connections kept for a single handle
+nmclient_maxidleconnections = 2
 
-# Sends data to a node (opens the connection, writes the 
-# communication header, sends all the data, receives the result, and returns
-# the result)...
-def nmclient_rawcommunicate(nmhandle, *args):
+
+
+# Opens a new connection to the node manager of a handle
+def _nmclient_openconnection(nmhandle):
 
   # the node is behind a nat and using nat layer
   if 'natlayermac' in nmclient_handledict[nmhandle]:
     try:
       # add 5 to timeout for nat delay
-      thisconnobject = nat_openconn(nmclient_handledict[nmhandle]['natlayermac'],nmclient_handledict[nmhandle]['port'],timeout=nmclient_handledict[nmhandle]['timeout']+5,usetimeoutsock=True) 
+      return nat_openconn(nmclient_handledict[nmhandle]['natlayermac'],nmclient_handledict[nmhandle]['port'],timeout=nmclient_handledict[nmhandle]['timeout']+5,usetimeoutsock=True) 
     except Exception, e:
       raise NMClientException, str(e)
   
@@ -97,28 +119,151 @@ def nmclient_rawcommunicate(nmhandle, *args):
   else:
     # do the normal openconn
     try:
-      thisconnobject = sockettimeout.timeout_openconnection(nmclient_handledict[nmhandle]['IP'], nmclient_handledict[nmhandle]['port'],timeout=nmclient_handledict[nmhandle]['timeout']) 
+      return sockettimeout.timeout_openconnection(nmclient_handledict[nmhandle]['IP'], nmclient_handledict[nmhandle]['port'],timeout=nmclient_handledict[nmhandle]['timeout']) 
     except Exception, e:
       raise NMClientException, str(e)
 
-  
-  # always close the connobject
+
+
+# Returns an idle connection of the handle, or None if there is none that is
+# recent enough.   Stale connections are closed.
+def _nmclient_getidleconnection(nmhandle):
+  nmclient_connectionpoollock.acquire(True)
+  try:
+    if nmhandle not in nmclient_connectionpool:
+      return None
+
+    idleconnections = nmclient_connectionpool[nmhandle]
+    while idleconnections:
+      connobject, IP, port, lastusedtime = idleconnections.pop()
+
+      # The handle may have been changed to point elsewhere
+      if getruntime() - lastusedtime < nmclient_connectionidletime and \
+          IP == nmclient_handledict[nmhandle]['IP'] and \
+          port == nmclient_handledict[nmhandle]['port']:
+        return connobject
+
+      connobject.close()
+
+    return None
+  finally:
+    nmclient_connectionpoollock.release()
+
+
+
+# Makes a connection available for later requests on the handle
+def _nmclient_releaseconnection(nmhandle, connobject):
+  nmclient_connectionpoollock.acquire(True)
+  try:
+    # the handle may have been destroyed in the meantime
+    if nmhandle in nmclient_handledict:
+      if nmhandle not in nmclient_connectionpool:
+        nmclient_connectionpool[nmhandle] = []
+
+      idleconnections = nmclient_connectionpool[nmhandle]
+      if len(idleconnections) < nmclient_maxidleconnections:
+        idleconnections.append([connobject, nmclient_handledict[nmhandle]['IP'], nmclient_handledict[nmhandle]['port'], getruntime()])
+        return
+
+    connobject.close()
+  finally:
+    nmclient_connectionpoollock.release()
+
+
+
+# Closes all of the idle connections of a handle
+def _nmclient_closeidleconnections(nmhandle):
+  nmclient_connectionpoollock.acquire(True)
   try:
+    if nmhandle in nmclient_connectionpool:
+      for idleconnection in nmclient_connectionpool[nmhandle]:
+        idleconnection[0].close()
+      del nmclient_connectionpool[nmhandle]
+  finally:
+    nmclient_connectionpoollock.release()
 
-    # send the args separated by '|' chars (as is expected by the node manager)
-    session.session_sendmessage(thisconnobject, '|'.join(args))
+
+
+# Raises e as an NMClientException (an NMClientTimeoutException if it is a
+# timeout).   If errorlabel is given, it is used to describe where the 
+# failure happened.
+def _nmclient_raiseerror(e, errorlabel, functionname):
+  if isinstance(e, sockettimeout.SocketTimeoutError):
+    exceptiontype = NMClientTimeoutException
+  else:
+    exceptiontype = NMClientException
+
+  if errorlabel:
+    # label the exception and change the type...
+    raise exceptiontype, errorlabel+" failed on "+functionname+" with error '"+str(e)+"'"
+  raise exceptiontype, str(e)
+
+
+
+# Sends a message on a connection and returns the response.   If errorlabel
+# is given, it is used to describe where a failure happened.
+def _nmclient_sendandreceive(thisconnobject, datatosend, errorlabel):
+  try:
+    session.session_sendmessage(thisconnobject, datatosend)
+  except Exception, e:
+    _nmclient_raiseerror(e, errorlabel, "session_sendmessage")
+
+  try:
     return session.session_recvmessage(thisconnobject)
   except Exception, e:
-    raise NMClientException, str(e)
-  finally:
+    _nmclient_raiseerror(e, errorlabel, "session_recvmessage")
+
+
+
+# Sends a message to a node and returns the response, reusing an idle
+# connection if possible.
+def _nmclient_communicate(nmhandle, datatosend, errorlabel=None):
+
+  thisconnobject = _nmclient_getidleconnection(nmhandle)
+  if thisconnobject is not None:
+    try:
+      response = _nmclient_sendandreceive(thisconnobject, datatosend, errorlabel)
+    except NMClientTimeoutException:
+      # The node manager may still be working on the request, so it must 
+      # not be sent again.
+      thisconnobject.close()
+      raise
+    except NMClientException:
+      # Otherwise the node manager closed the connection while it was idle
+      # (or it is an older version that closes after every request), and 
+      # we try again on a new connection.
+      thisconnobject.close()
+    else:
+      _nmclient_releaseconnection(nmhandle, thisconnobject)
+      return response
+
+
+  thisconnobject = _nmclient_openconnection(nmhandle)
+
+  try:
+    response = _nmclient_sendandreceive(thisconnobject, datatosend, errorlabel)
+  except:
     thisconnobject.close()
+    raise
+
+  _nmclient_releaseconnection(nmhandle, thisconnobject)
+  return response
+
 
 
 
+# Sends data to a node (writes the communication header, sends all the data, 
+# receives the result, and returns the result)...
+def nmclient_rawcommunicate(nmhandle, *args):
+
+  # send the args separated by '|' chars (as is expected by the node manager)
+  return _nmclient_communicate(nmhandle, '|'.join(args))
+
 
-# Sends data to a node (opens the connection, writes the 
-# communication header, sends all the data, receives the result, and returns
-# the result)...
+
+
+# Sends data to a node (writes the communication header, sends all the data, 
+# receives the result, and returns the result)...
 def nmclient_signedcommunicate(nmhandle, *args):
   
   # need to check lots of the nmhandle settings...
@@ -169,47 +314,13 @@ def nmclient_signedcommunicate(nmhandle, *args):
     datatosend = datatosend + '|' + str(arg)
   
 
-  # Sign first before opening the connection to prevent connections from idling
+  # Sign first before sending to prevent connections from idling
   try:
     signeddata = fastsigneddata.signeddata_signdata(datatosend, privatekey, publickey, timestamp, expirationtime, sequenceid, identity)
   except ValueError, e:
     raise NMClientException, str(e)
 
-
-  # the node is behind a nat
-  if 'natlayermac' in nmclient_handledict[nmhandle]:
-    try:
-      # add 5 to timeout for nat delay
-      thisconnobject = nat_openconn(nmclient_handledict[nmhandle]['natlayermac'], nmclient_handledict[nmhandle]['port'],timeout=nmclient_handledict[nmhandle]['timeout']+5,usetimeoutsock=True) 
-    except Exception, e:
-      raise NMClientException, str(e)
-  
-  # not a natlayer conn
-  else:  
-
-    try:
-      thisconnobject = sockettimeout.timeout_openconnection(nmclient_handledict[nmhandle]['IP'], nmclient_handledict[nmhandle]['port'], timeout=nmclient_handledict[nmhandle]['timeout'])
-    except Exception, e:
-      raise NMClientException, str(e)
-
-  
-  # always close the connobject afterwards...
-  try:
-    try:
-      session.session_sendmessage(thisconnobject, signeddata)
-    except Exception, e:
-      # label the exception and change the type...
-      raise NMClientException, "signedcommunicate failed on session_sendmessage with error '"+str(e)+"'"
-
-    try:
-      message = session.session_recvmessage(thisconnobject)
-    except Exception, e:
-      # label the exception and change the type...
-      raise NMClientException, "signedcommunicate failed on session_recvmessage with error '"+str(e)+"'"
-
-    return message
-  finally:
-    thisconnobject.close()
+  return _nmclient_communicate(nmhandle, signeddata, "signedcommunicate")
 
 
 
@@ -271,7 +382,7 @@ def nmclient_createhandle(nmIP, nmport, sequenceid = None, timestamp=True, ident
     response = nmclient_rawsay(newhandle, 'GetVessels')
 
   except (ValueError, NMClientException, KeyError), e:
-    del nmclient_handledict[newhandle]
+    nmclient_destroyhandle(newhandle)
     raise NMClientException, e
 
 
@@ -284,7 +395,7 @@ def nmclient_createhandle(nmIP, nmport, sequenceid = None, timestamp=True, ident
         break
         
     else:
-      del nmclient_handledict[newhandle]
+      nmclient_destroyhandle(newhandle)
       raise NMClientException, "Do not understand node manager identity in identification"
 
   else:
@@ -306,6 +417,7 @@ def nmclient_destroyhandle(nmhandle):
     del nmclient_handledict[nmhandle]
   except KeyError:
     return False
+  _nmclient_closeidleconnections(nmhandle)
   return True
   
 
@@ -385,6 +497,63 @@ def nmclient_signedsaytovessel(nmhandle, call, *args):
   return nmclient_signedsay(nmhandle,call, vesselid,*args)
 
 
+# public, runs several signed calls on the handle's vessel using one signed
+# request (see VesselBatch in nmrequesthandler).   calllist is a list of
+# tuples like ('AddFileToVessel', filename, filedata) (the vessel name is 
+# added by the node manager).   Returns a list with the output of each call.
+# If any call fails, NMClientException is raised.   The calls before it in
+# calllist have been performed, the ones after it have not.
+def nmclient_signedbatchtovessel(nmhandle, calllist):
+  vesselid = nmclient_handledict[nmhandle]['vesselid']
+  if not vesselid:
+    raise NMClientException, "Must set vesselid to communicate with a vessel"
+
+  encodedcalls = []
+  for call in calllist:
+    callstring = '|'.join(map(str, call))
+    encodedcalls.append(str(len(callstring)) + ':' + callstring)
+
+  fullresponse = nmclient_signedcommunicate(nmhandle, 'VesselBatch', vesselid, ''.join(encodedcalls))
+
+  try:
+    (response, status) = fullresponse.rsplit('\n',1)
+  except ValueError:
+    raise NMClientException, "Communication error '"+fullresponse+"'"
+
+  if status not in ['Success', 'Error']:
+    raise NMClientException, "Unknown status '"+fullresponse+"'"
+
+  # the response is a list of '<length>:<call output>' items.   If the batch 
+  # was rejected as a whole it is just the reason.
+  resultlist = []
+  position = 0
+  try:
+    while position < len(response):
+      separatorposition = response.index(':', position)
+      resultend = separatorposition + 1 + int(response[position:separatorposition])
+      if resultend > len(response):
+        raise ValueError("Truncated result")
+      resultlist.append(response[separatorposition+1:resultend])
+      position = resultend
+  except ValueError:
+    if status == 'Error':
+      raise NMClientException, "Node Manager error '"+response+"'"
+    raise NMClientException, "Communication error '"+fullresponse+"'"
+
+  if status == 'Error':
+    if not resultlist:
+      raise NMClientException, "Node Manager error '"+response+"'"
+    (failure, junkstatus) = resultlist[-1].rsplit('\n',1)
+    raise NMClientException, "Node Manager error in call "+str(len(resultlist))+" of batch '"+failure+"'"
+
+  # strip the status of each call just like nmclient_signedsay does
+  outputlist = []
+  for result in resultlist:
+    outputlist.append(result.rsplit('\n',1)[0])
+  return outputlist
+
+
+
 # public, lists the vessels that the provided key owns or can use
 def nmclient_listaccessiblevessels(nmhandle, publickey):
 
@@ -37,6 +37,10 @@ osrealtype = None
 # global   (the purpose of this is described below)
 statusexiting = [False]
 
+# Functions that are called (without arguments) when we start exiting, e.g.
+# to write out buffered data.   They should not block for long.
+exit_functions = []
+
 
 
 class UnsupportedSystemException(Exception):
@@ -88,6 +92,14 @@ def harshexit(val):
     # do this once (now)
     statusexiting[0] = True
 
+    # let others finish up (e.g. write out buffered data) before the status
+    # says we are done
+    for exitfunction in exit_functions:
+      try:
+        exitfunction()
+      except:
+        pass
+
     # prevent concurrent writes to status info (acquire the lock to stop others,
     # but do not block...
     statuslock.acquire()
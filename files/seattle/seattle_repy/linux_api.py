@@ -10,6 +10,13 @@ Description:
 """
 
 import os           # Provides some convenience functions
+import errno        # Tells which socket errors mean there is nothing to read
+import select       # Waits for inotify events
+import ctypes       # Allows us to make C calls
+import ctypes.util  # Helps to find the realtime library
+import fcntl        # Gets the address of interfaces
+import socket       # Gets the address of interfaces and watches for changes
+import struct       # Packs the request for the address of an interface
 
 import nix_common_api as nix_api # Import the Common API
 
@@ -41,6 +48,7 @@ last_stat_data = None   # Store the last array of data from _get_proc_info_by_pi
 
 # Constants
 JIFFIES_PER_SECOND = 100.0
+CLOCK_MONOTONIC = 1     # From <linux/time.h>
 PAGE_SIZE = os.sysconf('SC_PAGESIZE')
 
 # Get the thread id of the currently executing thread
@@ -196,6 +204,48 @@ def get_process_rss(force_update=False, pid=None):
   return rss_bytes
 
 
+def get_process_mapped_file_rss(pid, directory):
+  """
+  <Purpose>
+    Returns how much of the Resident Set Size of a process is made of pages
+    of the files in a directory that the process mapped into memory.
+
+  <Arguments>
+    pid:
+      The process identifier of the process.
+
+    directory:
+      The directory the files are in (or in a subdirectory of).
+
+  <Returns>
+    The size of the resident pages of the mappings in bytes.
+  """
+  # smaps has a header line for each mapping (which ends with the path of the
+  # mapped file) followed by "Name: value" lines, including its Rss in kB.
+  directory = os.path.join(os.path.realpath(directory), "")
+
+  fileobj = myopen("/proc/"+str(pid)+"/smaps", "r")
+  try:
+    smaps_data = fileobj.read()
+  finally:
+    fileobj.close()
+
+  rss_kb = 0
+  in_directory = False
+  for line in smaps_data.splitlines():
+    fields = line.split(None, 5)
+    if len(fields) == 0:
+      continue
+
+    if not fields[0].endswith(":"):
+      # A new mapping
+      in_directory = len(fields) == 6 and fields[5].startswith(directory)
+    elif in_directory and fields[0] == "Rss:":
+      rss_kb = rss_kb + int(fields[1])
+
+  return rss_kb * 1024
+
+
 # Get the id of the currently executing thread
 def _get_current_thread_id():
   # Syscall for GETTID
@@ -264,6 +314,54 @@ def get_system_uptime():
   else:
     raise Exception, "Could not find /proc/uptime!"
   
+# Matches struct timespec from <time.h>
+class _timespec(ctypes.Structure):
+  _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+# Find clock_gettime.   Older versions of glibc only provide it in librt.
+def _find_clock_gettime():
+  try:
+    return libc.clock_gettime
+  except AttributeError:
+    pass
+
+  try:
+    return ctypes.CDLL(ctypes.util.find_library("rt")).clock_gettime
+  except (OSError, TypeError, AttributeError):
+    return None
+
+_clock_gettime = _find_clock_gettime()
+if _clock_gettime is not None:
+  _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+
+def get_monotonic_time():
+  """
+  <Purpose>
+    Returns the time of the CLOCK_MONOTONIC clock.   This clock is not
+    affected by changes to the system time (e.g. by NTP), never goes
+    backwards and does not require any file I/O.
+
+  <Exception>
+    Raises Exception if CLOCK_MONOTONIC is unavailable
+
+  <Returns>
+    The time in seconds as a float.   It has no defined starting point, so
+    it is only useful to compute time differences.
+  """
+  if _clock_gettime is None:
+    raise Exception, "Could not find clock_gettime!"
+
+  # Use a new structure each call, so this is safe to call from many threads
+  # without locking
+  timespec = _timespec()
+  if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+    raise Exception, "clock_gettime failed! Error: "+nix_api.get_ctypes_error_str()
+
+  return timespec.tv_sec + timespec.tv_nsec / 1000000000.0
+
+
 def get_uptime_granularity():
   """
   <Purpose>
@@ -319,6 +417,12 @@ def get_system_thread_count():
 
 
 
+# ioctl to get the address of an interface (see netdevice(7))
+SIOCGIFADDR = 0x8915
+
+# Interfaces names are at most 15 characters long (plus the NUL)
+IFNAMSIZ = 16
+
 def get_interface_ip_addresses(interfaceName):
   """
   <Purpose>
@@ -328,32 +432,164 @@ def get_interface_ip_addresses(interfaceName):
     interfaceName: The string name of the interface, e.g. eth0
   
   <Returns>
-    A list of IP addresses associated with the interface.
+    A list of IP addresses associated with the interface.   This has the
+    (primary) IPv4 address of the interface, or is empty if the interface
+    does not exist or has no address.
   """
 
-  # Launch up a shell, get the feed back
-  # We use ifconfig with the interface name.
-  ifconfig_process = portable_popen.Popen(["/sbin/ifconfig", interfaceName.strip()])
+  # Ask the kernel rather than running ifconfig
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    try:
+      ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFADDR,
+          struct.pack('256s', interfaceName.strip()[:IFNAMSIZ-1]))
+    except IOError:
+      return []
+  finally:
+    sock.close()
 
-  ifconfig_output, _ = ifconfig_process.communicate()
-  ifconfig_lines = textops.textops_rawtexttolines(ifconfig_output)
-  
-  # Look for ipv4 addresses
-  target_lines = textops.textops_grep("inet", ifconfig_lines)
-  # and not ipv6
-  target_lines = textops.textops_grep("inet6", target_lines, exclude=True)
+  # The address is a struct sockaddr_in after the interface name
+  return [socket.inet_ntoa(ifreq[IFNAMSIZ+4:IFNAMSIZ+8])]
 
-  # Only take the ip(s)
-  target_lines = textops.textops_cut(target_lines, delimiter=":", fields=[1])
-  target_lines = textops.textops_cut(target_lines, delimiter=" ", fields=[0])
 
-  # Create an array for the ip's
-  ipaddressList = []
-  
-  for line in target_lines:
-     # Strip the newline and any spacing
-     line = line.strip("\n\t ")
-     ipaddressList.append(line)
 
-  # Done, return the interfaces
-  return ipaddressList
+# The netlink multicast group for IPv4 address changes (see rtnetlink(7))
+RTMGRP_IPV4_IFADDR = 0x10
+
+def create_address_watch():
+  """
+  <Purpose>
+    Uses a netlink socket to watch for IPv4 addresses that are added to or
+    removed from interfaces.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.
+
+  <Returns>
+    A socket for address_watch_has_changes(), or None if netlink is not
+    available.
+  """
+  try:
+    # Protocol 0 is NETLINK_ROUTE
+    watchsock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0)
+  except (AttributeError, socket.error):
+    return None
+
+  try:
+    watchsock.bind((0, RTMGRP_IPV4_IFADDR))
+  except socket.error:
+    watchsock.close()
+    return None
+
+  return watchsock
+
+
+def address_watch_has_changes(watchsock):
+  """
+  <Purpose>
+    Tells if addresses changed since the last call, without blocking.
+
+  <Arguments>
+    watchsock: The socket returned by create_address_watch()
+
+  <Exceptions>
+    None.
+
+  <Returns>
+    True if there was a change (or if the watch failed), False otherwise.
+  """
+  changed = False
+  # Discard the pending messages, the caller will look for itself
+  while True:
+    try:
+      watchsock.recv(65536, socket.MSG_DONTWAIT)
+    except socket.error, e:
+      if e[0] == errno.EAGAIN or e[0] == errno.EWOULDBLOCK:
+        return changed
+      # Messages were lost (ENOBUFS) or the socket broke
+      return True
+    changed = True
+
+
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+
+def create_directory_watch(directory):
+  """
+  <Purpose>
+    Uses inotify to watch for files that are written or renamed into a
+    directory.
+
+  <Arguments>
+    directory: The directory to watch.
+
+  <Exceptions>
+    None.
+
+  <Returns>
+    A file descriptor for wait_for_directory_watch(), or None if inotify
+    is not available.
+  """
+  try:
+    watchfd = libc.inotify_init()
+  except AttributeError:
+    # Old C libraries don't have inotify
+    return None
+
+  if watchfd < 0:
+    return None
+
+  if libc.inotify_add_watch(watchfd, directory, IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+    os.close(watchfd)
+    return None
+
+  return watchfd
+
+
+def wait_for_directory_watch(watchfd, timeout):
+  """
+  <Purpose>
+    Waits until a file is written or renamed into the watched directory.
+
+  <Arguments>
+    watchfd: The file descriptor returned by create_directory_watch()
+    timeout: The maximum amount of time to wait (in seconds).
+
+  <Exceptions>
+    None.
+
+  <Returns>
+    True if there was a change, False if the timeout expired.
+  """
+  try:
+    (readable, junk, junk) = select.select([watchfd], [], [], timeout)
+  except select.error:
+    # Interrupted, let the caller check again
+    return True
+
+  if not readable:
+    return False
+
+  # Discard the pending events, the caller will look for itself
+  os.read(watchfd, 4096)
+  return True
+
+
+def close_directory_watch(watchfd):
+  """
+  <Purpose>
+    Stops watching a directory.
+
+  <Arguments>
+    watchfd: The file descriptor returned by create_directory_watch()
+
+  <Returns>
+    None.
+  """
+  os.close(watchfd)
@@ -13,11 +13,52 @@
 import nanny
 import loggingrepy_core
 
+# Used to write out the log buffers when repy exits
+import harshexit
+
+# Get the buffer size and flush frequency of the log
+import repy_constants
+
 
 get_size = loggingrepy_core.get_size
 myfile = loggingrepy_core.myfile
 
 
+
+def start_log_flusher():
+  """
+  <Purpose>
+    Starts the thread that writes out the buffers of the circular loggers
+    periodically.   repy.py calls this before running the user program so
+    that the thread is not counted as a pending event of the program.   The
+    buffers are also written out when repy exits through harshexit.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    None
+  """
+  # The buffering is turned off
+  if repy_constants.LOG_BUFFER_SIZE <= 0:
+    return
+
+  loggingrepy_core.start_log_flusher(repy_constants.LOG_FLUSH_FREQ)
+
+  if _flush_buffered_loggers_at_exit not in harshexit.exit_functions:
+    harshexit.exit_functions.append(_flush_buffered_loggers_at_exit)
+
+
+
+def _flush_buffered_loggers_at_exit():
+  # harshexit calls this.   Exiting must not wait long for a log in use.
+  loggingrepy_core.flush_buffered_loggers(timeout=1)
+
+
+
 class flush_logger(loggingrepy_core.flush_logger_core):
   """
     A file-like class that can be used in lieu of stdout.   It always flushes
@@ -34,7 +75,7 @@ class flush_logger(loggingrepy_core.flush_logger_core):
 
     # block if over after log write
     writeamt = len(str(writeitem))
-    nanny.tattle_quantity('lograte', writeamt)
+    nanny.tattle_quantity_batched('lograte', writeamt)
 
 
   def writelines(self, writelist):
@@ -48,7 +89,7 @@ class flush_logger(loggingrepy_core.flush_logger_core):
     writeamt = 0
     for writeitem in writelist:
       writeamt = writeamt + len(str(writeitem))
-    nanny.tattle_quantity('lograte', writeamt)
+    nanny.tattle_quantity_batched('lograte', writeamt)
 
 
 
@@ -71,52 +112,53 @@ class circular_logger(loggingrepy_core.circular_logger_core):
   """
 
 
-  def __init__(self, fnp, mbs = 16*1024, use_nanny=True):
-    loggingrepy_core.circular_logger_core.__init__(self, fnp, mbs)
+  def __init__(self, fnp, mbs = 16*1024, use_nanny=True, buffersize=0):
+    loggingrepy_core.circular_logger_core.__init__(self, fnp, mbs, buffersize)
 
     # Should we be using the nanny to limit the lograte
     self.should_nanny = use_nanny
 
 
+  # The nanny is invoked without holding the writelock, so that a thread that
+  # waits for lograte doesn't keep others from writing out the buffer.
+
   def write(self, writeitem):
     # they / we can always log info (or else what happens on exception?)
 
+    if self.should_nanny:
+      # Only invoke the nanny if the should_nanny flag is set.
+      # block if already over
+      nanny.tattle_quantity('lograte',0)
+
     # acquire (and release later no matter what)
     self.writelock.acquire()
     try:
-      if self.should_nanny:
-        # Only invoke the nanny if the should_nanny flag is set.
-        # block if already over
-        nanny.tattle_quantity('lograte',0)
-
       writeamt = self.writedata(writeitem)
-
-      if self.should_nanny:
-        # Only invoke the nanny if the should_nanny flag is set.
-        nanny.tattle_quantity('lograte',writeamt)
-
     finally:
       self.writelock.release()
 
+    if self.should_nanny:
+      # Only invoke the nanny if the should_nanny flag is set.
+      nanny.tattle_quantity_batched('lograte',writeamt)
+
 
   def writelines(self, writelist):
     # we / they can always log info (or else what happens on exception?)
 
+    if self.should_nanny:
+      # Only invoke the nanny if the should_nanny flag is set.
+      # block if already over
+      nanny.tattle_quantity('lograte',0)
+
     # acquire (and release later no matter what)
     self.writelock.acquire()
     try:
-      if self.should_nanny:
-        # Only invoke the nanny if the should_nanny flag is set.
-        # block if already over
-        nanny.tattle_quantity('lograte',0)
-  
       writeamt = 0
       for writeitem in writelist:
         writeamt = writeamt + self.writedata(writeitem)
-
-      if self.should_nanny:
-        # Only invoke the nanny if the should_nanny flag is set.
-        nanny.tattle_quantity('lograte',writeamt)
-  
     finally:
       self.writelock.release()
+
+    if self.should_nanny:
+      # Only invoke the nanny if the should_nanny flag is set.
+      nanny.tattle_quantity_batched('lograte',writeamt)
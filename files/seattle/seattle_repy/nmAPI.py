@@ -65,6 +65,17 @@ prog_platform_dir = {'repyv1' : 'repyV1',
                      'repyv2' : 'repyV2'
                      }
 
+# If the 'repy_zygote' option of nodeman.cfg is set, vessels are started
+# through a zygote process for each platform (see repyzygote.py), which
+# preloads these libraries (or those in the 'repy_zygote_modules' option).
+default_zygote_modules = ['dylink.r2py', 'rsa.r2py', 'pycryptorsa.r2py',
+    'random.r2py', 'math.r2py', 'sha.r2py', 'serialize.r2py', 'time.r2py',
+    'ntp_time.r2py', 'tcp_time.r2py', 'time_interface.r2py']
+
+# The running zygotes, by platform.   zygotelock is held while one is started.
+repyzygotes = {}
+zygotelock = threading.Lock()
+
 
 # need this to check uploaded keys for validity
 def rsa_is_valid_publickey(key):
@@ -193,6 +204,9 @@ import nonportable
 # import for Popen
 import portable_popen
 
+# to start repy through a zygote process
+import repyzygote
+
 offcutfilename = "resources.offcut"
 
 # The node information (reported to interested clients)
@@ -233,7 +247,13 @@ maxownerstringlength = 256
 # last thing to be updated.   Since all actions that are performed on existing
 # files are either atomic or read-only, there is no danger of corruption of
 # the disk state.
+#
+# Several worker threads handle requests at the same time (requests for the
+# same vessel are serialized by the request handler).   vesseldictlock must be
+# held while vessels are added or removed, while iterating over the 
+# vesseldict, and while writing it to disk.
 vesseldict = {}
+vesseldictlock = threading.RLock()
 
 
 def initialize(name, pubkey, version):
@@ -255,7 +275,25 @@ def initialize(name, pubkey, version):
   return vesseldict
 
 
+# Private.   Writes the vesseldict to disk.
+def _commit_vesseldict():
+  vesseldictlock.acquire()
+  try:
+    persist.commit_object(vesseldict, "vesseldict")
+  finally:
+    vesseldictlock.release()
+
+
+
 def getvessels():
+  vesseldictlock.acquire()
+  try:
+    return _getvessels()
+  finally:
+    vesseldictlock.release()
+
+
+def _getvessels():
   # Returns vessel information
   # start with the node name, etc.
   vesselstring = "Version: "+nodeversion+"\n"
@@ -368,6 +406,23 @@ def startvessel_ex(vesselname, prog_platform, argstring):
         ip_iface_preference_flags.append("--nootherips")
         ip_iface_preference_str += "--nootherips "
     
+  # The safety of the vessel's code can be checked in the repy process (which
+  # saves starting safe_check.py processes on small devices).   Only repyV2
+  # has the option.
+  safe_check_flags = []
+  if prog_platform == 'repyv2' and configuration.get('repy_safe_check_in_process', False):
+    safe_check_flags.append("--safecheckinprocess")
+
+  # The bytecode of repy's libraries is only cached if nodeman.cfg asks for
+  # it, since some nodes should not write to their install
+  bytecode_cache_flags = []
+  if prog_platform == 'repyv2' and configuration.get('repy_bytecode_cache', None):
+    bytecode_cache_flags.extend(["--bytecodecache",
+        os.path.abspath(configuration['repy_bytecode_cache'])])
+    if 'repy_bytecode_cache_size' in configuration:
+      bytecode_cache_flags.extend(["--bytecodecachesize",
+          str(configuration['repy_bytecode_cache_size'])])
+
   # Find the location where the sandbox files is located. Location of repyV1, repyV2 etc.
   prog_platform_location = os.path.join(prog_platform_dir[prog_platform], "repy.py")
  
@@ -376,7 +431,7 @@ def startvessel_ex(vesselname, prog_platform, argstring):
   
   # Conrad: switched this to sequence-style Popen invocation so that spaces
   # in files work. Switched it back to absolute paths.
-  command = [sys.executable, prog_platform_location] + ip_iface_preference_flags + [
+  command = [sys.executable, prog_platform_location] + ip_iface_preference_flags + safe_check_flags + bytecode_cache_flags + [
       "--logfile", os.path.abspath(vesseldict[vesselname]['logfilename']),
       "--stop",    os.path.abspath(vesseldict[vesselname]['stopfilename']),
       "--status",  os.path.abspath(vesseldict[vesselname]['statusfilename']),
@@ -385,26 +440,34 @@ def startvessel_ex(vesselname, prog_platform, argstring):
       "--execinfo",
       os.path.abspath(vesseldict[vesselname]['resourcefilename'])] + argstring.split()
 
-  portable_popen.Popen(command)
+  # Watch for status updates (where supported) before starting, so that we
+  # notice the first one right away.
+  statuswatch = statusstorage.create_status_watch(vesseldict[vesselname]['statusfilename'])
 
+  try:
+    _start_repy(prog_platform, command, configuration)
 
-  starttime = nonportable.getruntime()
 
-  # wait for 10 seconds for it to start (else return an error)
-  while nonportable.getruntime()-starttime < 10:
-    newstatus, newtimestamp = statusstorage.read_status(vesseldict[vesselname]['statusfilename'])
-    # Great!   The timestamp was updated...   The new status is the result of 
-    # our work.   Let's tell the user what happened...
-    if newtimestamp != oldtimestamp and newstatus != None:
-      break
+    starttime = nonportable.getruntime()
 
-    
+    # wait for 10 seconds for it to start (else return an error)
+    while nonportable.getruntime()-starttime < 10:
+      newstatus, newtimestamp = statusstorage.read_status(vesseldict[vesselname]['statusfilename'])
+      # Great!   The timestamp was updated...   The new status is the result of 
+      # our work.   Let's tell the user what happened...
+      if newtimestamp != oldtimestamp and newstatus != None:
+        break
 
-    # sleep while busy waiting...
-    time.sleep(.5)
+      
 
-  else:
-    return "Did not start in a timely manner\nWarning"
+      # wait for an update (or sleep while busy waiting...)
+      statusstorage.wait_for_status_update(statuswatch, .5)
+
+    else:
+      return "Did not start in a timely manner\nWarning"
+
+  finally:
+    statusstorage.close_status_watch(statuswatch)
 
   # We need to update the status in the table because the status thread might
   # not notice this before our next request... (else occasional failures on XP)
@@ -418,6 +481,33 @@ def startvessel_ex(vesselname, prog_platform, argstring):
 
     
 
+# Private.   Starts repy with the command, through the platform's zygote if
+# they are enabled.
+def _start_repy(prog_platform, command, configuration):
+  if configuration.get('repy_zygote', False) and repyzygote.is_supported():
+    try:
+      zygotelock.acquire()
+      try:
+        if prog_platform not in repyzygotes or not repyzygotes[prog_platform].is_running():
+          modulelist = configuration.get('repy_zygote_modules', default_zygote_modules)
+          repyzygotes[prog_platform] = repyzygote.RepyZygote(
+              prog_platform_dir[prog_platform], modulelist)
+        zygote = repyzygotes[prog_platform]
+      finally:
+        zygotelock.release()
+
+      # The zygote runs the repy.py of the command
+      zygote.start_repy(command[2:])
+      return
+    except Exception, e:
+      # Start repy the usual way
+      servicelogger.log("[WARNING]: Failed to start repy through the zygote: " + str(e))
+
+  portable_popen.Popen(command)
+
+
+
+
 # Armon: Takes an optional exitparams tuple, which should contain
 # an integer exit code and a string message,
 # e.g. (44,'') is the default and represents exiting with status
@@ -704,7 +794,7 @@ def changeowner(vesselname, newkeystring):
   # Reset the advertise flag so the owner can find the node...
   vesseldict[vesselname]['advertise'] = True
 
-  persist.commit_object(vesseldict, "vesseldict")
+  _commit_vesseldict()
   return "\nSuccess"
   
 
@@ -730,7 +820,7 @@ def changeusers(vesselname, listofkeysstring):
 
   vesseldict[vesselname]['userkeys'] = newkeylist
     
-  persist.commit_object(vesseldict, "vesseldict")
+  _commit_vesseldict()
   return "\nSuccess"
 
 def changeownerinformation(vesselname, ownerstring):
@@ -744,7 +834,7 @@ def changeownerinformation(vesselname, ownerstring):
 
   vesseldict[vesselname]['ownerinformation'] = ownerstring
 
-  persist.commit_object(vesseldict, "vesseldict")
+  _commit_vesseldict()
   return "\nSuccess"
   
 
@@ -761,7 +851,7 @@ def changeadvertise(vesselname, setting):
   else: 
     raise BadRequest("Invalid advertisement setting '"+setting+"'")
 
-  persist.commit_object(vesseldict, "vesseldict")
+  _commit_vesseldict()
   return "\nSuccess"
 
 
@@ -787,12 +877,12 @@ def get_new_vessel_name():
 
 
 # Private.   Creates a new vessel's state in the dictionary and on disk
-def _setup_vessel(vesselname, examplevessel, resourcedict, call_list):
+def _setup_vessel(vesselname, examplevessel, resourcedict, call_list, burstdict=None):
   if vesselname in vesseldict:
     raise Exception, "Internal Error, setting up vessel '"+vesselname+"' already in vesseldict"
 
   # write the new resource file
-  resourcemanipulation.write_resourcedict_to_file(resourcedict, 'resource.'+vesselname, call_list)
+  resourcemanipulation.write_resourcedict_to_file(resourcedict, 'resource.'+vesselname, call_list, burstdict)
 
   # Set the invariants up...
   item = {}
@@ -857,6 +947,15 @@ def _destroy_vessel(vesselname):
 
 
 def splitvessel(vesselname, resourcedata):
+  # this adds and removes vessels
+  vesseldictlock.acquire()
+  try:
+    return _splitvessel(vesselname, resourcedata)
+  finally:
+    vesseldictlock.release()
+
+
+def _splitvessel(vesselname, resourcedata):
   if vesselname not in vesseldict:
     raise BadRequest, "No such vessel"
   
@@ -890,13 +989,18 @@ def splitvessel(vesselname, resourcedata):
   except resourcemanipulation.ResourceMathError, e:
     raise BadRequest('Proposed vessel is too large.\n'+str(e))
 
+  # The burst sizes are relative to the limits, so both vessels keep the 
+  # ones of the vessel they are split from.   (Burst lines in resourcedata
+  # are ignored.)
+  burstdict = resourcemanipulation.read_burstdict_from_file(vesseldict[vesselname]['resourcefilename'])
+
   # newname1 becomes the leftovers...
-  _setup_vessel(newname1, vesselname, finalresourcedict, call_list_vessel)
+  _setup_vessel(newname1, vesselname, finalresourcedict, call_list_vessel, burstdict)
   # newname2 is what the user requested
-  _setup_vessel(newname2, vesselname, proposedresourcedict, call_list_vessel)
+  _setup_vessel(newname2, vesselname, proposedresourcedict, call_list_vessel, burstdict)
   _destroy_vessel(vesselname)
     
-  persist.commit_object(vesseldict, "vesseldict")
+  _commit_vesseldict()
   return newname1+" "+newname2+"\nSuccess"
 
     
@@ -904,6 +1008,15 @@ def splitvessel(vesselname, resourcedata):
   
 
 def joinvessels(vesselname1, vesselname2):
+  # this adds and removes vessels
+  vesseldictlock.acquire()
+  try:
+    return _joinvessels(vesselname1, vesselname2)
+  finally:
+    vesseldictlock.release()
+
+
+def _joinvessels(vesselname1, vesselname2):
   if vesselname1 not in vesseldict:
     raise BadRequest, "No such vessel '"+vesselname1+"'"
   if vesselname2 not in vesseldict:
@@ -929,14 +1042,18 @@ def joinvessels(vesselname1, vesselname2):
 
   finalresourcedict = resourcemanipulation.add_resourcedicts(intermediateresourcedict, offcutresourcedict)
 
+  burstdict1 = resourcemanipulation.read_burstdict_from_file(vesseldict[vesselname1]['resourcefilename'])
+  burstdict2 = resourcemanipulation.read_burstdict_from_file(vesseldict[vesselname2]['resourcefilename'])
+  finalburstdict = resourcemanipulation.join_burstdicts(burstdict1, burstdict2)
+
   # MMM: We add in the call list of resources from one of the original 
   # resource file. Since this is for backward compatibility for Repy V1,
   # it does not matter which call list we add in to the final resource file.
-  _setup_vessel(newname, vesselname1, finalresourcedict, call_list_v1)
+  _setup_vessel(newname, vesselname1, finalresourcedict, call_list_v1, finalburstdict)
   _destroy_vessel(vesselname1)
   _destroy_vessel(vesselname2)
     
-  persist.commit_object(vesseldict, "vesseldict")
+  _commit_vesseldict()
   return newname+"\nSuccess"
 
     
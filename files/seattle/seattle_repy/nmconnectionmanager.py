@@ -3,7 +3,8 @@ Author: Justin Cappos
 
 Module: Node Manager connection handling.   This does everything up to handling
         a request (i.e. accept connections, handle the order they should be
-        processed in, etc.)   Requests will be handled one at a time.
+        processed in, etc.)   Requests are handled by a small pool of worker
+        threads.
 
 Start date: August 28th, 2008
 
@@ -20,20 +21,27 @@ connections from a single source.   This callback places valid connections into
 an ordered list.   This callback handles meta information like sceduling 
 requests and preventing DOS attacks that target admission.
 
-Another thread (the worker thread) processes the first element in the list.  
-The worker thread is responsible for handling an individual request.   This
+A pool of worker threads processes the list.   Each worker removes the first
+element and is responsible for handling that individual request.   This
 ensures that the request is validly signed, prevents slow connections from 
 clogging the request stream, etc.
 
-
-Right now I ensure that only one worker thread is active at a time.   In the 
-future, it would be possible to have multiple threads that are performing 
-disjoint operations to proceed in parallel.   This may allow starvation attacks
-if it involves reordering the list of connections.   As a result, it is punted 
-to future work.
-
-I'm going to use "polling" by the worker thread.   I'll sleep when the 
-list is empty and periodically look to see if a new element was added.
+Workers always take the next connection in the fair order described below, so
+having several of them does not let one source starve the others.   A single
+slow request (like a large file upload) no longer holds up everyone else
+though.   Requests that touch the same vessel are serialized by the request
+handler so workers only proceed in parallel on disjoint vessels.
+
+Idle workers block on a condition variable that is notified whenever a 
+connection is added to the list, so there is no polling.
+
+Clients may send several requests on one connection.   After a worker answered
+a request, the connection is handed to the idle connection thread, which
+waits (with select) until one of the idle connections has the start of a new
+request.
+A connection with a new request goes to the back of the list like a new
+connection (so it is scheduled fairly with the others), one that stays idle
+for too long is closed.   No worker is tied up waiting for a client.
 """
 
 # Need to have a separate threads for the worker and the accepter
@@ -42,6 +50,15 @@ import threading
 # need to get connections, etc.
 import socket
 
+# for waiting until an idle connection has a new request
+import select
+
+# to find the real socket of a connection
+import emulcomm
+
+# the pending connections are kept in deques so that scheduling is O(1)
+from collections import deque
+
 # needed for sleep
 import time
 
@@ -60,47 +77,83 @@ add_dy_support(_context)
 
 dy_import_module_symbols("sockettimeout.r2py")
 
-connectionlock = createlock()
+# for reading the start of a request on an idle connection
+session = dy_import_module("session.r2py")
+
+# Protects connection_dict, connection_IP_order and total_connection_count.
+# It is notified every time a connection is added so that idle workers wake up.
+connectioncondition = threading.Condition(threading.Lock())
+
+# The number of worker threads that is used if nodeman.cfg doesn't specify one
+DEFAULT_WORKER_THREAD_COUNT = 4
+
+# Connections are rejected once a single IP has more than this many pending...
+DEFAULT_MAX_CONNECTIONS_PER_IP = 3
+# ...or once more than this many are pending in total.
+DEFAULT_MAX_CONNECTIONS = 100
+
+max_connections_per_IP = DEFAULT_MAX_CONNECTIONS_PER_IP
+max_connections = DEFAULT_MAX_CONNECTIONS
+
+# Connections that were idle this long (in seconds) after a request are
+# closed.   Clients (see fastnmclient) stop reusing them a bit sooner.
+KEEPALIVE_IDLE_TIMEOUT = 3
+
+# How often (in seconds) idle connections are checked for a new request if
+# their real socket can't be found to wait for it
+IDLE_CHECK_INTERVAL = 0.02
+
+
+# sets the limits above (nodeman.cfg may override the defaults)
+def set_connection_limits(maxperIP, maxtotal):
+  global max_connections_per_IP
+  global max_connections
+  max_connections_per_IP = maxperIP
+  max_connections = maxtotal
   
 
-def connection_handler(IP, port, socketobject):
+# received is the start of the next request if it was already read (for
+# connections that were idle, see IdleConnectionThread)
+def connection_handler(IP, port, socketobject, received=''):
+  global total_connection_count
  
   # prevent races when adding connection information...   We don't process
   # the connections here, we just categorize them...
-  connectionlock.acquire(True)
+  connectioncondition.acquire()
  
   # always release the lock...
   try:
-    # it's not in the list, let's initialize!
-    if IP not in connection_dict_order:
-      connection_dict_order.append(IP)
-      connection_dict[IP] = []
-
     # we're rejecting lots of connections from the same IP to limit DOS by 
     # grabbing lots of connections
-    if len(connection_dict[IP]) > 3:
+    if IP in connection_dict and len(connection_dict[IP]) > max_connections_per_IP:
       # Armon: Avoid leaking sockets
       socketobject.close()
       return
 
-    # don't allow more than 100 connections regardless of source...
-    if _get_total_connection_count() > 100:
+    # don't allow too many connections regardless of source...
+    if total_connection_count > max_connections:
       socketobject.close()
       return
 
-    # we should add this connection to the list
-    connection_dict[IP].append(socketobject)
+    # it's not in the dict, let's initialize!   It goes to the back of the
+    # line behind the IPs that are already waiting.
+    if IP not in connection_dict:
+      connection_dict[IP] = deque()
+      connection_IP_order.append(IP)
+
+    # we should add this connection to the IP's queue
+    connection_dict[IP].append((socketobject, received))
+    total_connection_count = total_connection_count + 1
+
+    # ...and let an idle worker know there is something to do
+    connectioncondition.notify()
 
   finally:
-    connectionlock.release()
+    connectioncondition.release()
 
 
 def _get_total_connection_count():
-  totalconnections = 0
-  for srcIP in connection_dict:
-    totalconnections = totalconnections + len(connection_dict[srcIP])
-
-  return totalconnections
+  return total_connection_count
 
 
 
@@ -125,7 +178,9 @@ class AccepterThread(threading.Thread):
       except SocketWouldBlockError:
         sleep(0.5)
       except SocketTimeoutError:
-        sleep(0.5)
+        # getconnection() already waited for a connection for its whole
+        # timeout, so there is no need to sleep before trying again
+        pass
       except Exception, e:
         servicelogger.log("FATAL error in AccepterThread: " + 
             traceback.format_exc())
@@ -148,77 +203,256 @@ class AccepterThread(threading.Thread):
 # handled after the first IP3.   If IP2 adds a request, it should go in the 
 # third to last position.   IP3 cannot currently queue another request since 
 # it has 3 pending.
+#
+# This is round robin over the IPs (deficit round robin where every request 
+# costs the same).   Every operation on the structures below is O(1), so the
+# node manager stays responsive when hundreds of clients connect at once.
 
 
 
-# This is a list that has the order connections should be handled in.   This
-# list contains IP addresses (corresponding to the keys in the connection_dict)
-connection_dict_order = []
+# This is a deque that has the order IPs should be handled in.   Each IP
+# with pending connections (i.e. each key in the connection_dict) is in it
+# exactly once.
+connection_IP_order = deque()
 
-# this is dictionary that contains a list per IP.   Each key in the dict 
-# maps to a list of connections that are pending for that IP.
+# this is dictionary that contains a deque per IP.   Each key in the dict 
+# maps to the connections that are pending for that IP (oldest first).   The
+# items are tuples (socketobject, received), see connection_handler.
 connection_dict = {}
 
+# the number of connections in all of the deques in connection_dict
+total_connection_count = 0
 
 
-# get the first request
+
+# get the first request.   Blocks until there is one.   Returns the IP, the
+# connection and the part of the request that was already read.
 def pop_request():
+  global total_connection_count
 
   # Acquire a lock to prevent a race (#993)...
-  connectionlock.acquire(True)
+  connectioncondition.acquire()
 
   # ...but always release it.
   try:
-    if len(connection_dict)==0:
-      raise ValueError, "Internal Error: Popping a request for an empty connection_dict"
+    # wait() releases the lock while we sleep, so connection_handler can add
+    # a connection and wake us up.
+    while len(connection_dict)==0:
+      connectioncondition.wait()
 
-    # get the first item of the connection_dict_order... 
-    nextIP = connection_dict_order[0]
-    del connection_dict_order[0]
+    # get the IP at the front of the line... 
+    nextIP = connection_IP_order.popleft()
 
-    # ...and the first item of this list
-    therequest = connection_dict[nextIP][0]
-    del connection_dict[nextIP][0]
+    # ...and its oldest connection
+    socketobject, received = connection_dict[nextIP].popleft()
+    total_connection_count = total_connection_count - 1
 
-    # if this is the last connection from this IP, let's remove the empty list 
-    # from the dictionary
+    # if this is the last connection from this IP, let's remove the empty 
+    # deque from the dictionary
     if len(connection_dict[nextIP]) == 0:
       del connection_dict[nextIP]
     else:
-      # there are more.   Let's append the IP to the end of the dict_order
-      connection_dict_order.append(nextIP)
+      # there are more.   Let's put the IP at the back of the line
+      connection_IP_order.append(nextIP)
 
   finally:
     # if there is a bug in the above code, we still want to prevent deadlock...
-    connectionlock.release()
+    connectioncondition.release()
 
   # and return the request we removed.
-  return therequest
+  return nextIP, socketobject, received
+
+
+
+##### CONNECTIONS THAT ARE IDLE BETWEEN REQUESTS
+
+# Protects idle_connections.   It is notified when a connection is added.
+idleconnectioncondition = threading.Condition(threading.Lock())
+
+# The connections that wait for another request.   Each item is a list
+# [IP, socketobject, idlesince].
+idle_connections = []
+
+# A UDP socket on the loopback interface.   Sending a byte to it wakes the
+# idle connection thread up from select when a connection is added.   (On
+# Windows select can't wait for a pipe.)   It is created by 
+# IdleConnectionThread.
+idle_wakeup_socket = None
+
+
+
+# hands a connection that waits for another request to the idle connection
+# thread
+def add_idle_connection(IP, socketobject):
+  idleconnectioncondition.acquire()
+  try:
+    idle_connections.append([IP, socketobject, getruntime()])
+    idleconnectioncondition.notify()
+  finally:
+    idleconnectioncondition.release()
+
+  if idle_wakeup_socket is not None:
+    try:
+      idle_wakeup_socket.sendto("x", idle_wakeup_socket.getsockname())
+    except socket.error:
+      # The thread then notices the connection when it wakes up anyway
+      pass
+
+
+
+# returns the real socket under a connection, or None if it can't be found.
+# The timeout_socket wraps an Affix socket, which wraps the emulated socket
+# directly, or (without Affix) the emulated socket.
+def _get_real_socket(socketobject):
+  sock = socketobject.socket
+  if not isinstance(sock, emulcomm.EmulatedSocket):
+    sock = getattr(sock, "_socket", None)
+  if not isinstance(sock, emulcomm.EmulatedSocket):
+    return None
+  return sock.socketobj
+
+
+
+# returns the start of a new request on an idle connection, '' if there is
+# none yet.   Raises an exception if the connection was closed or broke.
+def _recv_request_start(socketobject):
+  # This reads from the socket below the timeout_socket, which doesn't block.
+  # Reading at most this much never reads past the end of the request.
+  try:
+    received = socketobject.socket.recv(session.session_minimumremaining(''))
+  except SocketWouldBlockError:
+    return ''
+
+  if received == '':
+    raise Exception("Socket closed")
+  return received
+
+
+
+# waits until an idle connection has the start of a new request or idled for
+# too long, or until another connection is added (then returns early).
+# Blocks until there is an idle connection.
+def _wait_for_idle_connections(checklist):
+  now = getruntime()
+  timeout = KEEPALIVE_IDLE_TIMEOUT
+  readlist = [idle_wakeup_socket]
+  for IP, socketobject, idlesince in checklist:
+    realsocket = _get_real_socket(socketobject)
+    if realsocket is None:
+      timeout = min(timeout, IDLE_CHECK_INTERVAL)
+    else:
+      readlist.append(realsocket)
+    timeout = min(timeout, max(0, idlesince + KEEPALIVE_IDLE_TIMEOUT - now))
+
+  try:
+    readylist = select.select(readlist, [], [], timeout)[0]
+  except (select.error, socket.error):
+    # A socket was closed under us, the checks will tell which one
+    return
+
+  # Read the wakeup bytes (there may be several)
+  if idle_wakeup_socket in readylist:
+    try:
+      while True:
+        idle_wakeup_socket.recv(16)
+    except socket.error:
+      pass
+
+
+
+# waits for the idle connections once (see _wait_for_idle_connections) and
+# checks them.   Blocks until there is one.
+def check_idle_connections():
+  idleconnectioncondition.acquire()
+  try:
+    while len(idle_connections) == 0:
+      idleconnectioncondition.wait()
+
+    checklist = idle_connections[:]
+  finally:
+    idleconnectioncondition.release()
+
+  _wait_for_idle_connections(checklist)
+
+  # The connections added meanwhile are checked as well
+  idleconnectioncondition.acquire()
+  try:
+    checklist = idle_connections[:]
+    del idle_connections[:]
+  finally:
+    idleconnectioncondition.release()
+
+  stillidle = []
+  for IP, socketobject, idlesince in checklist:
+    try:
+      received = _recv_request_start(socketobject)
+    except Exception, e:
+      # It is normal for clients to go away between requests
+      socketobject.close()
+      continue
+
+    if received != '':
+      # to the back of the line (the port isn't used)
+      connection_handler(IP, None, socketobject, received)
+    elif getruntime() - idlesince >= KEEPALIVE_IDLE_TIMEOUT:
+      socketobject.close()
+    else:
+      stillidle.append([IP, socketobject, idlesince])
+
+  idleconnectioncondition.acquire()
+  try:
+    idle_connections.extend(stillidle)
+  finally:
+    idleconnectioncondition.release()
+
+
+
+# this thread waits for new requests on the idle connections.   There is one
+# of these, named "IdleConnectionThread".
+class IdleConnectionThread(threading.Thread):
+  def __init__(self):
+    global idle_wakeup_socket
+
+    threading.Thread.__init__(self, name="IdleConnectionThread")
+
+    if idle_wakeup_socket is None:
+      wakeupsocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      wakeupsocket.bind(("127.0.0.1", 0))
+      wakeupsocket.setblocking(0)
+      idle_wakeup_socket = wakeupsocket
+
+  def run(self):
+    try:
+      while True:
+        check_idle_connections()
+
+    except:
+      servicelogger.log_last_exception()
+      raise
   
 
 
-# this class is the worker thread.   It processes connections
+# this class is the worker thread.   It processes connections.   There are
+# several of these, each named "WorkerThread-<number>".
 class WorkerThread(threading.Thread):
-  sleeptime = None
-  def __init__(self,st):
-    self.sleeptime = st
-    threading.Thread.__init__(self, name="WorkerThread")
+  workernumber = None
+  def __init__(self,workernumber):
+    self.workernumber = workernumber
+    threading.Thread.__init__(self, name="WorkerThread-"+str(workernumber))
 
   def run(self):
     try: 
 
       while True:
         
-        if len(connection_dict)>0:
-          # get the "first" request
-          conn = pop_request()
+        # get the "first" request (this blocks until there is one)
+        IP, conn, received = pop_request()
 # Removing this logging which seems excessive...          
-#          servicelogger.log('start handle_request:'+str(id(conn)))
-          nmrequesthandler.handle_request(conn)
-#          servicelogger.log('finish handle_request:'+str(id(conn)))
-        else:
-          # check at most twice a second (if nothing is new)
-          time.sleep(self.sleeptime)
+#        servicelogger.log('start handle_request:'+str(id(conn)))
+        if nmrequesthandler.handle_request(conn, received):
+          # the client may send another request on the connection
+          add_idle_connection(IP, conn)
+#        servicelogger.log('finish handle_request:'+str(id(conn)))
 
     except:
       servicelogger.log_last_exception()
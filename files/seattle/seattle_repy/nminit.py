@@ -283,12 +283,19 @@ def initialize_state():
   # initialize my configuration file.   This involves a few variables:
   #    pollfrequency --  the amount of time to sleep after a check when "busy
   #                      waiting".   This trades CPU load for responsiveness.
+  #    workerthreads --  the number of threads that handle requests.
+  #    maxconnectionsperip -- pending connections from one IP beyond this
+  #                      are rejected.
+  #    maxconnections --  pending connections beyond this are rejected.
   #    ports         --  the ports the node manager could listen on.
   #    publickey     --  the public key used to identify the node...
   #    privatekey    --  the corresponding private key for the node...
   configuration = {}
 
   configuration['pollfrequency'] = 1.0
+  configuration['workerthreads'] = 4
+  configuration['maxconnectionsperip'] = 3
+  configuration['maxconnections'] = 100
 
   # NOTE: I chose these randomly (they will be uniform across all NMs)...   
   # Was this wise?
@@ -412,25 +412,59 @@ def start_accepter():
 
 
 
-# has the thread started?
-def is_worker_thread_started():
+# returns the number of worker threads nodeman.cfg asks for
+def get_worker_thread_count():
+  if 'workerthreads' in configuration:
+    return max(1, int(configuration['workerthreads']))
+  return nmconnectionmanager.DEFAULT_WORKER_THREAD_COUNT
+
+
+
+# returns the names of the worker threads that aren't running
+def get_missing_worker_threads():
+  runningthreadnames = []
   for thread in threading.enumerate():
-    if 'WorkerThread' in str(thread):
+    runningthreadnames.append(thread.getName())
+
+  missingnumbers = []
+  for workernumber in range(get_worker_thread_count()):
+    if "WorkerThread-"+str(workernumber) not in runningthreadnames:
+      missingnumbers.append(workernumber)
+
+  return missingnumbers
+
+
+
+# is the thread that waits for requests on idle connections running?
+def is_idle_connection_thread_started():
+  for thread in threading.enumerate():
+    if thread.getName() == "IdleConnectionThread":
       return True
-  else:
-    return False
+  return False
 
 
 
-def start_worker_thread(sleeptime):
+# have all of the threads started?
+def is_worker_thread_started():
+  return len(get_missing_worker_threads()) == 0 and is_idle_connection_thread_started()
+
 
-  if not is_worker_thread_started():
+
+def start_worker_thread():
+
+  for workernumber in get_missing_worker_threads():
     # start the WorkerThread and set it to a daemon.   I think the daemon 
     # setting is unnecessary since I'll clobber on restart...
-    workerthread = nmconnectionmanager.WorkerThread(sleeptime)
+    workerthread = nmconnectionmanager.WorkerThread(workernumber)
     workerthread.setDaemon(True)
     workerthread.start()
 
+  # the workers hand connections that wait for another request to this one
+  if not is_idle_connection_thread_started():
+    idlethread = nmconnectionmanager.IdleConnectionThread()
+    idlethread.setDaemon(True)
+    idlethread.start()
+
 
 # has the thread started?
 def is_advert_thread_started():
@@ -479,7 +513,9 @@ def main():
   global configuration
 
   if not FOREGROUND:
-    # Background ourselves.
+    # Background ourselves.   (The exiting parent would otherwise write out
+    # the same buffered log messages as we do.)
+    servicelogger.flush()
     daemon.daemonize()
 
 
@@ -602,6 +638,11 @@ def main():
 
   vesseldict = nmrequesthandler.initialize(myip, configuration['publickey'], version)
 
+  # Use the connection limits from nodeman.cfg (if there are any)...
+  nmconnectionmanager.set_connection_limits(
+      configuration.get('maxconnectionsperip', nmconnectionmanager.DEFAULT_MAX_CONNECTIONS_PER_IP),
+      configuration.get('maxconnections', nmconnectionmanager.DEFAULT_MAX_CONNECTIONS))
+
   # Start accepter...
   myname = start_accepter()
 
@@ -611,8 +652,8 @@ def main():
   #send our advertised name to the log
   servicelogger.log('myname = ' + str(myname))
 
-  # Start worker thread...
-  start_worker_thread(configuration['pollfrequency'])
+  # Start worker threads...
+  start_worker_thread()
 
   # Start advert thread...
   start_advert_thread(vesseldict, myname, configuration['publickey'])
@@ -645,7 +686,7 @@ def main():
  
     if not is_worker_thread_started():
       servicelogger.log("[WARN]:WorkerThread requires restart.")
-      start_worker_thread(configuration['pollfrequency'])
+      start_worker_thread()
 
     if should_start_waitable_thread('advert', 'Advertisement Thread'):
       servicelogger.log("[WARN]:AdvertThread requires restart.")
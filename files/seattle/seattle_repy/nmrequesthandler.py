@@ -37,6 +37,9 @@ import nmAPI
 # for socket.error
 import socket
 
+# for the per vessel locks
+import threading
+
 # for logging informative errors
 import traceback
 
@@ -61,20 +64,28 @@ def initialize(myip, publickey, version):
   return nmAPI.initialize(myip, publickey, version)
 
 
-  
+
+
+
 # Armon: Safely closes a socket object
 
-# this takes a connection and safely processes the request.   
-def handle_request(socketobj):
+# this takes a connection and safely processes a request on it.   Clients may
+# send several requests on one connection, so the connection is left open
+# after a request was answered (nmconnectionmanager waits for the next one).
+# received is the start of the request if it was already read.   Returns True
+# if the connection was left open, it is closed otherwise.
+def handle_request(socketobj, received=''):
 
-  # always close the socketobj
+  keptopen = False
+
+  # always close the socketobj (unless we keep it open)
   try:
 
 
     try:
       # let's get the request...
       # BUG: Should prevent endless data / slow retrival attacks
-      fullrequest = session.session_recvmessage(socketobj)
+      fullrequest = session.session_recvmessage(socketobj, received)
   
     # Armon: Catch a vanilla exception because repy emulated_sockets
     # will raise Exception when the socket has been closed.
@@ -96,25 +107,9 @@ def handle_request(socketobj):
         return
 
 
-
-    # handle the request as appropriate
-    try:
-      retstring = process_API_call(fullrequest)
-
-    # Bad parameters, signatures, etc.
-    except nmAPI.BadRequest,e:
-      session.session_sendmessage(socketobj, str(e)+"\nError")
-      return
-
-    # Other exceptions only should happen on an internal error and should be
-    # captured by servicelogger.log
-    except Exception,e:
-      servicelogger.log_last_exception()
-      session.session_sendmessage(socketobj,"Internal Error\nError")
-      return
- 
-    # send the output of the command...
-    session.session_sendmessage(socketobj,retstring)
+    _answer_request(socketobj, fullrequest)
+    keptopen = True
+    return True
 
   except Exception, e:
     #JAC: Fix for the exception logging observed in #992
@@ -126,10 +121,35 @@ def handle_request(socketobj):
   
   finally:
     # Prevent leaks
-    try:
-      socketobj.close()
-    except Exception, e:
-      servicelogger.log_last_exception()
+    if not keptopen:
+      try:
+        socketobj.close()
+      except Exception, e:
+        servicelogger.log_last_exception()
+
+
+
+# processes a single request and sends the reply
+def _answer_request(socketobj, fullrequest):
+
+  # handle the request as appropriate
+  try:
+    retstring = process_API_call(fullrequest)
+
+  # Bad parameters, signatures, etc.
+  except nmAPI.BadRequest,e:
+    session.session_sendmessage(socketobj, str(e)+"\nError")
+    return
+
+  # Other exceptions only should happen on an internal error and should be
+  # captured by servicelogger.log
+  except Exception,e:
+    servicelogger.log_last_exception()
+    session.session_sendmessage(socketobj,"Internal Error\nError")
+    return
+
+  # send the output of the command...
+  session.session_sendmessage(socketobj,retstring)
    
       
   
@@ -177,11 +197,63 @@ API_dict = { \
   'ChangeAdvertise': (2, 'Owner', nmAPI.changeadvertise), \
   'SplitVessel': (2, 'Owner', nmAPI.splitvessel), \
   'JoinVessels': (2, 'Owner', nmAPI.joinvessels), \
+  # runs several of the calls above on one vessel (see _process_vessel_batch)
+  'VesselBatch': (2, 'User', None), \
   # obsoleted 
   # 'SetRestrictions': (2, 'Owner', nmAPI.setrestrictions) \
 }
 
 
+# Several worker threads may handle requests at once.   Requests that use the
+# same vessel must be handled one at a time so that checking and updating the
+# vessel's oldmetadata (the replay protection) can't interleave.   This maps
+# vessel names to their lock and the number of requests that hold it or wait
+# for it.   A lock is forgotten once no request uses it, so there are no
+# locks left behind for vessels that were removed (e.g. by SplitVessel).
+vessellockdict = {}
+
+# protects vessellockdict
+vessellockdictlock = threading.Lock()
+
+
+# returns the lock for a vessel (creating it if needed).   Every call must be
+# matched by a call to _put_vessel_lock once the request is done with it.
+def _get_vessel_lock(vesselname):
+  vessellockdictlock.acquire()
+  try:
+    if vesselname not in vessellockdict:
+      vessellockdict[vesselname] = [threading.Lock(), 0]
+    vessellockdict[vesselname][1] = vessellockdict[vesselname][1] + 1
+    return vessellockdict[vesselname][0]
+  finally:
+    vessellockdictlock.release()
+
+
+# the request no longer holds or waits for the vessel's lock
+def _put_vessel_lock(vesselname):
+  vessellockdictlock.acquire()
+  try:
+    vessellockdict[vesselname][1] = vessellockdict[vesselname][1] - 1
+    if vessellockdict[vesselname][1] == 0:
+      del vessellockdict[vesselname]
+  finally:
+    vessellockdictlock.release()
+
+
+# returns the names of the vessels a signed request operates on.   The first
+# argument is always a vessel name, JoinVessels also uses the second one.
+def _get_request_vessel_names(callname, requestdata):
+  requestargs = requestdata.split('|', 3)
+  vesselnamelist = [requestargs[1]]
+  if callname == 'JoinVessels' and len(requestargs) > 2 and requestargs[2] != requestargs[1]:
+    vesselnamelist.append(requestargs[2])
+
+  # always lock in the same order to avoid deadlock
+  vesselnamelist.sort()
+  return vesselnamelist
+
+
+
 def process_API_call(fullrequest):
 
   callname = fullrequest.split('|')[0]
@@ -212,34 +284,171 @@ def process_API_call(fullrequest):
   else:
     # strip off the signature and get the requestdata
     requestdata, requestsignature = fastsigneddata.signeddata_split_signature(fullrequest)
-    
 
-    # NOTE: the first argument *must* be the vessel name!!!!!!!!!!!
-    vesselname = requestdata.split('|',2)[1]
+    # handle at most one request at a time for a vessel
+    vesselnamelist = _get_request_vessel_names(callname, requestdata)
+    vessellocklist = []
+    for vesselname in vesselnamelist:
+      vessellocklist.append(_get_vessel_lock(vesselname))
 
-    if vesselname not in nmAPI.vesseldict:
-      raise nmAPI.BadRequest('Unknown Vessel')
+    try:
+      for vessellock in vessellocklist:
+        vessellock.acquire()
+      try:
+        return _process_signed_API_call(callname, fullrequest, requestdata, requestsignature, numberofargs, permissiontype, APIfunction)
+      finally:
+        for vessellock in vessellocklist:
+          vessellock.release()
+    finally:
+      for vesselname in vesselnamelist:
+        _put_vessel_lock(vesselname)
 
-    # I must have something to check...
-    if permissiontype == 'Owner':
-      # only the owner is allowed, so the list of keys is merely that key
-      allowedkeys = [ nmAPI.vesseldict[vesselname]['ownerkey'] ]
-    else:
-      # the user keys are also allowed
-      allowedkeys = [ nmAPI.vesseldict[vesselname]['ownerkey'] ] + nmAPI.vesseldict[vesselname]['userkeys']
 
-    # I need to pass the fullrequest in here...
-    ensure_is_correctly_signed(fullrequest, allowedkeys, nmAPI.vesseldict[vesselname]['oldmetadata'])
-    
-    # If there are 3 args, we want to split at most 3 times (the first item is 
-    # the callname)
-    callargs = requestdata.split('|',numberofargs)
-    
-    #store the request signature as old metadata
-    nmAPI.vesseldict[vesselname]['oldmetadata'] = requestsignature
-    
-    # return any output for the user...
-    return APIfunction(*callargs[1:])
+
+# handles a request that is protected by a signature.   The caller must hold
+# the lock of the vessel(s) the request uses.
+def _process_signed_API_call(callname, fullrequest, requestdata, requestsignature, numberofargs, permissiontype, APIfunction):
+
+  # NOTE: the first argument *must* be the vessel name!!!!!!!!!!!
+  vesselname = requestdata.split('|',2)[1]
+
+  if vesselname not in nmAPI.vesseldict:
+    raise nmAPI.BadRequest('Unknown Vessel')
+
+  # I must have something to check...
+  if permissiontype == 'Owner':
+    # only the owner is allowed, so the list of keys is merely that key
+    allowedkeys = [ nmAPI.vesseldict[vesselname]['ownerkey'] ]
+  else:
+    # the user keys are also allowed
+    allowedkeys = [ nmAPI.vesseldict[vesselname]['ownerkey'] ] + nmAPI.vesseldict[vesselname]['userkeys']
+
+  # I need to pass the fullrequest in here...
+  ensure_is_correctly_signed(fullrequest, allowedkeys, nmAPI.vesseldict[vesselname]['oldmetadata'])
+  
+  # If there are 3 args, we want to split at most 3 times (the first item is 
+  # the callname)
+  callargs = requestdata.split('|',numberofargs)
+  
+  #store the request signature as old metadata
+  nmAPI.vesseldict[vesselname]['oldmetadata'] = requestsignature
+
+  if callname == 'VesselBatch':
+    signingpublickey = fastsigneddata.signeddata_split(fullrequest)[1]
+    return _process_vessel_batch(vesselname, callargs[2], signingpublickey)
+  
+  # return any output for the user...
+  return APIfunction(*callargs[1:])
+
+
+
+
+
+# A VesselBatch request carries an ordered list of calls for one vessel under a
+# single signature (and sequence number), so deploying a program doesn't need
+# a separate connection, RSA verification and oldmetadata update per call:
+#    VesselBatch|vesselname|encodedcalls
+# encodedcalls is a list of calls (encoded with _encode_string_list) where each
+# call is a normal request without the vessel name, like 
+# 'AddFileToVessel|filename|filedata'.
+#
+# The batch is accepted or rejected as a whole: every call is checked (known
+# call, number of arguments, permissions of the signing key) before any of
+# them runs.   The calls are then run in order, stopping at the first one that
+# fails.   Calls that already ran are not undone.
+#
+# The response holds the output of each call that ran (encoded with
+# _encode_string_list), like 'output\nSuccess' or 'reason\nError'.   It ends
+# in '\nSuccess' if all of the calls succeeded and '\nError' otherwise.
+
+# These calls may not be batched.   Splitting or joining destroys the vessel
+# the rest of the batch would use.   Changing the owner or the users changes
+# the permissions that were checked for the rest of the batch.
+BATCH_EXCLUDED_CALLS = ['SplitVessel', 'JoinVessels', 'VesselBatch',
+    'ChangeOwner', 'ChangeUsers']
+
+# The most calls a single batch may contain
+BATCH_MAX_CALLS = 100
+
+
+# encodes a list of strings as a string of '<length>:<string>' items
+def _encode_string_list(stringlist):
+  encodedlist = []
+  for item in stringlist:
+    encodedlist.append(str(len(item)) + ':' + item)
+  return ''.join(encodedlist)
+
+
+# decodes a string built by _encode_string_list.   Raises ValueError if the 
+# string is malformed.
+def _decode_string_list(encodedstring):
+  stringlist = []
+  position = 0
+  while position < len(encodedstring):
+    separatorposition = encodedstring.find(':', position)
+    if separatorposition == -1:
+      raise ValueError("Missing length separator")
+    itemlength = int(encodedstring[position:separatorposition])
+    if itemlength < 0:
+      raise ValueError("Negative item length")
+    itemend = separatorposition + 1 + itemlength
+    if itemend > len(encodedstring):
+      raise ValueError("Truncated item")
+    stringlist.append(encodedstring[separatorposition+1:itemend])
+    position = itemend
+  return stringlist
+
+
+
+# checks and runs the calls of a VesselBatch request.   The signature has
+# already been checked.
+def _process_vessel_batch(vesselname, encodedcalls, signingpublickey):
+
+  try:
+    rawcalllist = _decode_string_list(encodedcalls)
+  except ValueError, e:
+    raise nmAPI.BadRequest("Malformed batch: "+str(e))
+
+  if len(rawcalllist) == 0:
+    raise nmAPI.BadRequest("Empty batch")
+  if len(rawcalllist) > BATCH_MAX_CALLS:
+    raise nmAPI.BadRequest("Too many calls in batch")
+
+  # check everything before we run anything...
+  calllist = []
+  for rawcall in rawcalllist:
+    callname = rawcall.split('|')[0]
+    if callname not in API_dict:
+      raise nmAPI.BadRequest("Unknown Call '"+callname+"' in batch")
+
+    numberofargs, permissiontype, APIfunction = API_dict[callname]
+    if permissiontype == 'Public' or callname in BATCH_EXCLUDED_CALLS:
+      raise nmAPI.BadRequest("Call '"+callname+"' is not allowed in a batch")
+
+    if permissiontype == 'Owner' and signingpublickey != nmAPI.vesseldict[vesselname]['ownerkey']:
+      raise nmAPI.BadRequest("Insufficient Permissions for '"+callname+"' in batch")
+
+    # the vessel name is the first argument and isn't in the call
+    callargs = rawcall.split('|', numberofargs-1)
+    if len(callargs) != numberofargs:
+      raise nmAPI.BadRequest("Wrong number of arguments for '"+callname+"' in batch")
+
+    calllist.append((APIfunction, [vesselname] + callargs[1:]))
+
+  # ...and then run the calls in order until one fails
+  resultlist = []
+  for APIfunction, callargs in calllist:
+    try:
+      resultlist.append(APIfunction(*callargs))
+    except nmAPI.BadRequest, e:
+      resultlist.append(str(e)+"\nError")
+      return _encode_string_list(resultlist) + "\nError"
+    except Exception, e:
+      servicelogger.log_last_exception()
+      resultlist.append("Internal Error\nError")
+      return _encode_string_list(resultlist) + "\nError"
+
+  return _encode_string_list(resultlist) + "\nSuccess"
 
 
 
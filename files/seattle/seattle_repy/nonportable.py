@@ -54,6 +54,9 @@ import nanny
 # This is used for IPC
 import marshal
 
+# This is used to check for messages from the repy process
+import select
+
 # This will fail on non-windows systems
 try:
   import windows_api as windows_api
@@ -72,6 +75,89 @@ class UnsupportedSystemException(Exception):
 
 ###################     Publicly visible functions   #######################
 
+def mapped_files_count_as_memory():
+  """
+  <Purpose>
+    Tells whether the pages of files that repy maps into memory (see
+    emulfile) count toward the memory use of the sandbox.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    False if the memory use leaves out the pages of mapped files, True
+    otherwise.
+  """
+  return not os_api_has_mapped_file_rss
+
+
+
+# The number of bytes of files that emulfile has mapped into memory in this
+# (the repy) process.   The monitor process learns it from the "mappedbytes"
+# messages that add_mapped_file_bytes sends.
+mapped_file_bytes = 0
+mapped_file_bytes_lock = threading.Lock()
+
+# The write end of the pipe to the monitor process (in the repy process on
+# *NIX), or None if there is no monitor process
+monitor_writehandle = None
+
+
+def add_mapped_file_bytes(bytes):
+  """
+  <Purpose>
+    Tells how many bytes of files emulfile mapped into memory (or unmapped,
+    with a negative number), so that the memory use only needs to leave out
+    the pages of mapped files while there are any.
+
+  <Arguments>
+    bytes:
+      The number of bytes mapped (positive) or unmapped (negative).
+
+  <Exceptions>
+    None
+
+  <Returns>
+    None
+  """
+  global mapped_file_bytes
+
+  mapped_file_bytes_lock.acquire()
+  try:
+    mapped_file_bytes = mapped_file_bytes + bytes
+    if monitor_writehandle is not None:
+      try:
+        write_message_to_pipe(monitor_writehandle, "mappedbytes", mapped_file_bytes)
+      except EnvironmentError:
+        # The monitor process died, parent_process_checker will exit
+        pass
+  finally:
+    mapped_file_bytes_lock.release()
+
+
+
+# Returns the memory use of the process pid from the cached data of the last
+# call to os_api.get_process_cpu_time(pid).   mappedbytes is the number of
+# bytes of files emulfile has mapped into memory in the process.   While there
+# are any, the pages of the files in the sandbox's directory that are mapped
+# into memory are left out where the OS can tell us about them.   Only emulfile
+# maps these files (for reading), so their pages are page cache the OS can
+# reclaim.   Everything else counts as it always did.
+def _get_memory_use(pid, mappedbytes):
+  memused = os_api.get_process_rss()
+  if mappedbytes > 0 and not mapped_files_count_as_memory():
+    try:
+      memused = max(memused - os_api.get_process_mapped_file_rss(pid,
+          repy_constants.REPY_CURRENT_DIR), 0)
+    except EnvironmentError:
+      # The mapped pages count then
+      pass
+  return memused
+
+
 # check the disk space used by a dir.
 def compute_disk_use(dirname):
   # Convert path to absolute
@@ -119,6 +205,10 @@ def preparesocket(socketobject):
 # This will result in an internal thread on Windows
 # and a thread on the external process for *NIX
 def monitor_cpu_disk_and_mem():
+  # Take the initial disk measurement before we fork so that both the repy
+  # process and the monitor start from the same running total
+  initialize_disk_use()
+
   if ostype == 'Linux' or ostype == 'Darwin':  
     # Startup a CPU monitoring thread/process
     do_forked_resource_monitor()
@@ -155,6 +245,11 @@ granularity = 1
 # This ensures only one thread calling getruntime at any given time
 runtimelock = threading.Lock()
 
+# The monotonic clock reading when we got loaded.   This is None if the
+# system does not provide a monotonic clock, and getruntime has to reconcile
+# the uptime with time.time() instead.
+monotonic_starttime = None
+
 def getruntime():
   """
    <Purpose>
@@ -172,7 +267,10 @@ def getruntime():
       None
 
    <Remarks>
-      By default this will have the same granularity as the system clock. However, if time 
+      If the system provides a monotonic clock (CLOCK_MONOTONIC on Linux),
+      it is used directly and the returned values never decrease.
+
+      Otherwise this will have the same granularity as the system clock. However, if time 
       goes backward due to NTP or other issues, getruntime falls back to system uptime.
       This has much lower granularity, and varies by each system.
 
@@ -181,6 +279,11 @@ def getruntime():
   """
   global starttime, last_uptime, last_timestamp, elapsedtime, granularity, runtimelock
   
+  # The monotonic clock is not affected by NTP, so no lock or reconciliation
+  # with time.time() is needed
+  if monotonic_starttime is not None:
+    return os_api.get_monotonic_time() - monotonic_starttime
+
   # Get the lock
   runtimelock.acquire()
   
@@ -256,9 +359,19 @@ def getruntime():
 # This lock is used to serialize calls to get_resources
 get_resources_lock = threading.Lock()
 
-# Cache the disk used from the external process
+# The disk used by the vessel.   This is a running total which emulfile
+# adjusts as files are created, grown and removed (see
+# report_disk_use_change).   The resource monitor periodically replaces it
+# with the result of a full scan to correct any drift.
 cached_disk_used = 0L
 
+# Serializes updates to cached_disk_used
+disk_used_lock = threading.Lock()
+
+# Set once the initial scan was done.   Until then size changes are ignored,
+# e.g. when emulfile is used through repyportability without a monitor
+disk_use_tracked = [False]
+
 # This array holds the times that repy was stopped.
 # It is an array of tuples, of the form (time, amount)
 # where time is when repy was stopped (from getruntime()) and amount
@@ -266,6 +379,79 @@ cached_disk_used = 0L
 process_stopped_timeline = []
 process_stopped_max_entries = 100
 
+def initialize_disk_use():
+  """
+  <Purpose>
+    Scans the vessel directory once to set the initial disk usage and
+    enables incremental disk accounting.
+
+  <Arguments>
+    None
+
+  <Returns>
+    None
+  """
+  reconcile_disk_use(compute_disk_use(repy_constants.REPY_CURRENT_DIR))
+  disk_use_tracked[0] = True
+
+
+def reconcile_disk_use(diskused):
+  """
+  <Purpose>
+    Replaces the running disk usage total with the result of a full scan.
+
+  <Arguments>
+    diskused: The disk usage in bytes, as computed by compute_disk_use
+
+  <Returns>
+    None
+  """
+  global cached_disk_used
+
+  disk_used_lock.acquire()
+  try:
+    cached_disk_used = diskused
+  finally:
+    disk_used_lock.release()
+
+
+def report_disk_use_change(delta):
+  """
+  <Purpose>
+    Adjusts the running disk usage total and enforces the diskused limit.
+    This is called by emulfile whenever the size of the vessel changes, so
+    the check is O(1) instead of a scan of the vessel directory.
+
+  <Arguments>
+    delta: The change in bytes (negative if disk space was freed)
+
+  <Side Effects>
+    Terminates repy if the disk usage is over the limit.
+
+  <Returns>
+    None
+  """
+  global cached_disk_used
+
+  if not disk_use_tracked[0] or delta == 0:
+    return
+
+  disk_used_lock.acquire()
+  try:
+    cached_disk_used = cached_disk_used + delta
+    diskused = cached_disk_used
+  finally:
+    disk_used_lock.release()
+
+  if diskused > nanny.get_resource_limit("diskused"):
+    try:
+      print >> sys.stderr, "Disk use '"+str(diskused)+"' over limit '"+str(nanny.get_resource_limit("diskused"))+"'. Impolitely killing repy!"
+      sys.stderr.flush()
+    except:
+      pass
+    harshexit.harshexit(98)
+
+
 # Method to expose resource limits and usage
 def get_resources():
   """
@@ -313,7 +499,7 @@ def get_resources():
       usage["cpu"] = os_api.get_process_cpu_time(pid)
 
       # This uses the cached PID data from the CPU check
-      usage["memory"] = os_api.get_process_rss()
+      usage["memory"] = _get_memory_use(pid, mapped_file_bytes)
 
       # Get the thread specific CPU usage
       usage["threadcpu"] = os_api.get_current_thread_cpu_time() 
@@ -359,8 +545,8 @@ class WindowsNannyThread(threading.Thread):
   def run(self):
     # How often the memory will be checked (seconds)
     memory_check_interval = repy_constants.CPU_POLLING_FREQ_WIN
-    # The ratio of the disk polling time to memory polling time.
-    disk_to_memory_ratio = int(repy_constants.DISK_POLLING_HDD / memory_check_interval)
+    # The ratio of the disk reconciliation time to memory polling time.
+    disk_to_memory_ratio = int(repy_constants.DISK_RECONCILE_FREQ / memory_check_interval)
       
     # Which cycle number we're on  
     counter = 0
@@ -384,10 +570,12 @@ class WindowsNannyThread(threading.Thread):
           # We will be killed by the other thread...
           raise Exception, "Memory use '"+str(memused)+"' over limit '"+str(nanny.get_resource_limit("memory"))+"'"
 
-        # Check if we should check the disk
+        # Check if we should reconcile the disk use.   Changes are accounted
+        # for incrementally, this full scan only corrects drift.
         if (counter % disk_to_memory_ratio) == 0:
           # Check diskused
           diskused = compute_disk_use(repy_constants.REPY_CURRENT_DIR)
+          reconcile_disk_use(diskused)
           if diskused > nanny.get_resource_limit("diskused"):
             raise Exception, "Disk use '"+str(diskused)+"' over limit '"+str(nanny.get_resource_limit("diskused"))+"'"
         # Sleep until the next iteration of checking the memory
@@ -519,9 +707,9 @@ class WinCPUNannyThread(threading.Thread):
 
 # This method handles messages on the "diskused" channel from
 # the external process. When the external process measures disk used,
-# it is piped in and cached for calls to getresources.
+# it is piped in and replaces the running total used by getresources.
 def IPC_handle_diskused(bytes):
-  cached_disk_used = bytes
+  reconcile_disk_use(bytes)
 
 
 # This method handles messages on the "repystopped" channel from
@@ -707,16 +895,27 @@ repy_process_id = None
 # will become a resource monitor
 def do_forked_resource_monitor():
   global repy_process_id
+  global monitor_writehandle
 
   # Get a pipe
   (readhandle, writehandle) = os.pipe()
 
+  # And one for messages from repy to the monitor process
+  (monitorreadhandle, monitorwritehandle) = os.pipe()
+
+  # Write out buffered output (e.g. of the circular log) first, or else both
+  # processes would write it
+  sys.stdout.flush()
+  sys.stderr.flush()
+
   # I'll fork a copy of myself
   childpid = os.fork()
 
   if childpid == 0:
     # We are the child, close the write end of the pipe
     os.close(writehandle)
+    os.close(monitorreadhandle)
+    monitor_writehandle = monitorwritehandle
 
     # Start a thread to check on the survival of the parent
     parent_process_checker(readhandle).start()
@@ -725,6 +924,7 @@ def do_forked_resource_monitor():
   else:
     # We are the parent, close the read end
     os.close(readhandle)
+    os.close(monitorwritehandle)
 
   # Store the childpid
   repy_process_id = childpid
@@ -758,7 +958,7 @@ def do_forked_resource_monitor():
     (pid, status) = os.waitpid(childpid,os.WNOHANG)
     
     # Launch the resource monitor, if it fails determine why and restart if necessary
-    resource_monitor(childpid, writehandle)
+    resource_monitor(childpid, writehandle, monitorreadhandle)
     
   except ResourceException, exp:
     # Repy exceeded its resource limit, kill it
@@ -781,7 +981,7 @@ def do_forked_resource_monitor():
       _internal_error(str(exp)+" Monitor death! Impolitely killing child!")
       raise
   
-def resource_monitor(childpid, pipe_handle):
+def resource_monitor(childpid, pipe_handle, monitor_pipe_handle):
   """
   <Purpose>
     Function runs in a loop forever, checking resource usage and throttling CPU.
@@ -793,18 +993,26 @@ def resource_monitor(childpid, pipe_handle):
 
     pipe_handle:
       A handle to the pipe to the repy process. Allows sending resource use information.
+
+    monitor_pipe_handle:
+      A handle to the pipe from the repy process, on which it tells how many
+      bytes of files it mapped into memory.
   """
   # Get our pid
   ourpid = os.getpid()
   
-  # Calculate how often disk should be checked
-  disk_interval = int(repy_constants.RESOURCE_POLLING_FREQ_LINUX / repy_constants.CPU_POLLING_FREQ_LINUX)
+  # Calculate how often the disk use should be reconciled.   The repy process
+  # accounts for changes incrementally, so a full scan is rarely needed.
+  disk_interval = int(repy_constants.DISK_RECONCILE_FREQ / repy_constants.CPU_POLLING_FREQ_LINUX)
   current_interval = -1 # What cycle are we on  
   
   # Store time of the last interval
   last_time = getruntime()
   last_CPU_time = 0
   resume_time = 0 
+
+  # The number of bytes of files repy has mapped into memory
+  mappedbytes = 0
   
   # Run forever...
   while True:
@@ -861,8 +1069,10 @@ def resource_monitor(childpid, pipe_handle):
     # 
     ########### Check Memory ###########
     
-    # Get how much memory repy is using
-    memused = os_api.get_process_rss()
+    # Get how much memory repy is using (this uses the cached PID data from
+    # the CPU check)
+    mappedbytes = _read_mapped_file_bytes(monitor_pipe_handle, mappedbytes)
+    memused = _get_memory_use(childpid, mappedbytes)
     
     # Check if it is using too much memory
     if memused > nanny.get_resource_limit("memory"):
@@ -886,7 +1096,8 @@ def resource_monitor(childpid, pipe_handle):
       if diskused > nanny.get_resource_limit("diskused"):
         raise ResourceException, "Disk use '"+str(diskused)+"' over limit '"+str(nanny.get_resource_limit("diskused"))+"'."
 
-      # Send the disk usage information, raw bytes used
+      # Send the disk usage information, raw bytes used, to correct the
+      # running total of the repy process
       write_message_to_pipe(pipe_handle, "diskused", diskused)
     
     ########### End Check Disk ###########
@@ -895,6 +1106,17 @@ def resource_monitor(childpid, pipe_handle):
     time.sleep(repy_constants.CPU_POLLING_FREQ_LINUX)
 
 
+# Returns the number of bytes of files the repy process has mapped into memory,
+# from the last message it sent on the pipe (see add_mapped_file_bytes).
+# mappedbytes is returned if there is no new message.
+def _read_mapped_file_bytes(readhandle, mappedbytes):
+  while select.select([readhandle], [], [], 0)[0]:
+    (channel, data) = read_message_from_pipe(readhandle)
+    if channel == "mappedbytes":
+      mappedbytes = data
+  return mappedbytes
+
+
 ###########     functions that help me figure out the os type    ###########
 
 # Calculates the system granularity
@@ -950,21 +1172,60 @@ elif ostype == "Windows":
 else:
   # This is a non-supported OS
   raise UnsupportedSystemException, "The current Operating System is not supported! Fatal Error."
+
+# Can the memory use leave out the pages of mapped files?   (This is checked
+# here because hasattr isn't allowed once the sandbox runs.)   Linux has no
+# smaps without CONFIG_PROC_PAGE_MONITOR.
+os_api_has_mapped_file_rss = hasattr(os_api, "get_process_mapped_file_rss") \
+    and (ostype != "Linux" or os.path.exists("/proc/self/smaps"))
   
-# Set granularity
-calculate_granularity()  
+# Initializes the state used by getruntime
+def init_getruntime(use_monotonic_clock=True):
+  """
+   <Purpose>
+      Sets the point getruntime measures from and selects its time source.
 
-# For Windows, we need to initialize time.clock()
-if ostype in ["Windows"]:
-  time.clock()
+   <Arguments>
+      use_monotonic_clock:
+        If False, the monotonic clock is not used even if the system has one.
+        getruntime then reconciles the uptime with time.time() as on systems
+        without a monotonic clock.
 
-# Initialize getruntime for other platforms 
-else:
-  # Set the starttime to the initial uptime
-  starttime = getruntime()
-  last_uptime = starttime
+   <Returns>
+      None
+  """
+  global monotonic_starttime, starttime, last_uptime, last_timestamp, elapsedtime
+
+  # Use the monotonic clock if there is one
+  monotonic_starttime = None
+  if use_monotonic_clock:
+    try:
+      monotonic_starttime = os_api.get_monotonic_time()
+    except Exception:
+      # Either the platform's API lacks get_monotonic_time or the clock is
+      # unavailable
+      monotonic_starttime = None
+
+  # The granularity is only needed without a monotonic clock
+  if monotonic_starttime is None:
+    calculate_granularity()
+
+  # For Windows, we need to initialize time.clock()
+  if ostype in ["Windows"]:
+    time.clock()
+
+  # Initialize getruntime for other platforms
+  elif monotonic_starttime is None:
+    # Set the starttime to the initial uptime
+    starttime = 0
+    last_uptime = 0
+    last_timestamp = time.time()
+    elapsedtime = 0
+    starttime = getruntime()
+    last_uptime = starttime
 
-  # Reset elapsed time 
-  elapsedtime = 0
+    # Reset elapsed time
+    elapsedtime = 0
 
 
+init_getruntime()
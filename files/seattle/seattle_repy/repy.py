@@ -78,6 +78,7 @@ checkpythonversion.ensure_python_version_is_supported()
 import safe
 import nanny
 import emulcomm
+import emulfile
 import idhelper
 import harshexit
 import namespace
@@ -96,7 +97,6 @@ import tracebackrepy
 from exception_hierarchy import *
 
 # BAD: REMOVE these imports after we remove the API calls
-#import emulfile
 import emulmisc
 #import emultimer
 
@@ -261,6 +261,18 @@ def add_repy_options(parser):
                     action="store_true", dest="servicelog",
                     help="Enable usage of the servicelogger for internal errors"
                     )
+  parser.add_option('--safecheckinprocess',
+                    action="store_true", dest="safecheckinprocess", default=False,
+                    help="Check the safety of code in this process instead of in safe_check.py processes"
+                    )
+  parser.add_option('--bytecodecache',
+                    action="store", type="string", dest="bytecodecache",
+                    help="Cache the bytecode of repy's libraries in the directory bytecodecache"
+                    )
+  parser.add_option('--bytecodecachesize',
+                    action="store", type="int", dest="bytecodecachesize",
+                    help="Limit the bytecode cache to bytecodecachesize bytes"
+                    )
     
 def parse_options(options):
   """ Parse the specified options and initialize all required structures
@@ -289,11 +301,23 @@ def parse_options(options):
     # Disable nonspecified IP's
     emulcomm.allow_nonspecified_ips = False
     
+  if options.safecheckinprocess:
+    safe.SAFE_CHECK_IN_PROCESS = True
+
+  # The cache directory is relative to the repy directory (not --cwd)
+  if options.bytecodecache:
+    safe.BYTECODE_CACHE_ENABLED = True
+    safe.BYTECODE_CACHE_DIRECTORY = options.bytecodecache
+    if options.bytecodecachesize is not None:
+      safe.BYTECODE_CACHE_MAX_SIZE = options.bytecodecachesize
+    safe.trim_caches()
+
   # set up the circular log buffer...
   # Armon: Initialize the circular logger before starting the nanny
   if options.logfile:
     # time to set up the circular logger
-    loggerfo = loggingrepy.circular_logger(options.logfile)
+    loggerfo = loggingrepy.circular_logger(options.logfile,
+        buffersize=repy_constants.LOG_BUFFER_SIZE)
     # and redirect err and out there...
     sys.stdout = loggerfo
     sys.stderr = loggerfo
@@ -333,6 +357,22 @@ def initialize_nanny(resourcefn):
   # JAC: I believe this is needed for interface / ip-based restrictions
   emulcomm.update_ip_cache()
 
+  # Start the socket readiness reactor now so that its thread is not
+  # mistaken for a pending event of the program
+  emulcomm.start_readiness_reactor()
+
+  # The same goes for the thread that writes out buffered file writes
+  emulfile.start_write_buffer_flusher()
+
+  # ...and for the one that writes out the buffered log
+  loggingrepy.start_log_flusher()
+
+  # ...and for the one that charges what threads batched but didn't charge
+  nanny.start_pending_charge_sweeper()
+
+  # ...and for the one that stops idle safety checking processes
+  safe.start_safe_check_worker_reaper()
+
 
 
 def main():
@@ -13,6 +13,9 @@
 
 import nanny
 
+# Used to account for changes in disk use
+import nonportable
+
 # Used for path and file manipulation
 import os 
 import os.path
@@ -23,6 +26,18 @@ import tracebackrepy
 # Used to get a lock object
 import threading
 
+# Used to wait between writing out the write buffers
+import time
+
+# Used to write out the write buffers when repy exits
+import harshexit
+
+# Used to read from large files
+try:
+  import mmap
+except ImportError:
+  mmap = None
+
 # Get access to the current working directory
 import repy_constants
 
@@ -57,6 +72,15 @@ ILLEGAL_FILENAMES = set(["", ".", ".."])
 OPEN_FILES_LOCK = threading.Lock()
 OPEN_FILES = set([])
 
+# This set contains the open files whose write buffer holds data
+# Access to this set should be serialized via the BUFFERED_FILES_LOCK
+BUFFERED_FILES_LOCK = threading.Lock()
+BUFFERED_FILES = set([])
+
+# The thread that writes out the write buffers periodically.   Files are only
+# buffered while it runs (see start_write_buffer_flusher).
+write_buffer_flusher = None
+
 
 ##### Public Functions
 
@@ -136,9 +160,15 @@ def removefile(filename):
     # Consume the filewrite resources
     nanny.tattle_quantity('filewrite',4096)
 
+    # Get the size first, so we know how much disk space is freed
+    filesize = os.path.getsize(absolute_filename)
+
     # Remove the file (failure is an internal error)
     os.remove(absolute_filename)
 
+    # The file and the 4K charged for it are no longer in use
+    nonportable.report_disk_use_change(-(filesize + 4096))
+
   
   finally:
     OPEN_FILES_LOCK.release()
@@ -224,6 +254,113 @@ def _assert_is_allowed_filename(filename):
 check_repy_filename = _assert_is_allowed_filename
 
 
+
+def start_write_buffer_flusher():
+  """
+  <Purpose>
+    Turns on the write-behind buffering of the files opened from now on and
+    starts the thread that writes out the buffers periodically.   repy.py
+    calls this before running the user program so that the thread is not
+    counted as a pending event of the program.   The buffers are also written
+    out when repy exits through harshexit.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    None
+  """
+  global write_buffer_flusher
+
+  # The buffering is turned off
+  if repy_constants.FILE_WRITE_BUFFER_SIZE <= 0:
+    return
+
+  if write_buffer_flusher is not None and write_buffer_flusher.isAlive():
+    return
+
+  write_buffer_flusher = threading.Thread(target=_flush_write_buffers_periodically,
+      name="FileWriteBufferFlusher")
+  write_buffer_flusher.setDaemon(True)
+  write_buffer_flusher.start()
+
+  if _flush_write_buffers_at_exit not in harshexit.exit_functions:
+    harshexit.exit_functions.append(_flush_write_buffers_at_exit)
+
+
+
+def flush_write_buffers(timeout=None):
+  """
+  <Purpose>
+    Writes out the write buffers of all open files.
+
+  <Arguments>
+    timeout:
+      The maximum number of seconds to wait for a file that is in use
+      (e.g. a writeat waiting for filewrite resources).   Its buffer is not
+      written out if the time runs out.   None means to wait as long as it
+      takes.
+
+  <Exceptions>
+    As with file.write() if writing fails.
+
+  <Returns>
+    None
+  """
+  BUFFERED_FILES_LOCK.acquire()
+  try:
+    bufferedfiles = list(BUFFERED_FILES)
+    BUFFERED_FILES.clear()
+  finally:
+    BUFFERED_FILES_LOCK.release()
+
+  if timeout is not None:
+    deadline = time.time() + timeout
+
+  for fileobj in bufferedfiles:
+    if timeout is None:
+      fileobj.seek_lock.acquire()
+    elif not _acquire_lock_before(fileobj.seek_lock, deadline):
+      continue
+
+    try:
+      fileobj._flush_write_buffer()
+    finally:
+      fileobj.seek_lock.release()
+
+
+
+def _acquire_lock_before(lock, deadline):
+  # Tries to acquire the lock until time.time() reaches the deadline.
+  # Returns True if the lock was acquired.
+  while not lock.acquire(False):
+    if time.time() >= deadline:
+      return False
+    time.sleep(0.001)
+  return True
+
+
+
+def _flush_write_buffers_at_exit():
+  # harshexit calls this.   Exiting must not wait long for files in use.
+  flush_write_buffers(timeout=1)
+
+
+
+def _flush_write_buffers_periodically():
+  # This is the write buffer flusher thread
+  while True:
+    time.sleep(repy_constants.FILE_WRITE_BUFFER_FLUSH_FREQ)
+    try:
+      flush_write_buffers()
+    except Exception, e:
+      # The data of a writeat call was lost, just as if that call had failed
+      tracebackrepy.handle_internalerror("Failed to write out buffered file data: " + str(e), 843)
+
+
 ##### Class Definitions
 
 
@@ -241,7 +378,19 @@ class emulated_file (object):
   # fobj is the actual underlying file-object from python.
   # seek_lock is a Lock object to serialize seeking
   # size is the byte size of the file, to detect seeking past the end.
-  __slots__ = ["filename", "abs_filename", "fobj", "seek_lock", "filesize"]
+  # This includes the data in the write buffer.
+  #
+  # writebuffer is a list of the data of buffered writeat calls, which goes
+  # to the file at writebufferoffset.   writebufferlength is the number of
+  # bytes in it, and writebuffersize is the number at which it is written out
+  # (0 if the file isn't buffered).   These are protected by the seek_lock.
+  #
+  # usereadmap is True if readat may read large files from a memory mapping.
+  # readmap is a read-only mapping of the first readmaplength bytes of the
+  # file (or None).   These are also protected by the seek_lock.
+  __slots__ = ["filename", "abs_filename", "fobj", "seek_lock", "filesize",
+      "writebuffer", "writebufferoffset", "writebufferlength", "writebuffersize",
+      "usereadmap", "readmap", "readmaplength"]
 
   def __init__(self, filename, create):
     """
@@ -256,6 +405,13 @@ class emulated_file (object):
     self.fobj = None
     self.seek_lock = threading.Lock()
     self.filesize = 0
+    self.writebuffer = []
+    self.writebufferoffset = 0
+    self.writebufferlength = 0
+    self.writebuffersize = 0
+    self.usereadmap = False
+    self.readmap = None
+    self.readmaplength = 0
 
     # raise an RepyArgumentError if the filename isn't valid
     _assert_is_allowed_filename(filename)
@@ -294,6 +450,9 @@ class emulated_file (object):
         nanny.tattle_quantity('filewrite', 4096)
         safe_open(self.abs_filename, "w").close() # Forces file creation
 
+        # Every file is charged 4K of disk use
+        nonportable.report_disk_use_change(4096)
+
       # Store a file handle
       # Always open in mode r+b, this avoids Windows text-mode
       # quirks, and allows reading and writing
@@ -305,6 +464,15 @@ class emulated_file (object):
       # Get the file's size
       self.filesize = os.path.getsize(self.abs_filename)
 
+      # Buffer the writes if the write buffer flusher is running
+      if write_buffer_flusher is not None:
+        self.writebuffersize = repy_constants.FILE_WRITE_BUFFER_SIZE
+
+      # The pages of a mapping must not count as memory use of the sandbox
+      self.usereadmap = mmap is not None and \
+          repy_constants.FILE_MMAP_MIN_SIZE is not None and \
+          not nonportable.mapped_files_count_as_memory()
+
     except RepyException:
       # Restore the file handle we tattled
       nanny.tattle_remove_item('filesopened', self.abs_filename)
@@ -345,14 +513,26 @@ class emulated_file (object):
       # Release the file object
       fobj = self.fobj
       if fobj is not None:
-        fobj.close()
-        self.fobj = None
+        try:
+          # Write out the buffered data first
+          self._flush_write_buffer()
+        finally:
+          self._close_read_map()
+          fobj.close()
+          self.fobj = None
       else:
         raise FileClosedError("File '"+str(self.filename)+"' is already closed!")
 
       # Remove this file from the list of open files
       OPEN_FILES.remove(self.filename)
 
+      # Its buffer is empty now
+      BUFFERED_FILES_LOCK.acquire()
+      try:
+        BUFFERED_FILES.discard(self)
+      finally:
+        BUFFERED_FILES_LOCK.release()
+
     finally:
       # Release the two locks we hold
       self.seek_lock.release()
@@ -403,19 +583,29 @@ class emulated_file (object):
       # Check the provided offset
       if offset > self.filesize:
         raise SeekPastEndOfFileError("Seek offset extends past the EOF!")
-      
-      # Seek to the correct location
-      fobj.seek(offset)
+
+      # The buffered data must be read as well
+      self._flush_write_buffer()
 
       # Wait for available file read resources
       nanny.tattle_quantity('fileread',0)
 
-      if sizelimit != None:
-        # Read the data
-        data = fobj.read(sizelimit)
-      else:
-        # read all the data...
-        data = fobj.read()
+      # Large files are read from a memory mapping.   (This is None if the
+      # file can't be mapped.)
+      data = None
+      if self.usereadmap and self.filesize >= repy_constants.FILE_MMAP_MIN_SIZE:
+        data = self._read_from_map(sizelimit, offset)
+
+      if data is None:
+        # Seek to the correct location
+        fobj.seek(offset)
+
+        if sizelimit != None:
+          # Read the data
+          data = fobj.read(sizelimit)
+        else:
+          # read all the data...
+          data = fobj.read()
 
     finally:
       # Release the seek lock
@@ -428,7 +618,7 @@ class emulated_file (object):
       disk_blocks_read += 1
 
     # Charge 4K per block
-    nanny.tattle_quantity('fileread', disk_blocks_read*4096)
+    nanny.tattle_quantity_batched('fileread', disk_blocks_read*4096)
 
     # Return the data
     return data
@@ -465,6 +655,9 @@ class emulated_file (object):
     if type(data) is not str:
       raise RepyArgumentError("Data must be specified as a string!")
 
+    # The number of bytes the file grew by
+    sizeincrease = 0
+
     # Get the seek lock
     self.seek_lock.acquire()
 
@@ -477,25 +670,54 @@ class emulated_file (object):
       # Check the provided offset
       if offset > self.filesize:
         raise SeekPastEndOfFileError("Seek offset extends past the EOF!")
-      
-      # Seek to the correct location
-      fobj.seek(offset)
 
       # Wait for available file write resources
       nanny.tattle_quantity('filewrite',0)
 
-      # Write the data and flush to disk
-      fobj.write(data)
-      fobj.flush()
+      if len(data) < self.writebuffersize:
+        # Buffer the data.   Only a write that continues the buffered data is
+        # added to it, so the buffer always goes to one place in the file.
+        if self.writebufferlength > 0 and \
+            offset != self.writebufferoffset + self.writebufferlength:
+          self._flush_write_buffer()
+
+        if self.writebufferlength == 0:
+          self.writebufferoffset = offset
+          BUFFERED_FILES_LOCK.acquire()
+          try:
+            BUFFERED_FILES.add(self)
+          finally:
+            BUFFERED_FILES_LOCK.release()
+
+        self.writebuffer.append(data)
+        self.writebufferlength = self.writebufferlength + len(data)
+
+        if self.writebufferlength >= self.writebuffersize:
+          self._flush_write_buffer()
+
+      else:
+        # Keep the writes in order
+        self._flush_write_buffer()
+
+        # Seek to the correct location
+        fobj.seek(offset)
+
+        # Write the data and flush to disk
+        fobj.write(data)
+        fobj.flush()
 
       # Check if we expanded the file size
       if offset + len(data) > self.filesize:
+        sizeincrease = offset + len(data) - self.filesize
         self.filesize = offset + len(data)
 
     finally:
       # Release the seek lock
       self.seek_lock.release()
 
+    # Account for the additional disk use
+    nonportable.report_disk_use_change(sizeincrease)
+
     # Check how much we've written, in terms of 4K "blocks"
     end_offset = len(data) + offset
     disk_blocks_written = end_offset / 4096 - offset / 4096
@@ -503,7 +725,57 @@ class emulated_file (object):
       disk_blocks_written += 1
 
     # Charge 4K per block
-    nanny.tattle_quantity('filewrite', disk_blocks_written*4096)
+    nanny.tattle_quantity_batched('filewrite', disk_blocks_written*4096)
+
+
+  def _flush_write_buffer(self):
+    # Writes out the write buffer.   The caller must hold the seek_lock.
+    if self.writebufferlength == 0:
+      return
+
+    data = "".join(self.writebuffer)
+    offset = self.writebufferoffset
+    # The data is dropped if writing fails, so it isn't written again later
+    self.writebuffer = []
+    self.writebufferlength = 0
+
+    fobj = self.fobj
+    fobj.seek(offset)
+    fobj.write(data)
+    fobj.flush()
+
+
+  def _read_from_map(self, sizelimit, offset):
+    # Reads from the mapping of the file.   The caller must hold the
+    # seek_lock and must have written out the write buffer.   Returns None if
+    # the file can't be mapped.
+    if sizelimit == None:
+      endoffset = self.filesize
+    else:
+      endoffset = min(offset + sizelimit, self.filesize)
+
+    # Map the file (again if it grew past the mapping).   Writes to the part
+    # that is mapped already show up in the mapping.
+    if self.readmap is None or endoffset > self.readmaplength:
+      self._close_read_map()
+      try:
+        self.readmap = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+      except (EnvironmentError, ValueError):
+        # e.g. there is no address space left, or the file is empty
+        return None
+      self.readmaplength = len(self.readmap)
+      nonportable.add_mapped_file_bytes(self.readmaplength)
+
+    return self.readmap[offset:endoffset]
+
+
+  def _close_read_map(self):
+    # The caller must hold the seek_lock
+    if self.readmap is not None:
+      self.readmap.close()
+      nonportable.add_mapped_file_bytes(-self.readmaplength)
+      self.readmap = None
+      self.readmaplength = 0
 
 
   def __del__(self):
@@ -14,10 +14,29 @@ import os
 # for Lock
 import threading
 
+# for the log flusher thread
+import time
+
+# the buffered logs are written out when python exits
+import atexit
+
 # I need to rename file so that the checker doesn't complain...
 myfile = file
 
 
+# The circular loggers that have a write buffer.   The log flusher thread
+# writes out their buffers periodically.   Access to this list should be
+# serialized via the BUFFERED_LOGGERS_LOCK
+BUFFERED_LOGGERS_LOCK = threading.Lock()
+BUFFERED_LOGGERS = []
+
+# The log flusher thread (None until it is started)
+log_flusher = None
+
+# Has flush_buffered_loggers been registered with atexit?
+registered_atexit = False
+
+
 # used to make stdout flush as written   This is private to my code
 class flush_logger_core:
   """
@@ -68,6 +87,105 @@ def get_size(fn):
 
 
 
+def start_log_flusher(flushfrequency):
+  """
+  <Purpose>
+    Starts the thread that writes out the buffers of the circular loggers
+    every flushfrequency seconds, unless it is running.   The thread doesn't
+    survive a fork, so a process that forked must call this again.   The 
+    buffers are also written out when python exits (but not through 
+    os._exit).
+
+  <Arguments>
+    flushfrequency:
+      The number of seconds between writing out the buffers.
+
+  <Exceptions>
+    None
+
+  <Returns>
+    None
+  """
+  global log_flusher
+  global registered_atexit
+
+  if log_flusher is not None and log_flusher.isAlive():
+    return
+
+  log_flusher = threading.Thread(target=_flush_buffered_loggers_periodically,
+      args=(flushfrequency,), name="LogFlusher")
+  log_flusher.setDaemon(True)
+  log_flusher.start()
+
+  if not registered_atexit:
+    atexit.register(flush_buffered_loggers)
+    registered_atexit = True
+
+
+
+def flush_buffered_loggers(timeout=None):
+  """
+  <Purpose>
+    Writes out the buffers of all circular loggers.
+
+  <Arguments>
+    timeout:
+      The maximum number of seconds to wait for a logger that is in use.
+      Its buffer is not written out if the time runs out.   None means to
+      wait as long as it takes.
+
+  <Exceptions>
+    As with file.write() if writing fails.
+
+  <Returns>
+    None
+  """
+  BUFFERED_LOGGERS_LOCK.acquire()
+  try:
+    bufferedloggers = BUFFERED_LOGGERS[:]
+  finally:
+    BUFFERED_LOGGERS_LOCK.release()
+
+  if timeout is not None:
+    deadline = time.time() + timeout
+
+  for logger in bufferedloggers:
+    if timeout is None:
+      logger.writelock.acquire()
+    elif not _acquire_lock_before(logger.writelock, deadline):
+      continue
+
+    try:
+      logger.write_buffer()
+    finally:
+      logger.writelock.release()
+
+
+
+def _acquire_lock_before(lock, deadline):
+  # Tries to acquire the lock until time.time() reaches the deadline.
+  # Returns True if the lock was acquired.
+  while not lock.acquire(False):
+    if time.time() >= deadline:
+      return False
+    time.sleep(0.001)
+  return True
+
+
+
+def _flush_buffered_loggers_periodically(flushfrequency):
+  # This is the log flusher thread
+  while True:
+    time.sleep(flushfrequency)
+    try:
+      flush_buffered_loggers()
+    except Exception:
+      # There is nowhere to log this.   The data is lost, just as if the
+      # write had failed
+      pass
+
+
+
 # used to implement the circular log buffer
 class circular_logger_core:
   """
@@ -82,10 +200,16 @@ class circular_logger_core:
     
     *not always on some systems because moving files isn't atomic
 
+    If a buffer size is given, writes are collected in memory and written to
+    the files once the buffer holds that many bytes, when flush() is called,
+    and by the log flusher thread (see start_log_flusher).   Only the data
+    that ends up in the files is written, so output that is overwritten
+    before the buffer is written out never reaches the disk.
+
   """
 
 
-  def __init__(self, fnp, mbs = 16 * 1024):
+  def __init__(self, fnp, mbs = 16 * 1024, buffersize = 0):
     # I do not use these.   This is merely for API convenience
     self.mode = None
     self.name = None
@@ -102,6 +226,19 @@ class circular_logger_core:
     # prevent race conditions when writing
     self.writelock = threading.Lock()
 
+    # the data that isn't written yet, how many bytes it has, and the number
+    # of bytes at which it is written out (0 writes every write right away)
+    self.pendingdata = []
+    self.pendingsize = 0
+    self.writebuffersize = buffersize
+
+    if buffersize > 0:
+      BUFFERED_LOGGERS_LOCK.acquire()
+      try:
+        BUFFERED_LOGGERS.append(self)
+      finally:
+        BUFFERED_LOGGERS_LOCK.release()
+
     
     # we need to set up the currentsize, activefo and first variables...
     if os.path.exists(self.newfn):
@@ -113,6 +250,7 @@ class circular_logger_core:
         self.currentsize = get_size(self.newfn)
         self.activefo = myfile(self.newfn,"a")
         self.first = False
+        self.finalsize = self.currentsize
         # now we have the fileobject and the size set up.   We're ready...
         return
 
@@ -123,6 +261,7 @@ class circular_logger_core:
         self.currentsize = 0
         self.activefo = myfile(self.newfn,"w")
         self.first = False
+        self.finalsize = self.currentsize
         return
 
     else:
@@ -133,6 +272,7 @@ class circular_logger_core:
         self.currentsize = get_size(self.oldfn)
         self.activefo = myfile(self.oldfn,"a")
         self.first = True
+        self.finalsize = self.currentsize
         # now we have the fileobject and the size set up.   We're ready...
         return
 
@@ -141,20 +281,25 @@ class circular_logger_core:
         self.currentsize = 0
         self.activefo = myfile(self.oldfn,"w")
         self.first = True
+        self.finalsize = self.currentsize
         return
 
 
 
 
-  # No-op
+  # The log stays open (others may still write), but the buffer is written out
   def close(self):
-    return 
+    return self.flush()
 
 
 
-  # No-op, I always flush myself
+  # Writes out the buffer (if there is one, I flush myself otherwise)
   def flush(self):
-    return
+    self.writelock.acquire()
+    try:
+      self.write_buffer()
+    finally:
+      self.writelock.release()
 
 
   def write(self,writeitem):
@@ -202,24 +347,74 @@ class circular_logger_core:
     
 
 
-  # I could write this in about 1/4 the code, but it would be much harder to 
-  # read.   
+  # Adds the data to the buffer (and writes the buffer out if it is full).
+  # Returns the amount of data that ends up in the log files.   The caller
+  # must hold the writelock.
   def writedata(self, data):
+    # every item is only made into a string once
+    data = str(data)
+    datasize = len(data)
+    totalsize = self.finalsize + datasize
+
+    # this is what currentsize will be once the buffer is written out.   (A
+    # write that exactly fills the file leaves it full.   The next byte
+    # rotates the logs.)
+    if totalsize <= self.maxbuffersize:
+      self.finalsize = totalsize
+    else:
+      self.finalsize = (totalsize - 1) % self.maxbuffersize + 1
+
+    if self.pendingsize + datasize < self.writebuffersize:
+      # keep it in the buffer
+      self.pendingdata.append(data)
+      self.pendingsize = self.pendingsize + datasize
+    elif self.pendingsize == 0:
+      # nothing is buffered (e.g. there is no buffer), so write it right away
+      self.writetofiles(data)
+    else:
+      # the buffer is full, write it out along with this
+      self.pendingdata.append(data)
+      self.write_buffer()
 
+    if totalsize <= self.maxbuffersize*2:
+      return datasize
+
+    # a really-long write only leaves its end in the files, so charge them
+    # for only that
+    return self.finalsize + self.maxbuffersize
+
+
+
+  # Writes the buffered data to the files.   The caller must hold the
+  # writelock.
+  def write_buffer(self):
+    if not self.pendingdata:
+      return
+
+    data = "".join(self.pendingdata)
+    self.pendingdata = []
+    self.pendingsize = 0
+    self.writetofiles(data)
+
+
+
+  # Writes the data to the files.   The caller must hold the writelock.
+  def writetofiles(self, data):
+    datasize = len(data)
 
     # first I'll dispose of the common case
-    if len(str(data)) + self.currentsize <= self.maxbuffersize:
-      # didn't fill the buffer
-      self.activefo.write(str(data))
+    if datasize + self.currentsize <= self.maxbuffersize:
+      # didn't fill the file
+      self.activefo.write(data)
       self.activefo.flush()
-      self.currentsize = self.currentsize + len(str(data))
-      return len(str(data))
+      self.currentsize = self.currentsize + datasize
+      return
 
     # now I'll deal with the "longer-but-still-fits case"
-    if len(str(data))+self.currentsize <= self.maxbuffersize*2:
+    if datasize + self.currentsize <= self.maxbuffersize*2:
       # finish off this file
       splitindex = self.maxbuffersize - self.currentsize
-      self.activefo.write(str(data[:splitindex]))
+      self.activefo.write(data[:splitindex])
       self.activefo.flush()
 
       # rotate logs
@@ -230,35 +425,23 @@ class circular_logger_core:
         self.rotate_log()
 
       # now write the last bit of data...
-      self.activefo.write(str(data[splitindex:]))
+      self.activefo.write(data[splitindex:])
       self.activefo.flush()
-      self.currentsize = len(str(data[splitindex:]))
-      return len(str(data))
+      self.currentsize = datasize - splitindex
+      return
+
+    # now the "really-long-write case".   The new file gets what is left
+    # after filling whole files (a full file if nothing is left) and the old
+    # file gets the maxbuffersize bytes before that.   Note, I'm going to
+    # avoid doing any extra "alignment" on the data.   In other words, if
+    # they write some multiple of 16KB, and they currently have a full file
+    # and a file with 7 bytes, they'll end up with a full file and a file
+    # with 7 bytes
+    lastchunk = (datasize + self.currentsize - 1) % self.maxbuffersize + 1
 
-    # now the "really-long-write case"
-    # Note, I'm going to avoid doing any extra "alignment" on the data.   In
-    # other words, if they write some multiple of 16KB, and they currently have
-    # a full file and a file with 7 bytes, they'll end up with a full file and
-    # a file with 7 bytes
-
-    datasize = len(str(data))
-
-    # this is what data the new file should contain (the old file will contain
-    # the 16KB of data before this)
-    lastchunk = (datasize + self.currentsize) % self.maxbuffersize
-
-    # I'm going to write the old file and new file now
-    #
     # Note: I break some of the guarantees about being able to 
     # recover disk state here 
     self.activefo.close()
-    if self.first: 
-      # remove existing files (unnecessary on some platforms)
-      os.remove(self.oldfn)
-    else:
-      # remove existing files (unnecessary on some platforms)
-      os.remove(self.oldfn)
-      os.remove(self.newfn)
 
     oldfo = myfile(self.oldfn,"w")
 
@@ -270,12 +453,10 @@ class circular_logger_core:
     self.activefo = myfile(self.newfn,"w")
 
     # now write the last bit of data...
-    self.activefo.write(str(data[-lastchunk:]))
+    self.activefo.write(data[-lastchunk:])
     self.activefo.flush()
-    self.currentsize = len(str(data[-lastchunk:]))
-
-    # charge them for only the data we actually wrote
-    return self.currentsize + self.maxbuffersize
+    self.currentsize = lastchunk
+    self.first = False
 
 
 
@@ -22,8 +22,8 @@
   dealing with have been wrapped by this namespace layer.
   
   All of our own api functions are wrapped in NamespaceAPIFunctionWrapper
-  objects whose wrapped_function() method is mapped in to the untrusted
-  code's context. When called, the wrapped_function() method performs
+  objects whose specialized function (see make_specialized_function()) is
+  mapped in to the untrusted code's context. When called, it performs
   argument, return value, and exception validation as well as additional
   wrapping and unwrapping, as needed, that is specific to the function
   that was ultimately being called. If the return value or raised exceptions
@@ -96,14 +96,15 @@
       are never actually allowed in untrusted code. Rather, each function that
       is wrapped has a single NamespaceAPIFunctionWrapper instance created
       when wrap_and_insert_api_functions() is called and what is actually made
-      available to the untrusted code is the wrapped_function() method of each
-      of the corresponding NamespaceAPIFunctionWrapper instances.
+      available to the untrusted code is the function returned by the
+      make_specialized_function() method of each of the corresponding
+      NamespaceAPIFunctionWrapper instances.
       
     NamespaceInternalError
     
       If this error is raised anywhere (along with any other unexpected exceptions),
       it should result in termination of the running program (see the except blocks
-      in NamespaceAPIFunctionWrapper.wrapped_function).
+      in NamespaceAPIFunctionWrapper.wrapped_function and make_specialized_function).
 """
 
 import types
@@ -146,7 +147,7 @@ def wrap_and_insert_api_functions(usercontext):
   for function_name in USERCONTEXT_WRAPPER_INFO:
     function_info = USERCONTEXT_WRAPPER_INFO[function_name]
     wrapperobj = NamespaceAPIFunctionWrapper(function_info)
-    usercontext[function_name] = wrapperobj.wrapped_function
+    usercontext[function_name] = wrapperobj.make_specialized_function()
 
 
 
@@ -201,7 +202,7 @@ def _prepare_wrapped_functions_for_object_wrappers():
     for function_name in description_dict:
       function_info = description_dict[function_name]
       wrapperobj = NamespaceAPIFunctionWrapper(function_info, is_method=True)
-      wrapped_func_dict[function_name] = wrapperobj.wrapped_function
+      wrapped_func_dict[function_name] = wrapperobj.make_specialized_function()
 
 
 
@@ -259,9 +260,18 @@ class ValueProcessor(BaseProcessor):
   the namespace layer.
   """
 
+  # Values whose type is exactly one of these are returned unchanged by
+  # copy() and checking their type again is unnecessary, so the wrappers
+  # only call check_value() on them (see _make_arg_processor).
+  immutable_types = frozenset()
+
   def check(self):
     raise NotImplementedError
 
+  def check_value(self, val):
+    """Checks a value of one of the immutable_types beyond its type."""
+    pass
+
   def copy(self, val):
     return _copy(val)
 
@@ -289,6 +299,8 @@ class ObjectProcessor(BaseProcessor):
 class Str(ValueProcessor):
   """Allows str or unicode."""
 
+  immutable_types = frozenset([str, unicode])
+
   def __init__(self, maxlen=None, minlen=None):
     self.maxlen = maxlen
     self.minlen = minlen
@@ -299,6 +311,11 @@ class Str(ValueProcessor):
     if not _is_in(type(val), [str, unicode]):
       raise RepyArgumentError("Invalid type %s" % type(val))
 
+    self.check_value(val)
+
+
+
+  def check_value(self, val):
     if self.maxlen is not None:
       if len(val) > self.maxlen:
         raise RepyArgumentError("Max string length is %s" % self.maxlen)
@@ -314,6 +331,8 @@ class Str(ValueProcessor):
 class Int(ValueProcessor):
   """Allows int or long."""
 
+  immutable_types = frozenset([int, long])
+
   def __init__(self, min=0):
     self.min = min
 
@@ -323,6 +342,11 @@ class Int(ValueProcessor):
     if not _is_in(type(val), [int, long]):
       raise RepyArgumentError("Invalid type %s" % type(val))
 
+    self.check_value(val)
+
+
+
+  def check_value(self, val):
     if val < self.min:
       raise RepyArgumentError("Min value is %s." % self.min)
 
@@ -331,6 +355,8 @@ class NoneOrInt(ValueProcessor):
   """Allows a NoneType or an int. This doesn't enforce min limit on the
   ints."""
 
+  immutable_types = frozenset([types.NoneType, int, long])
+
   def check(self, val):
     if val is not None and not _is_in(type(val), [int, long]):
       raise RepyArgumentError("Invalid type %s" % type(val))
@@ -344,6 +370,8 @@ class StrOrInt(ValueProcessor):
   """Allows a string or int. This doesn't enforce max/min/length limits on the
   strings and ints."""
 
+  immutable_types = frozenset([int, long, str, unicode])
+
   def check(self, val):
     if not _is_in(type(val), [int, long, str, unicode]):
       raise RepyArgumentError("Invalid type %s" % type(val))
@@ -355,6 +383,8 @@ class StrOrInt(ValueProcessor):
 class Float(ValueProcessor):
   """Allows float, int, or long."""
 
+  immutable_types = frozenset([int, long, float])
+
   def __init__(self, allow_neg=False):
     self.allow_neg = allow_neg
 
@@ -364,6 +394,11 @@ class Float(ValueProcessor):
     if not _is_in(type(val), [int, long, float]):
       raise RepyArgumentError("Invalid type %s" % type(val))
 
+    self.check_value(val)
+
+
+
+  def check_value(self, val):
     if not self.allow_neg:
       if val < 0:
         raise RepyArgumentError("Must be non-negative.")
@@ -375,6 +410,8 @@ class Float(ValueProcessor):
 class Bool(ValueProcessor):
   """Allows bool."""
 
+  immutable_types = frozenset([bool])
+
   def check(self, val):
     if type(val) is not bool:
       raise RepyArgumentError("Invalid type %s" % type(val))
@@ -398,6 +435,28 @@ class ListOfStr(ValueProcessor):
 
 
 
+class ListOfMessages(ValueProcessor):
+  """Allows lists of (ip, port, message) tuples, as taken by sendmessages and
+  returned by getmessages. Lists are allowed in place of the tuples. This
+  doesn't enforce max/min/length limits on the strings and ints."""
+
+  def check(self, val):
+    if not type(val) is list:
+      raise RepyArgumentError("Invalid type %s" % type(val))
+
+    strprocessor = Str()
+    intprocessor = Int()
+    for item in val:
+      if not _is_in(type(item), [tuple, list]) or len(item) != 3:
+        raise RepyArgumentError("Messages must be (ip, port, message) tuples")
+      strprocessor.check(item[0])
+      intprocessor.check(item[1])
+      strprocessor.check(item[2])
+
+
+
+
+
 class List(ValueProcessor):
   """Allows lists. The list may contain anything."""
   
@@ -609,6 +668,10 @@ USERCONTEXT_WRAPPER_INFO = {
       {'func' : emulcomm.sendmessage,
        'args' : [Str(), Int(), Str(), Str(), Int()],
        'return' : Int()},
+  'sendmessages' :
+      {'func' : emulcomm.sendmessages,
+       'args' : [ListOfMessages(), Str(), Int()],
+       'return' : Int()},
   'listenformessage' :
       {'func' : emulcomm.listenformessage,
        'args' : [Str(), Int()],
@@ -705,6 +768,14 @@ TCP_SOCKET_OBJECT_WRAPPER_INFO = {
       {'func' : emulcomm.EmulatedSocket.send,
        'args' : [Str()],
        'return' : Int(min=0)},
+  'waitforrecv' :
+      {'func' : emulcomm.EmulatedSocket.waitforrecv,
+       'args' : [Float()],
+       'return' : Bool()},
+  'waitforsend' :
+      {'func' : emulcomm.EmulatedSocket.waitforsend,
+       'args' : [Float()],
+       'return' : Bool()},
 }
 
 # TODO: Figure out which real object should be wrapped. It doesn't appear
@@ -718,6 +789,10 @@ TCP_SERVER_SOCKET_OBJECT_WRAPPER_INFO = {
       {'func' : emulcomm.TCPServerSocket.getconnection,
        'args' : [],
        'return' : (Str(), Int(), TCPSocket())},
+  'waitforconnection' :
+      {'func' : emulcomm.TCPServerSocket.waitforconnection,
+       'args' : [Float()],
+       'return' : Bool()},
 }
 
 UDP_SERVER_SOCKET_OBJECT_WRAPPER_INFO = {
@@ -729,6 +804,14 @@ UDP_SERVER_SOCKET_OBJECT_WRAPPER_INFO = {
       {'func' : emulcomm.UDPServerSocket.getmessage,
        'args' : [],
        'return' : (Str(), Int(), Str())},
+  'getmessages' :
+      {'func' : emulcomm.UDPServerSocket.getmessages,
+       'args' : [Int(min=1)],
+       'return' : ListOfMessages()},
+  'waitformessage' :
+      {'func' : emulcomm.UDPServerSocket.waitformessage,
+       'args' : [Float()],
+       'return' : Bool()},
 }
 
 LOCK_OBJECT_WRAPPER_INFO = {
@@ -761,7 +844,34 @@ VIRTUAL_NAMESPACE_OBJECT_WRAPPER_INFO = {
 # The classes we define from which actual wrappers are instantiated.
 ##############################################################################
 
-def _copy(obj, objectmap=None):
+# Objects of these types are returned unchanged by _copy. types.InstanceType
+# is included because the user can provide an instance of a class of their
+# own in the list of callback args to settimer. (Type objects compare by
+# identity, so membership tests on this set are identity checks.)
+_COPY_IMMUTABLE_TYPES = frozenset([str, unicode, int, long, float, complex, bool,
+                                   frozenset, types.NoneType, types.FunctionType,
+                                   types.LambdaType, types.MethodType,
+                                   types.InstanceType])
+
+# The containers _copy copies and how it does so.
+_COPY_LIST = 0
+_COPY_DICT = 1
+_COPY_TUPLE = 2
+_COPY_SET = 3
+_COPY_CONTAINER_KINDS = {list : _COPY_LIST, dict : _COPY_DICT,
+                         tuple : _COPY_TUPLE, set : _COPY_SET}
+
+# Indexes into the frames _copy keeps for each container it is copying.
+_FRAME_KIND = 0
+_FRAME_ORIGINAL = 1
+_FRAME_COPY = 2      # The new list or dict, or a list of the copied items
+_FRAME_ITEMS = 3     # The items to copy (keys and values alternate for dicts)
+_FRAME_INDEX = 4     # The next item to copy
+_FRAME_KEY = 5       # The copied key of the dict item being copied
+
+
+
+def _copy(obj):
   """
   <Purpose>
     Create a deep copy of an object without using the python 'copy' module.
@@ -770,9 +880,6 @@ def _copy(obj, objectmap=None):
   <Arguments>
     obj
       The object to make a deep copy of.
-    objectmap
-      A mapping between original objects and the corresponding copy. This is
-      used to handle circular references.
   <Exceptions>
     TypeError
       If an object is encountered that we don't know how to make a copy of.
@@ -782,104 +889,200 @@ def _copy(obj, objectmap=None):
       function call.
   <Side Effects>
     A new reference is created to every non-simple type of object. That is,
-    everything except objects of type str, unicode, int, etc.
+    everything except objects of type str, unicode, int, etc. and tuples that
+    only contain such objects.
   <Returns>
     The deep copy of obj with circular/recursive references preserved.
   """
+  if type(obj) in _COPY_IMMUTABLE_TYPES:
+    return obj
+
   try:
-    # If this is a top-level call to _copy, create a new objectmap for use
-    # by recursive calls to _copy.
-    if objectmap is None:
-      objectmap = {}
-    # If this is a circular reference, use the copy we already made.
-    elif _saved_id(obj) in objectmap:
-      return objectmap[_saved_id(obj)]
-
-    # types.InstanceType is included because the user can provide an instance
-    # of a class of their own in the list of callback args to settimer.
-    if _is_in(type(obj), [str, unicode, int, long, float, complex, bool, frozenset,
-                          types.NoneType, types.FunctionType, types.LambdaType,
-                          types.MethodType, types.InstanceType]):
-      return obj
-
-    elif type(obj) is list:
-      temp_list = []
-      # Need to save this in the objectmap before recursing because lists
-      # might have circular references.
-      objectmap[_saved_id(obj)] = temp_list
-
-      for item in obj:
-        temp_list.append(_copy(item, objectmap))
-
-      return temp_list
-
-    elif type(obj) is tuple:
-      temp_list = []
-
-      for item in obj:
-        temp_list.append(_copy(item, objectmap))
-
-      # I'm not 100% confident on my reasoning here, so feel free to point
-      # out where I'm wrong: There's no way for a tuple to directly contain
-      # a circular reference to itself. Instead, it has to contain, for
-      # example, a dict which has the same tuple as a value. In that
-      # situation, we can avoid infinite recursion and properly maintain
-      # circular references in our copies by checking the objectmap right
-      # after we do the copy of each item in the tuple. The existence of the
-      # dictionary would keep the recursion from being infinite because those
-      # are properly handled. That just leaves making sure we end up with
-      # only one copy of the tuple. We do that here by checking to see if we
-      # just made a copy as a result of copying the items above. If so, we
-      # return the one that's already been made.
-      if _saved_id(obj) in objectmap:
-        return objectmap[_saved_id(obj)]
-
-      retval = tuple(temp_list)
-      objectmap[_saved_id(obj)] = retval
-      return retval
-
-    elif type(obj) is set:
-      temp_list = []
-      # We can't just store this list object in the objectmap because it isn't
-      # a set yet. If it's possible to have a set contain a reference to
-      # itself, this could result in infinite recursion. However, sets can
-      # only contain hashable items so I believe this can't happen.
-
-      for item in obj:
-        temp_list.append(_copy(item, objectmap))
-
-      retval = set(temp_list)
-      objectmap[_saved_id(obj)] = retval
-      return retval
-
-    elif type(obj) is dict:
-      temp_dict = {}
-      # Need to save this in the objectmap before recursing because dicts
-      # might have circular references.
-      objectmap[_saved_id(obj)] = temp_dict
-
-      for key, value in obj.items():
-        temp_key = _copy(key, objectmap)
-        temp_dict[temp_key] = _copy(value, objectmap)
-
-      return temp_dict
+    return _copy_containers(obj)
+  except Exception, e:
+    raise NamespaceInternalError("_copy failed on " + str(obj) + " with message " + str(e))
+
+
+
+def _copy_containers(obj):
+  """
+  The part of _copy that copies containers. This walks the containers with
+  an explicit stack of frames (see _FRAME_*) instead of recursing, so deep
+  nesting doesn't hit the recursion limit.
+  """
+  # A mapping between the ids of original objects and the corresponding copy.
+  # This is used to handle circular and repeated references. A container can
+  # only be reached twice if there are nested containers, so this is only
+  # created once we see the first one.
+  objectmap = None
+
+  stack = []
+  value = obj
+
+  while True:
+    # Either find the copy of value or start copying it (push a frame)
+    valuetype = type(value)
+    pushed = False
+
+    if valuetype in _COPY_IMMUTABLE_TYPES:
+      copied = value
+
+    elif valuetype is tuple and _is_immutable_tuple(value):
+      # These can't be part of a circular reference, so they don't need to
+      # be in the objectmap either.
+      copied = value
+
+    elif valuetype in _COPY_CONTAINER_KINDS:
+      if objectmap is None and stack:
+        # Lists and dicts are in the objectmap while their items are being
+        # copied because they might have circular references.
+        objectmap = {}
+        for frame in stack:
+          if frame[_FRAME_KIND] is _COPY_LIST or frame[_FRAME_KIND] is _COPY_DICT:
+            objectmap[_saved_id(frame[_FRAME_ORIGINAL])] = frame[_FRAME_COPY]
+
+      if objectmap is not None and _saved_id(value) in objectmap:
+        copied = objectmap[_saved_id(value)]
+
+      else:
+        kind = _COPY_CONTAINER_KINDS[valuetype]
+        if kind is _COPY_LIST:
+          newcontainer = []
+          items = value
+        elif kind is _COPY_DICT:
+          newcontainer = {}
+          items = []
+          for key, item in value.items():
+            items.append(key)
+            items.append(item)
+        elif kind is _COPY_TUPLE:
+          newcontainer = []
+          items = value
+        else:
+          # We can't put a set in the objectmap before its items are copied.
+          # If it's possible to have a set contain a reference to itself, this
+          # could result in an endless loop. However, sets can only contain
+          # hashable items so I believe this can't happen.
+          newcontainer = []
+          items = list(value)
+
+        if objectmap is not None and (kind is _COPY_LIST or kind is _COPY_DICT):
+          objectmap[_saved_id(value)] = newcontainer
+
+        stack.append([kind, value, newcontainer, items, 0, None])
+        pushed = True
+        copied = None
 
     # We don't copy certain objects. This is because copying an emulated file
     # object, for example, will cause the destructor of the original one to
     # be invoked, which will close the actual underlying file. As the object
     # is wrapped and the client does not have access to it, it's safe to not
     # wrap it.
-    elif isinstance(obj, (NamespaceObjectWrapper, emulfile.emulated_file,
-                          emulcomm.EmulatedSocket, emulcomm.TCPServerSocket,
-                          emulcomm.UDPServerSocket, thread.LockType,
-                          virtual_namespace.VirtualNamespace)):
-      return obj
+    elif isinstance(value, (NamespaceObjectWrapper, emulfile.emulated_file,
+                            emulcomm.EmulatedSocket, emulcomm.TCPServerSocket,
+                            emulcomm.UDPServerSocket, thread.LockType,
+                            virtual_namespace.VirtualNamespace)):
+      copied = value
 
     else:
-      raise TypeError("_copy is not implemented for objects of type " + str(type(obj)))
+      raise TypeError("_copy is not implemented for objects of type " + str(valuetype))
+
+    if not stack:
+      return copied
+
+    # Unless we just pushed a frame, hand the copy to the container it is in.
+    # Then continue with the next item that isn't immutable, finishing the 
+    # containers that have no items left.
+    frame = stack[-1]
+    if not pushed:
+      _copy_add_item(frame, copied)
+
+    while True:
+      kind = frame[_FRAME_KIND]
+      items = frame[_FRAME_ITEMS]
+      index = frame[_FRAME_INDEX]
+      itemcount = len(items)
+
+      # Immutable items are added right away
+      newcontainer = frame[_FRAME_COPY]
+      if kind is not _COPY_DICT:
+        while index < itemcount and type(items[index]) in _COPY_IMMUTABLE_TYPES:
+          newcontainer.append(items[index])
+          index += 1
+      elif index % 2 == 0:
+        while index < itemcount and type(items[index]) in _COPY_IMMUTABLE_TYPES \
+            and type(items[index + 1]) in _COPY_IMMUTABLE_TYPES:
+          newcontainer[items[index]] = items[index + 1]
+          index += 2
+
+      if index < itemcount:
+        value = items[index]
+        frame[_FRAME_INDEX] = index + 1
+        break
+
+      # The container is done
+      stack.pop()
+      copied = _copy_finish_container(frame, objectmap)
+      if not stack:
+        return copied
+
+      frame = stack[-1]
+      _copy_add_item(frame, copied)
+
+
+
+def _is_immutable_tuple(obj):
+  """Returns True if the tuple only contains objects _copy doesn't copy."""
+  for item in obj:
+    if type(item) not in _COPY_IMMUTABLE_TYPES:
+      return False
+  return True
+
+
+
+def _copy_add_item(frame, copied):
+  """Adds the copy of the item that was last taken from the frame's items."""
+  if frame[_FRAME_KIND] is _COPY_DICT:
+    # Keys and values alternate, so an odd index means we copied a key.
+    if frame[_FRAME_INDEX] % 2 == 1:
+      frame[_FRAME_KEY] = copied
+    else:
+      frame[_FRAME_COPY][frame[_FRAME_KEY]] = copied
+  else:
+    frame[_FRAME_COPY].append(copied)
 
-  except Exception, e:
-    raise NamespaceInternalError("_copy failed on " + str(obj) + " with message " + str(e))
+
+
+def _copy_finish_container(frame, objectmap):
+  """Returns the copy of a container whose items have all been copied."""
+  kind = frame[_FRAME_KIND]
+  original = frame[_FRAME_ORIGINAL]
+
+  if kind is _COPY_LIST or kind is _COPY_DICT:
+    return frame[_FRAME_COPY]
+
+  if kind is _COPY_TUPLE:
+    # There's no way for a tuple to directly contain a circular reference
+    # to itself. Instead, it has to contain, for example, a dict which has
+    # the same tuple as a value. In that situation the tuple was copied while
+    # copying its items, and we must end up with only one copy of it.
+    if objectmap is not None and _saved_id(original) in objectmap:
+      return objectmap[_saved_id(original)]
+
+    # A tuple whose items were all returned unchanged is immutable itself.
+    copieditems = frame[_FRAME_COPY]
+    retval = original
+    for index in range(len(copieditems)):
+      if copieditems[index] is not original[index]:
+        retval = tuple(copieditems)
+        break
+
+  else:
+    retval = set(frame[_FRAME_COPY])
+
+  if objectmap is not None:
+    objectmap[_saved_id(original)] = retval
+  return retval
 
 
 
@@ -1010,12 +1213,68 @@ class NamespaceObjectWrapper(object):
 
 
 
+def _make_arg_processor(arg_type):
+  """
+  Returns a function that does what NamespaceAPIFunctionWrapper._process_args
+  does for a single argument of type arg_type: it returns the copied or
+  unwrapped argument after checking it. Values of one of the immutable_types
+  of a ValueProcessor are neither copied (_copy would return them unchanged)
+  nor have their type checked twice.
+  """
+  check = arg_type.check
+
+  if isinstance(arg_type, ObjectProcessor):
+    unwrap = arg_type.unwrap
+    def process_object_arg(val):
+      temparg = unwrap(val)
+      check(temparg)
+      return temparg
+    return process_object_arg
+
+  if not isinstance(arg_type, ValueProcessor):
+    raise NamespaceInternalError("Unknown argument expectation.")
+
+  copy = arg_type.copy
+  def process_value_arg(val):
+    temparg = copy(val)
+    check(temparg)
+    return temparg
+
+  # Processors that override copy() may not return immutable values unchanged
+  immutable_types = arg_type.immutable_types
+  if not immutable_types or type(arg_type).copy.im_func is not ValueProcessor.copy.im_func:
+    return process_value_arg
+
+  # The type is the only thing checked for these.   (Type objects compare
+  # by identity, so the set lookup is an identity check.)
+  if type(arg_type).check_value.im_func is ValueProcessor.check_value.im_func:
+    def process_immutable_arg(val):
+      if type(val) in immutable_types:
+        return val
+      return process_value_arg(val)
+    return process_immutable_arg
+
+  check_value = arg_type.check_value
+  def process_checked_immutable_arg(val):
+    if type(val) in immutable_types:
+      check_value(val)
+      return val
+    return process_value_arg(val)
+  return process_checked_immutable_arg
+
+
+
+
+
 class NamespaceAPIFunctionWrapper(object):
   """
   Instances of this class exist solely to provide function wrapping. This is
   done by creating an instance of the class and then making available the
-  instance's wrapped_function() method to any code that should only be allowed
-  to call the wrapped version of the function.
+  function returned by the instance's make_specialized_function() method to
+  any code that should only be allowed to call the wrapped version of the
+  function. That function behaves exactly like the wrapped_function() method
+  but does the per-call work that depends on the wrapped function's
+  signature only once, when it is created.
   """
 
   def __init__(self, func_dict, is_method=False):
@@ -1136,12 +1395,147 @@ class NamespaceAPIFunctionWrapper(object):
 
 
 
+  def _make_retval_processor(self):
+    """
+    Returns a function that does what _process_retval does. Return values
+    that are None or of one of the immutable_types of the return value's
+    ValueProcessor are checked directly. Everything else, including every
+    return value that is not allowed, is handled by _process_retval.
+    """
+    process_retval = self._process_retval
+    processor = self.__return
+
+    if processor is None:
+      def process_none_retval(retval):
+        if retval is None:
+          return None
+        return process_retval(retval)
+      return process_none_retval
+
+    if not isinstance(processor, ValueProcessor) or not processor.immutable_types or \
+        type(processor).copy.im_func is not ValueProcessor.copy.im_func:
+      return process_retval
+
+    immutable_types = processor.immutable_types
+    check_value = processor.check_value
+    def process_immutable_retval(retval):
+      if type(retval) in immutable_types:
+        try:
+          check_value(retval)
+        except RepyArgumentError:
+          return process_retval(retval)
+        return retval
+      return process_retval(retval)
+    return process_immutable_retval
+
+
+
+  def make_specialized_function(self):
+    """
+    <Purpose>
+      Creates the function that is made available to untrusted code. It acts
+      exactly like wrapped_function(), but the argument and return value
+      processing is prepared for this function's signature in advance and
+      immutable arguments are not copied.
+    <Arguments>
+      self
+    <Exceptions>
+      NamespaceInternalError if an argument expectation is unknown.
+    <Side Effects>
+      None
+    <Returns>
+      The specialized function.
+    """
+    func = self.__func
+    func_name = self.__func_name
+    is_method = self.__is_method
+    expected_arg_count = len(self.__args)
+
+    # Arguments at and after a NonCopiedVarArgs are passed on unchanged, so
+    # only the ones before it need to be processed.
+    takes_varargs = bool(self.__args) and isinstance(self.__args[-1], NonCopiedVarArgs)
+    if takes_varargs:
+      arg_processors = map(_make_arg_processor, self.__args[:-1])
+    else:
+      arg_processors = map(_make_arg_processor, self.__args)
+    processed_arg_count = len(arg_processors)
+
+    process_retval = self._make_retval_processor()
+
+    # The types allowed for the "self" argument of methods
+    self_types = (NamespaceObjectWrapper, emulfile.emulated_file,
+                  emulcomm.EmulatedSocket, emulcomm.TCPServerSocket,
+                  emulcomm.UDPServerSocket, thread.LockType,
+                  virtual_namespace.VirtualNamespace)
+
+    def process_args(args):
+      if is_method:
+        args_to_check = args[1:]
+      else:
+        args_to_check = args
+
+      if len(args_to_check) != expected_arg_count and not takes_varargs:
+        raise RepyArgumentError("Function '" + func_name + 
+            "' takes " + str(expected_arg_count) + " arguments, not " + 
+            str(len(args_to_check)) + " as you provided.")
+
+      args_copy = []
+      for index in range(min(len(args_to_check), processed_arg_count)):
+        args_copy.append(arg_processors[index](args_to_check[index]))
+      args_copy.extend(args_to_check[processed_arg_count:])
+      return args_copy
+
+    # See wrapped_function() for what the three kinds of functions are.
+    if type(func) is str:
+      def specialized_function(*args, **kwargs):
+        try:
+          if kwargs:
+            raise RepyArgumentError("Keyword arguments not allowed when calling %s." %
+                                    func_name)
+          args_copy = process_args(args)
+          return process_retval(_saved_getattr(args[0], func)(*args_copy))
+        except RepyException:
+          raise
+        except:
+          _handle_internalerror("Unexpected exception from within Repy API", 843)
+
+    elif is_method:
+      def specialized_function(*args, **kwargs):
+        try:
+          if kwargs:
+            raise RepyArgumentError("Keyword arguments not allowed when calling %s." %
+                                    func_name)
+          args_copy = process_args(args)
+          if not isinstance(args[0], self_types):
+            raise NamespaceInternalError("Wrong type for 'self' argument.")
+          return process_retval(func(args[0], *args_copy))
+        except RepyException:
+          raise
+        except:
+          _handle_internalerror("Unexpected exception from within Repy API", 843)
+
+    else:
+      def specialized_function(*args, **kwargs):
+        try:
+          if kwargs:
+            raise RepyArgumentError("Keyword arguments not allowed when calling %s." %
+                                    func_name)
+          return process_retval(func(*process_args(args)))
+        except RepyException:
+          raise
+        except:
+          _handle_internalerror("Unexpected exception from within Repy API", 843)
+
+    return specialized_function
+
+
+
   def wrapped_function(self, *args, **kwargs):
     """
     <Purpose>
       Act as the function that is wrapped but perform all required sanitization
       and checking of data that goes into and comes out of the underlying
-      function.
+      function. make_specialized_function() creates a faster equivalent.
     <Arguments>
       self
       *args
@@ -37,6 +37,9 @@ import resource_constants
 
 import threading
 
+# Threads waiting for a resource are kept in a queue
+from collections import deque
+
 
 
 # I'm going to global information about the resources allowed and used...
@@ -47,6 +50,33 @@ _resources_allowed_dict = None
 _resources_consumed_dict = None
 
 
+# Charges of renewable resources made with tattle_quantity_batched that are
+# not yet in the consumption table.   Each thread keeps its own dict (in
+# _pending_charges_local.charges) that maps the resource to [amount, time of
+# the first pending charge], so that batching a charge takes no lock.   Only
+# the thread that owns a dict changes it while the thread is alive.   The 
+# charges are added to the table by the thread that made them, when it exits
+# (see flush_pending_charges) or by the sweeper thread after the thread exited.
+_pending_charges_local = threading.local()
+
+# A list of (thread, dict of pending charges) for every thread that has 
+# batched a charge.   A thread adds itself once, on its first batched charge.
+_pending_charges_list = []
+
+# Protects _pending_charges_list (but not the dicts in it).
+_pending_charges_lock = threading.Lock()
+
+# The thread that adds old pending charges to the consumption table
+_pending_charge_sweeper = None
+
+# Pending charges are added to the consumption table once this much time
+# (in seconds) has passed since the first one...
+BATCHED_TATTLE_INTERVAL = 0.1
+
+# ... or once they exceed this fraction of the resource's per second limit
+BATCHED_TATTLE_LIMIT_FRACTION = 0.1
+
+
 
 
 
@@ -84,24 +114,72 @@ def _update_resource_consumption_table(resource, resource_allowed_dict, consumed
 
 
 
-# I want to wait until a resource can be used again...
+# The amount of a renewable resource that may be used before threads have to
+# wait for it to drain.
+def _get_resource_capacity(resource, resourcesalloweddict, resourcesuseddict):
+  return resourcesalloweddict[resource] * resourcesuseddict['renewable_burst'][resource]
+
+
+
+# I want to wait until a resource can be used again...   Threads wait in 
+# arrival order.   Only the first waiting thread sleeps until the resource
+# drains, the others wait until it wakes them.   The caller must hold the
+# resource's lock, which is released while waiting and held again on return.
 def _sleep_until_resource_drains(resource, resourcesalloweddict, resourcesuseddict):
 
   # It'll never drain!
   if resourcesalloweddict[resource] == 0:
     raise InternalRepyError, "Resource '"+resource+"' limit set to 0, won't drain!"
-    
 
-  # We may need to go through this multiple times because other threads may
-  # also block and consume resources.
-  while resourcesuseddict[resource] > resourcesalloweddict[resource]:
+  resourcelock = resourcesuseddict['renewable_locks'][resource]
+  waitqueue = resourcesuseddict['renewable_waiters'][resource]
+  capacity = _get_resource_capacity(resource, resourcesalloweddict, resourcesuseddict)
 
-    # Sleep until we're expected to be under quota
-    sleeptime = (resourcesuseddict[resource] - resourcesalloweddict[resource]) / resourcesalloweddict[resource]
+  # Nobody is ahead of us and there is capacity, so we don't need to wait.
+  if len(waitqueue) == 0 and resourcesuseddict[resource] <= capacity:
+    return
 
-    time.sleep(sleeptime)
+  # Get in line.   The event is set when we get to the front of the queue.
+  myturn = threading.Event()
+  waitqueue.append(myturn)
+  if waitqueue[0] is myturn:
+    myturn.set()
 
-    _update_resource_consumption_table(resource, resourcesalloweddict, resourcesuseddict)
+  resourcelock.release()
+  holdinglock = False
+  try:
+    myturn.wait()
+
+    # We are at the front, so sleep until we're expected to be under quota.
+    # New threads queue up behind us, so we only need to check again in case
+    # some charges were made without waiting (e.g. by a thread that was
+    # already running).
+    while True:
+      resourcelock.acquire()
+      holdinglock = True
+      _update_resource_consumption_table(resource, resourcesalloweddict, resourcesuseddict)
+      if resourcesuseddict[resource] <= capacity:
+        break
+
+      sleeptime = (resourcesuseddict[resource] - capacity) / resourcesalloweddict[resource]
+      resourcelock.release()
+      holdinglock = False
+
+      time.sleep(sleeptime)
+
+  except:
+    # Don't hold up the threads behind us if something went wrong
+    if not holdinglock:
+      resourcelock.acquire()
+    waitqueue.remove(myturn)
+    if len(waitqueue) > 0:
+      waitqueue[0].set()
+    raise
+
+  # Let the next thread in line take its turn (we hold the lock again)
+  waitqueue.popleft()
+  if len(waitqueue) > 0:
+    waitqueue[0].set()
 
 
 
@@ -148,6 +226,18 @@ def _create_resource_consumption_dict():
   for init_resource in resource_constants.renewable_resources:
     returned_resource_dict['renewable_locks'][init_resource] = threading.Lock()
 
+  # Threads that wait for a renewable resource to drain queue up here...
+  returned_resource_dict['renewable_waiters'] = {}
+  for init_resource in resource_constants.renewable_resources:
+    returned_resource_dict['renewable_waiters'][init_resource] = deque()
+
+  # ... until the resource is below its limit times its burst size (the 
+  # number of seconds worth of the resource that can be used at once).
+  # start_resource_nanny sets these from the resource file.
+  returned_resource_dict['renewable_burst'] = {}
+  for init_resource in resource_constants.renewable_resources:
+    returned_resource_dict['renewable_burst'][init_resource] = 1.0
+
 
   # I also need to track when the last update of a renewable resource occurred
   returned_resource_dict['renewable_update_time'] = {}
@@ -197,6 +287,13 @@ def _tattle_quantity(resource, quantity, resourcesalloweddict, resourcesuseddict
     # enabled. -Brent
     tracebackrepy.handle_internalerror("Resource '" + resource + 
         "' has a negative quantity " + str(quantity) + "!", 132)
+
+  # If we only need to check for capacity, do it without the lock.   The
+  # table only decreases when it is updated, so if the value that is there
+  # is under the limit, the updated one is as well and we wouldn't block
+  # (unless other threads are already waiting).
+  if quantity == 0 and len(resourcesuseddict['renewable_waiters'][resource]) == 0 and resourcesuseddict[resource] <= _get_resource_capacity(resource, resourcesalloweddict, resourcesuseddict):
+    return
     
   # get the lock for this resource
   resourcesuseddict['renewable_locks'][resource].acquire()
@@ -228,6 +325,140 @@ def _tattle_quantity(resource, quantity, resourcesalloweddict, resourcesuseddict
 
 
 
+# Like _tattle_quantity, but the charge is collected with other charges of
+# this thread and only added to the consumption table once enough has
+# accumulated.   This avoids taking the resource lock on every call.
+def _tattle_quantity_batched(resource, quantity, resourcesalloweddict, resourcesuseddict):
+  """
+   <Purpose>
+      Notify the nanny of the consumption of a renewable resource, in a way
+      suitable for frequent small charges (e.g. network or file I/O).   The
+      charge is accumulated with earlier charges of the same thread.   The
+      total is tattled once it exceeds BATCHED_TATTLE_LIMIT_FRACTION of the
+      resource's limit or BATCHED_TATTLE_INTERVAL has passed since the first
+      pending charge.
+
+   <Arguments>
+      resource:
+         A string with the resource name.   
+      quantity:
+         The amount consumed.   This must not be negative.   Use
+         tattle_quantity with 0 to block until there is capacity.
+
+   <Exceptions>
+      None.
+
+   <Side Effects>
+      May sleep the program until the resource is available.
+
+   <Returns>
+      None.
+  """
+  thetime = nonportable.getruntime()
+  threadcharges = _get_thread_pending_charges()
+
+  if resource in threadcharges:
+    pending = threadcharges[resource]
+    pending[0] = pending[0] + quantity
+  else:
+    pending = [quantity, thetime]
+    threadcharges[resource] = pending
+
+  # Not enough yet to be worth a trip to the consumption table
+  if pending[0] < resourcesalloweddict[resource] * BATCHED_TATTLE_LIMIT_FRACTION and thetime - pending[1] < BATCHED_TATTLE_INTERVAL:
+    return
+
+  # Take the charge out of the pending charges first, so that it isn't 
+  # counted twice by get_resource_information while we may block
+  del threadcharges[resource]
+
+  _tattle_quantity(resource, pending[0], resourcesalloweddict, resourcesuseddict)
+
+
+
+# Returns the dict of pending charges of the current thread, adding it to
+# _pending_charges_list the first time.
+def _get_thread_pending_charges():
+  try:
+    return _pending_charges_local.charges
+  except AttributeError:
+    pass
+
+  threadcharges = {}
+  _pending_charges_lock.acquire()
+  try:
+    _pending_charges_list.append((threading.currentThread(), threadcharges))
+  finally:
+    _pending_charges_lock.release()
+
+  _pending_charges_local.charges = threadcharges
+  return threadcharges
+
+
+
+# Adds a charge to the consumption table without waiting for the resource to
+# drain.   This is used for pending charges that are added for another thread
+# (or for a thread that is about to exit).   The next thread that uses the 
+# resource waits for it instead.
+def _add_to_consumption_table(resource, quantity, resourcesalloweddict, resourcesuseddict):
+  resourcesuseddict['renewable_locks'][resource].acquire()
+  try:
+    _update_resource_consumption_table(resource, resourcesalloweddict, resourcesuseddict)
+    resourcesuseddict[resource] = resourcesuseddict[resource] + quantity
+  finally:
+    resourcesuseddict['renewable_locks'][resource].release()
+
+
+
+# Adds the charges in threadcharges to the consumption table and removes them
+# from it.   This must only be called by the thread that owns threadcharges,
+# or once that thread exited.
+def _flush_pending_charges(threadcharges, resourcesalloweddict, resourcesuseddict):
+  for resource in threadcharges.keys():
+    pending = threadcharges.pop(resource)
+    _add_to_consumption_table(resource, pending[0], resourcesalloweddict, resourcesuseddict)
+
+
+
+# Adds the charges of threads that exited to the consumption table and forgets
+# those threads.   A thread that is still alive adds its own charges once they
+# are old, on its next batched charge.   Until then they are below
+# BATCHED_TATTLE_LIMIT_FRACTION of the limit and get_resource_information
+# reports them.
+def _sweep_pending_charges(resourcesalloweddict, resourcesuseddict):
+  global _pending_charges_list
+
+  exitedlist = []
+
+  _pending_charges_lock.acquire()
+  try:
+    livelist = []
+    for threadobj, threadcharges in _pending_charges_list:
+      if threadobj.isAlive():
+        livelist.append((threadobj, threadcharges))
+      else:
+        exitedlist.append(threadcharges)
+    _pending_charges_list = livelist
+  finally:
+    _pending_charges_lock.release()
+
+  for threadcharges in exitedlist:
+    _flush_pending_charges(threadcharges, resourcesalloweddict, resourcesuseddict)
+
+
+
+def _sweep_pending_charges_periodically():
+  while True:
+    time.sleep(BATCHED_TATTLE_INTERVAL)
+    try:
+      _sweep_pending_charges(_resources_allowed_dict, _resources_consumed_dict)
+    except Exception:
+      # This will cause the program to exit and log things if logging is
+      # enabled.
+      tracebackrepy.handle_internalerror("Sweeping the pending charges failed!", 134)
+
+
+
 def _tattle_add_item(resource, item, resourcesalloweddict, resourcesuseddict):
   """
    <Purpose>
@@ -390,12 +621,47 @@ def start_resource_nanny(resourcefilename):
   # this sets up a dictionary with the correct locks, etc. for tracking
   # resource use.
   _resources_consumed_dict = _create_resource_consumption_dict()
+
+  # get the burst sizes of the renewable resources
+  _resources_consumed_dict['renewable_burst'] = resourcemanipulation.read_burstdict_from_file(resourcefilename)
   
 
 def tattle_quantity(resource, quantity):
   return _tattle_quantity(resource, quantity, _resources_allowed_dict, _resources_consumed_dict)
   
 
+def tattle_quantity_batched(resource, quantity):
+  return _tattle_quantity_batched(resource, quantity, _resources_allowed_dict, _resources_consumed_dict)
+
+
+# Adds the charges the current thread batched to the consumption table.   
+# Threads should call this before they exit.
+def flush_pending_charges():
+  try:
+    threadcharges = _pending_charges_local.charges
+  except AttributeError:
+    # This thread never batched a charge
+    return
+
+  _flush_pending_charges(threadcharges, _resources_allowed_dict, _resources_consumed_dict)
+
+
+# Starts the thread that adds the pending charges of threads that stopped
+# making charges (or exited) to the consumption table.   repy.py calls this 
+# before running the user program so that the thread is not counted as a 
+# pending event of the program.
+def start_pending_charge_sweeper():
+  global _pending_charge_sweeper
+
+  if _pending_charge_sweeper is not None and _pending_charge_sweeper.isAlive():
+    return
+
+  _pending_charge_sweeper = threading.Thread(target=_sweep_pending_charges_periodically,
+      name="PendingChargeSweeper")
+  _pending_charge_sweeper.setDaemon(True)
+  _pending_charge_sweeper.start()
+  
+
 def tattle_add_item(resource, item):
   return _tattle_add_item(resource, item, _resources_allowed_dict, _resources_consumed_dict)
 
@@ -518,6 +784,17 @@ def get_resource_information():
   for resourcename in resource_constants.quantity_resources:
     resource_use_dict[resourcename] = _resources_consumed_dict[resourcename]
 
+  # the charges batched by tattle_quantity_batched are used as well, even if
+  # they are not in the table yet
+  _pending_charges_lock.acquire()
+  try:
+    for threadobj, threadcharges in _pending_charges_list:
+      # items() copies the dict at once, so the owner may change it meanwhile
+      for resourcename, pending in threadcharges.items():
+        resource_use_dict[resourcename] = resource_use_dict[resourcename] + pending[0]
+  finally:
+    _pending_charges_lock.release()
+
   # for the fungible resources (files opened, etc,), we only need a count...
   for resourcename in resource_constants.fungible_item_resources:
     resource_use_dict[resourcename] = len(_resources_consumed_dict[resourcename])
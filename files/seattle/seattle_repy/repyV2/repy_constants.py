@@ -39,6 +39,35 @@ CPU_POLLING_FREQ_WINCE = .5 # Mobile devices are pretty slow
 #Disk Polling Frequency:
 DISK_POLLING_HDD = 3
 
+# How often (in seconds) the disk use is fully rescanned.   Between scans
+# emulfile reports size changes to a running total (see nonportable).
+DISK_RECONCILE_FREQ = 30
+
+# How long (in seconds) emulcomm uses its cache of allowed IP addresses before
+# it looks at the interfaces again.   On Linux, address changes also refresh
+# the cache right away.
+IP_CACHE_REFRESH_FREQ = 5
+
+# The size (in bytes) of the write-behind buffer of each file the sandbox has
+# open.   Adjacent writeat calls are collected in the buffer and written out
+# together when it fills up, every FILE_WRITE_BUFFER_FLUSH_FREQ seconds, and
+# before the file is read or closed.   0 turns the buffering off.
+FILE_WRITE_BUFFER_SIZE = 64 * 1024
+FILE_WRITE_BUFFER_FLUSH_FREQ = 1
+
+# With --logfile, the output of the sandbox is collected in a buffer of
+# LOG_BUFFER_SIZE bytes, which is written to the circular log when it fills
+# up, every LOG_FLUSH_FREQ seconds, and when repy exits.   0 turns the
+# buffering off.
+LOG_BUFFER_SIZE = 16 * 1024
+LOG_FLUSH_FREQ = 1
+
+# readat serves reads from files of at least FILE_MMAP_MIN_SIZE bytes from a
+# memory mapping of the file (None turns this off).   This is only done where
+# the mapped pages don't count toward the memory use of the sandbox (see
+# nonportable.mapped_files_count_as_memory).
+FILE_MMAP_MIN_SIZE = 1024 * 1024
+
 # These IP addresses are used to resolve our external IP address
 # We attempt to connect to these IP addresses, and then check our local IP
 # These addresses were choosen since they have been historically very stable
@@ -68,6 +68,14 @@ resource insocket 2			# Can listen for 2 incoming comms
 resource messport 2023 			# Can use messageport 2023 
 resource messport 2043 			# Can use messageport 2043 
 
+
+Burst sizes: how much of a renewable resource may be used at once, as the
+number of seconds worth of its limit.   Resources without a burst line use 1.
+These lines are ignored by parse_resourcedict_from_string.
+Usage: burst resourcename seconds
+Example:
+burst netsend 4				# Can send 4 seconds worth of netsend at once
+
 """
 
 
@@ -154,8 +162,8 @@ def parse_resourcedict_from_string(resourcestring):
     
     linetypestring = tokenlist[0]
  
-    # should be either a resource or a call line
-    if linetypestring != 'resource' and linetypestring != 'call':
+    # should be either a resource, burst or call line
+    if linetypestring != 'resource' and linetypestring != 'call' and linetypestring != 'burst':
       raise ResourceParseError("Line '"+line+"' not understood.")
     
 
@@ -224,6 +232,10 @@ def parse_resourcedict_from_string(resourcestring):
       # continue
       # MMM: Added back the 'call's to make it compatible with RepyV1
 
+    elif linetypestring == 'burst':
+      # these are handled by parse_burstdict_from_string
+      continue
+
     else:
       raise ResourceParseError("Internal error for '"+line+"'")
 
@@ -252,7 +264,108 @@ def parse_resourcedict_from_string(resourcestring):
 
 
 
-def write_resourcedict_to_file(resourcedict, filename, call_list=None):
+def read_burstdict_from_file(filename):
+  """
+    <Purpose>
+        Reads the burst sizes of renewable resources from a resource file
+
+    <Arguments>
+        filename: the name of the file to read the burst sizes from.
+
+    <Exceptions>
+        ResourceParseError: if a burst line does not have the correct format
+
+        IOError: if the file cannot be opened.
+   
+    <Side Effects>
+        None
+
+    <Returns>
+        A dictionary mapping each renewable resource to its burst size.
+  """
+
+  filedata = open(filename).read()
+
+  return parse_burstdict_from_string(filedata)
+
+
+
+
+def parse_burstdict_from_string(resourcestring):
+  """
+    <Purpose>
+        Reads the burst sizes of renewable resources from a string in the 
+        resource file format.   Lines other than burst lines are skipped.
+
+    <Arguments>
+        resourcestring: the string of data to parse
+
+    <Exceptions>
+        ResourceParseError: if a burst line does not have the correct format
+   
+    <Side Effects>
+        None
+
+    <Returns>
+        A dictionary mapping each renewable resource to its burst size, in
+        seconds worth of the resource's limit.   Resources that are not
+        specified have a burst size of 1.0
+  """
+
+  returned_burst_dict = {}
+
+  # ensure we don't have problems with windows style newlines... (only LF)
+  lfresourcestring = resourcestring.replace('\r\n','\n')
+
+  for line in lfresourcestring.split('\n'):
+
+    # remove whitespace and comments, the items are separated by spaces
+    tokenlist = line.strip().split('#')[0].split()
+
+    # skip blank, comment and non-burst lines
+    if len(tokenlist) == 0 or tokenlist[0] != 'burst':
+      continue
+
+    if len(tokenlist) != 3:
+      raise ResourceParseError("Line '"+line+"' has wrong number of items")
+
+    resourcename = tokenlist[1]
+    burstvaluestring = tokenlist[2]
+
+    # only renewable resources drain, so only they can burst
+    if resourcename not in resource_constants.renewable_resources:
+      raise ResourceParseError("Line '"+line+"' has a burst for '"+resourcename+"' which is not a renewable resource")
+
+    try:
+      burstvalue = float(burstvaluestring)
+    except ValueError:
+      raise ResourceParseError("Line '"+line+"' has an invalid burst value '"+burstvaluestring+"'")
+
+    if burstvalue < 0.0:
+      raise ResourceParseError("Line '"+line+"' has a negative burst value")
+
+    if resourcename in returned_burst_dict:
+      raise ResourceParseError("Line '"+line+"' has a duplicate burst rule for '"+resourcename+"'")
+
+    returned_burst_dict[resourcename] = burstvalue
+
+  # fill out the table with the default
+  for resource in resource_constants.renewable_resources:
+    if resource not in returned_burst_dict:
+      returned_burst_dict[resource] = 1.0
+
+  return returned_burst_dict
+
+
+
+
+
+
+
+
+
+
+def write_resourcedict_to_file(resourcedict, filename, call_list=None, burstdict=None):
   """
     <Purpose>
         Writes out a resource dictionary to disk...
@@ -262,6 +375,9 @@ def write_resourcedict_to_file(resourcedict, filename, call_list=None):
         filename: the file to write it to
         call_list: if provided is the list of calls that are allowed
             (for backward compatibility with Repy V1).
+        burstdict: if provided, the burst sizes (as returned by 
+            read_burstdict_from_file) to write out.   Burst sizes of 1 are
+            the default and are left out.
 
     <Exceptions>
         IOError: if the filename cannot be opened or is invalid.
@@ -281,6 +397,11 @@ def write_resourcedict_to_file(resourcedict, filename, call_list=None):
     else:
       print >> outfo, "resource "+resource+" "+str(resourcedict[resource])
 
+  if burstdict:
+    for resource in burstdict:
+      if burstdict[resource] != 1.0:
+        print >> outfo, "burst "+resource+" "+str(burstdict[resource])
+
   if call_list:
     print >> outfo, '\n' + str(call_list)
   outfo.close()
@@ -349,6 +470,35 @@ def add_resourcedicts(dict1, dict2):
 
 
 
+# The burst sizes of a vessel made by joining two others.   A burst size is 
+# relative to the resource's limit, so the smaller one still holds for the 
+# sum of the limits.
+def join_burstdicts(dict1, dict2):
+  """
+    <Purpose>
+        Takes two burst dicts and returns the burst dict of the vessel with
+        the resources of both.
+
+    <Arguments>
+        dict1,dict2: the burst dictionaries
+
+    <Exceptions>
+        None
+   
+    <Side Effects>
+        None
+
+    <Returns>
+        The new burst dictionary
+  """
+  retdict = {}
+  for resource in dict1:
+    retdict[resource] = min(dict1[resource], dict2[resource])
+
+  return retdict
+
+
+
 # remove one quantity of resources from the other. (be sure to check if the
 # resulting resources are negative if appropriate)
 def subtract_resourcedicts(dict1, dict2):
@@ -60,8 +60,8 @@
 # Built-in Objects
 # http://docs.python.org/lib/builtin.html
 
-# AST Nodes - compiler
-# http://docs.python.org/lib/module-compiler.ast.html
+# AST Nodes - ast
+# http://docs.python.org/library/ast.html
 
 # Types and members - inspection
 # http://docs.python.org/lib/inspect-types.html
@@ -79,6 +79,9 @@
 import os           # This is for some path manipulation
 import sys          # This is to get sys.executable to launch the external process
 import time         # This is to sleep
+import hashlib      # This is to key the safety check and bytecode caches
+import imp          # This is to get the bytecode version
+import marshal      # This is to store compiled code
 
 # Currently required to filter out Android-specific debug messages, cf #1080
 # and safe_check() below
@@ -88,11 +91,7 @@ try:
 except ImportError:
   IS_ANDROID = False
 
-# Hide the DeprecationWarning for compiler
-import warnings
-warnings.simplefilter('ignore')
-import compiler     # Required for the code safety check
-warnings.resetwarnings()
+import ast          # Required for the code safety check
 
 import UserDict     # This is to get DictMixin
 import platform     # This is for detecting Nokia tablets
@@ -154,16 +153,22 @@ _STR_OK:
 # through it node by node, and checking that only safe nodes
 # are used and that no unsafe strings are present.
 
-_STR_OK = ['__init__','__del__','__iter__', '__repr__', '__str__']
+# The checks use these builtins only through these names, so that code can
+# also be checked once the builtins are replaced (see safe_check_in_process)
+_check_getattr = getattr
+_check_type = type
+_check_unicode = unicode
+
+_STR_OK = frozenset(['__init__','__del__','__iter__', '__repr__', '__str__'])
 
 # __ is not allowed because it can be used to access a 'private' object in a class
 # by bypassing Python's name mangling.
 _STR_NOT_CONTAIN = ['__']
-_STR_NOT_BEGIN = ['im_','func_','tb_','f_','co_',]
+_STR_NOT_BEGIN = ('im_','func_','tb_','f_','co_',)
 
 # Disallow these exact strings.
 #   encode and decode are not allowed because of the potential for encoding bugs (#982) 
-_STR_NOT_ALLOWED = ['encode','decode'] 
+_STR_NOT_ALLOWED = frozenset(['encode','decode'])
 
 def _is_string_safe(token):
   """
@@ -180,7 +185,7 @@ def _is_string_safe(token):
   """
 
   # If it's not a string, return True
-  if type(token) is not str and type(token) is not unicode:
+  if _check_type(token) is not str and _check_type(token) is not _check_unicode:
     return True
   
   # If the string is explicitly allowed, return True
@@ -198,10 +203,13 @@ def _is_string_safe(token):
 
   # Check all the prohibited prefixes
   # Return True if it is safe.
-  return not token.startswith(tuple(_STR_NOT_BEGIN))
+  return not token.startswith(_STR_NOT_BEGIN)
 
 
-_NODE_CLASS_OK = [
+# The whitelist uses the node names of the (deprecated) compiler package, which
+# was used to check code before.   _AST_NODE_CLASS_NAMES gives the name for
+# each ast node.
+_NODE_CLASS_OK = frozenset([
     'Add', 'And', 'AssAttr', 'AssList', 'AssName', 'AssTuple',
     'Assert', 'Assign','AugAssign', 'Bitand', 'Bitor', 'Bitxor', 'Break',
     'CallFunc', 'Class', 'Compare', 'Const', 'Continue',
@@ -213,52 +221,125 @@ _NODE_CLASS_OK = [
     'Stmt', 'Sub', 'Subscript', 'Tuple', 'UnaryAdd', 'UnarySub', 'While',
     # New additions
     'TryExcept', 'TryFinally', 'Raise', 'ExcepthandlerType', 'Invert',
-    ]
-
-_NODE_ATTR_OK = ['value']
-
-
-def _check_node(node):
+    ])
+
+# The compiler node name of each ast node whose name differs.   Nodes that are
+# mapped to None did not exist as nodes in the compiler package (they were
+# strings or were implied by their parent) and are always allowed.   Nodes
+# that are not listed have the same name.
+_AST_NODE_CLASS_NAMES = {
+    # Statements
+    'FunctionDef': 'Function', 'ClassDef': 'Class', 'Expr': 'Discard',
+    'ImportFrom': 'From', 'Delete': None, 'ExceptHandler': None,
+    'arguments': None, 'keyword': 'Keyword', 'alias': None,
+    # Expressions
+    'Call': 'CallFunc', 'Attribute': 'Getattr', 'Num': 'Const', 'Str': 'Const',
+    'GeneratorExp': 'GenExpr', 'Repr': 'Backquote', 'comprehension': 'ListCompFor',
+    'BoolOp': None, 'BinOp': None, 'UnaryOp': None,
+    'Index': None, 'ExtSlice': 'Sliceobj',
+    # Operators
+    'Mult': 'Mul', 'Pow': 'Power', 'LShift': 'LeftShift', 'RShift': 'RightShift',
+    'BitOr': 'Bitor', 'BitXor': 'Bitxor', 'BitAnd': 'Bitand',
+    'UAdd': 'UnaryAdd', 'USub': 'UnarySub',
+    'Eq': None, 'NotEq': None, 'Lt': None, 'LtE': None, 'Gt': None, 'GtE': None,
+    'Is': None, 'IsNot': None, 'In': None, 'NotIn': None,
+    # Expression contexts
+    'Load': None, 'Store': None, 'Del': None, 'AugLoad': None,
+    'AugStore': None, 'Param': None,
+    }
+
+# The fields of ast nodes that hold names, and the name of the attribute of
+# the compiler node they correspond to (which is used in error messages).
+_AST_NAME_FIELDS = {
+    'Name': ('id', 'name'),
+    'Attribute': ('attr', 'attrname'),
+    'keyword': ('arg', 'name'),
+    'FunctionDef': ('name', 'name'),
+    'ClassDef': ('name', 'name'),
+    }
+
+# The version of the checking rules.   This must be increased whenever the way
+# _check_ast() or _is_string_safe() decide about safety changes, so that the
+# verdicts in the safety check cache are no longer used.   (Changes to the
+# tables above are detected without this.)
+SAFE_CHECK_RULESET_VERSION = 2
+
+
+# ast.iter_child_nodes(), with the saved getattr
+def _iter_child_nodes(node):
+  for fieldname in node._fields:
+    field = _check_getattr(node, fieldname, None)
+    if isinstance(field, ast.AST):
+      yield field
+    elif isinstance(field, list):
+      for item in field:
+        if isinstance(item, ast.AST):
+          yield item
+
+
+def _check_ast(tree):
   """
   <Purpose>
-    Examines a node, its attributes, and all of its children (recursively) for safety.
-    A node is safe if it is in _NODE_CLASS_OK and an attribute is safe if it is
-    not a unicode string and either in _NODE_ATTR_OK or is safe as is 
-    defined by _is_string_safe()
+    Examines every node of an AST for safety.   A node is safe if its name
+    (see _AST_NODE_CLASS_NAMES) is in _NODE_CLASS_OK.   The names a node
+    holds must be safe as defined by _is_string_safe() and string constants
+    must not be unicode.   The names of function arguments are not checked
+    (uses of the arguments are).
+
+    The nodes are checked in the same order as the compiler package visited
+    them, without recursion.
   
   <Arguments>
-    node: A node in an AST
+    tree: The root node of an AST from ast.parse()
     
   <Exceptions>
     CheckNodeException if an unsafe node is used
-    CheckStrException if an attribute has an unsafe string 
+    CheckStrException if a node has an unsafe string 
   
   <Return>
     None
   """
-  if node.__class__.__name__ not in _NODE_CLASS_OK:
-    raise exception_hierarchy.CheckNodeException(node.lineno,node.__class__.__name__)
-  
-  for attribute, value in node.__dict__.iteritems():
-    # Don't allow the construction of unicode literals
-    if type(value) == unicode:
-      raise exception_hierarchy.CheckStrException(node.lineno, attribute, value)
-
-    if attribute in _NODE_ATTR_OK: 
-      continue
-
-    # JAC: don't check doc strings for __ and the like... (#889)
-    if attribute == 'doc' and (node.__class__.__name__ in
-      ['Module', 'Function', 'Class']):
+  # The nodes left to check, with the line number of their closest parent
+  # (for nodes like operators which have none)
+  pending = [(tree, 0)]
+
+  while pending:
+    node, lineno = pending.pop()
+    classname = node.__class__.__name__
+    lineno = _check_getattr(node, 'lineno', lineno)
+
+    nodename = _AST_NODE_CLASS_NAMES.get(classname, classname)
+    if classname == 'Print' and node.nl:
+      nodename = 'Printnl'
+    if nodename is not None and nodename not in _NODE_CLASS_OK:
+      raise exception_hierarchy.CheckNodeException(lineno, nodename)
+
+    if classname in _AST_NAME_FIELDS:
+      fieldname, attribute = _AST_NAME_FIELDS[classname]
+      value = _check_getattr(node, fieldname)
+      if not _is_string_safe(value):
+        raise exception_hierarchy.CheckStrException(lineno, attribute, value)
+
+    # Don't allow the construction of unicode literals.   The contents of
+    # strings (including doc strings) are not checked otherwise.
+    if classname == 'Str':
+      if _check_type(node.s) is _check_unicode:
+        raise exception_hierarchy.CheckStrException(lineno, 'value', node.s)
       continue
 
+    if classname == 'FunctionDef' or classname == 'ClassDef':
+      if node.decorator_list:
+        raise exception_hierarchy.CheckNodeException(lineno, 'Decorators')
 
-    # Check the safety of any strings
-    if not _is_string_safe(value):
-      raise exception_hierarchy.CheckStrException(node.lineno, attribute, value)
+    if classname == 'arguments':
+      # Only the default values are code
+      children = node.defaults
+    else:
+      children = list(_iter_child_nodes(node))
 
-  for child in node.getChildNodes():
-    _check_node(child)
+    # Check the first child next
+    for index in xrange(len(children) - 1, -1, -1):
+      pending.append((children[index], lineno))
 
 
 
@@ -266,7 +347,7 @@ def safe_check(code):
   """
   <Purpose>
     Takes the code as input, and parses it into an AST.
-    It then calls _check_node, which does a recursive safety check for every node.
+    It then calls _check_ast, which does a safety check for every node.
   
   <Arguments>
     code: A string representation of python code
@@ -278,8 +359,14 @@ def safe_check(code):
   <Return>
     None
   """
-  parsed_ast = compiler.parse(code)
-  _check_node(parsed_ast)
+  try:
+    # This is ast.parse(), with the saved compile
+    parsed_ast = _cache_compile(code, "<unknown>", "exec", ast.PyCF_ONLY_AST)
+  except SyntaxError, e:
+    # The code has no file name, don't report one
+    e.filename = None
+    raise
+  _check_ast(parsed_ast)
 
 
 # End of the code safety checking implementation
@@ -373,7 +460,24 @@ def safe_check_subprocess(code):
   else: # We are *not* running on Android, proceed with unfiltered output
     output = rawoutput
 
+  return _evaluate_safe_check_output(output)
+
+
+
+def _evaluate_safe_check_output(output):
+  """
+  <Purpose>
+    Turns the output of safe_check.py into the result of safe_check().
+
+  <Arguments>
+    output: The output of safe_check.py for some code.
 
+  <Exceptions>
+    As with safe_check.   An Exception is raised if there is no output.
+
+  <Return>
+    True if the code is safe.
+  """
   # Check the output, None is success, else it is a failure
   if output == "None":
     return True
@@ -386,19 +490,558 @@ def safe_check_subprocess(code):
     # Raise the error from the output
     raise exception_hierarchy.SafeException, output
 
+
+
+# The checks can also be done in this process, since the ast checker uses
+# little memory.   repy.py sets this for --safecheckinprocess.
+SAFE_CHECK_IN_PROCESS = False
+
+def safe_check_in_process(code):
+  """
+  <Purpose>
+    Runs safe_check() in this process, raising the same errors as
+    safe_check_subprocess() would.
+
+  <Arguments>
+    code: See safe_check.
+
+  <Exceptions>
+    As with safe_check_subprocess.
+
+  <Return>
+    See safe_check.
+  """
+  try:
+    value = safe_check(code)
+  except Exception, e:
+    raise exception_hierarchy.SafeException, str(type(e)) + " " + str(e)
+  return _evaluate_safe_check_output(str(value))
+
+
+# Rather than starting a process for every check, the checks are done by a
+# pool of safe_check.py processes which each check code until they are
+# replaced.   A worker is replaced after SAFE_CHECK_WORKER_MAX_CHECKS checks or
+# once it has used more than SAFE_CHECK_WORKER_MAX_MEMORY bytes, so that the
+# memory used by the checks is still reclaimed.   Up to SAFE_CHECK_POOL_SIZE
+# checks are done in parallel.   The workers are not counted in the memory use
+# of the program, so once started with start_safe_check_worker_reaper, workers
+# that were idle for SAFE_CHECK_WORKER_IDLE_TIMEOUT seconds are stopped.
+SAFE_CHECK_POOL_SIZE = 2
+SAFE_CHECK_WORKER_MAX_CHECKS = 100
+SAFE_CHECK_WORKER_MAX_MEMORY = 64 * 1024 * 1024
+SAFE_CHECK_WORKER_IDLE_TIMEOUT = 5
+
+class _SafeCheckWorker(object):
+  """
+  A safe_check.py process started with --worker.   The worker must be used by
+  one thread at a time.
+  """
+
+  def __init__(self):
+    # Get the path to safe_check.py by using the original start directory of python
+    path_to_safe_check = os.path.join(repy_constants.REPY_START_DIR, "safe_check.py")
+
+    # Don't let the worker inherit the pipes of the other workers, so that
+    # each of them sees EOF when we exit.   (Windows can't close the
+    # inherited handles when the standard handles are redirected.)
+    self.proc = subprocess.Popen([sys.executable, path_to_safe_check, "--worker"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=(os.name != 'nt'))
+    self.checkcount = 0
+    self.memoryused = 0
+    self.timedout = False
+    # When the worker was last returned to the pool
+    self.idlesince = None
+
+
+  def _kill(self):
+    self.timedout = True
+    try:
+      harshexit.portablekill(self.proc.pid)
+    except:
+      pass
+
+
+  def check(self, code):
+    """
+    <Purpose>
+      Has the worker check code.
+
+    <Arguments>
+      code: See safe_check.
+
+    <Exceptions>
+      As with safe_check.   IOError or OSError if the worker already exited.
+
+    <Return>
+      See safe_check.
+    """
+    self.checkcount = self.checkcount + 1
+
+    self.proc.stdin.write(str(len(code)) + "\n" + code)
+    self.proc.stdin.flush()
+
+    # Only wait up to EVALUTATION_TIMEOUT seconds before killing the worker,
+    # which ends the reads below
+    starttime = nonportable.getruntime()
+    killtimer = threading.Timer(EVALUTATION_TIMEOUT, self._kill)
+    killtimer.setDaemon(True)
+    killtimer.start()
+    try:
+      header = self.proc.stdout.readline().split()
+      if len(header) == 2:
+        output = self.proc.stdout.read(int(header[0]))
+        self.memoryused = int(header[1])
+      else:
+        output = ""
+    finally:
+      killtimer.cancel()
+      # Don't leave the timer thread behind (cancel wakes it up)
+      killtimer.join()
+
+    if self.timedout:
+      raise Exception, "Evaluation of code safety exceeded timeout threshold \
+                    ("+str(nonportable.getruntime() - starttime)+" seconds)"
+
+    return _evaluate_safe_check_output(output)
+
+
+  def is_reusable(self):
+    return not self.timedout and self.proc.poll() is None and \
+        self.checkcount < SAFE_CHECK_WORKER_MAX_CHECKS and \
+        self.memoryused <= SAFE_CHECK_WORKER_MAX_MEMORY
+
+
+  def stop(self):
+    # Closing stdin makes the worker exit
+    for pipe in [self.proc.stdin, self.proc.stdout]:
+      try:
+        pipe.close()
+      except (IOError, OSError):
+        pass
+    if self.timedout:
+      self.proc.wait()
+
+
+
+# The workers that are not doing a check, and a lock that protects the list
+_idle_safe_check_workers = []
+_safe_check_workers_lock = threading.Lock()
+
+# Limits the number of checks in progress to the size of the pool
+_safe_check_pool_semaphore = threading.Semaphore(SAFE_CHECK_POOL_SIZE)
+
+# The thread that stops the workers that are idle for too long
+_safe_check_worker_reaper = None
+
+
+def _get_safe_check_worker():
+  _safe_check_workers_lock.acquire()
+  try:
+    if _idle_safe_check_workers:
+      return _idle_safe_check_workers.pop()
+  finally:
+    _safe_check_workers_lock.release()
+
+  return _SafeCheckWorker()
+
+
+
+def _return_safe_check_worker(worker):
+  if not worker.is_reusable():
+    worker.stop()
+    return
+
+  _safe_check_workers_lock.acquire()
+  try:
+    worker.idlesince = nonportable.getruntime()
+    _idle_safe_check_workers.append(worker)
+  finally:
+    _safe_check_workers_lock.release()
+
+
+
+# Stops the workers that were idle for at least maxidletime seconds
+def _stop_idle_safe_check_workers(maxidletime):
+  stoplist = []
+
+  _safe_check_workers_lock.acquire()
+  try:
+    thetime = nonportable.getruntime()
+    for worker in _idle_safe_check_workers[:]:
+      if thetime - worker.idlesince >= maxidletime:
+        _idle_safe_check_workers.remove(worker)
+        stoplist.append(worker)
+  finally:
+    _safe_check_workers_lock.release()
+
+  for worker in stoplist:
+    worker.stop()
+
+
+
+def _reap_idle_safe_check_workers():
+  while True:
+    time.sleep(SAFE_CHECK_WORKER_IDLE_TIMEOUT / 2.0)
+    _stop_idle_safe_check_workers(SAFE_CHECK_WORKER_IDLE_TIMEOUT)
+
+
+
+def start_safe_check_worker_reaper():
+  """
+  <Purpose>
+    Starts the thread that stops the safe_check.py workers that were idle 
+    for SAFE_CHECK_WORKER_IDLE_TIMEOUT seconds.   repy.py calls this before
+    running the user program so that the thread is not counted as a pending
+    event of the program.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Return>
+    None
+  """
+  global _safe_check_worker_reaper
+
+  if _safe_check_worker_reaper is not None and _safe_check_worker_reaper.isAlive():
+    return
+
+  _safe_check_worker_reaper = threading.Thread(target=_reap_idle_safe_check_workers,
+      name="SafeCheckWorkerReaper")
+  _safe_check_worker_reaper.setDaemon(True)
+  _safe_check_worker_reaper.start()
+
+
+
+def stop_safe_check_workers():
+  """
+  <Purpose>
+    Stops the idle safe_check.py workers.   This must be done before forking
+    a process that will check code, since the workers can only be used by one
+    process.   New workers are started when needed.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Return>
+    None
+  """
+  _safe_check_workers_lock.acquire()
+  try:
+    while _idle_safe_check_workers:
+      _idle_safe_check_workers.pop().stop()
+  finally:
+    _safe_check_workers_lock.release()
+
+
+
+def safe_check_pool(code):
+  """
+  <Purpose>
+    Runs safe_check() in one of the safe_check.py worker processes (see
+    safe_check_subprocess() for why it runs in another process).   This
+    blocks while SAFE_CHECK_POOL_SIZE other checks are in progress.
+
+  <Arguments>
+    code: See safe_check.
+
+  <Exceptions>
+    As with safe_check.
+
+  <Return>
+    See safe_check.
+  """
+  _safe_check_pool_semaphore.acquire()
+  try:
+    worker = _get_safe_check_worker()
+    try:
+      try:
+        return worker.check(code)
+      except (IOError, OSError):
+        # The worker exited while it was idle, so use a new one
+        if worker.checkcount == 1:
+          raise
+        worker.stop()
+        worker = _SafeCheckWorker()
+        return worker.check(code)
+    finally:
+      _return_safe_check_worker(worker)
+  finally:
+    _safe_check_pool_semaphore.release()
+
+
+
+# The safety check cache stores the verdict of safe_check() for code that was
+# already checked, so that identical code (such as a module imported through
+# dylink by every program on a node) is only checked once per install.   Each
+# verdict is a file in SAFE_CHECK_CACHE_DIRECTORY (in the repy directory) named
+# after the hash of the code and of the checking rules.   The file contains
+# "None" if the code is safe and the error otherwise.   The least recently used
+# verdicts are removed once the directory uses more than 
+# SAFE_CHECK_CACHE_MAX_SIZE bytes (counted like nonportable.compute_disk_use),
+# when trim_caches() is called.   Only the verdicts of code that the sandbox
+# doesn't supply are cached (libraries of the repy directory, see 
+# is_repy_library_code, and the libraries repyzygote.py preloads), since the
+# writes are not charged to any vessel.
+SAFE_CHECK_CACHE_ENABLED = True
+SAFE_CHECK_CACHE_DIRECTORY = "safe_check_cache"
+SAFE_CHECK_CACHE_MAX_SIZE = 4 * 1024 * 1024
+
+# Only these errors of safe_check() are verdicts about the code.   Others
+# (e.g. a MemoryError in the checker) are not cached.
+_SAFE_CHECK_VERDICT_TYPES = [exception_hierarchy.CheckNodeException,
+    exception_hierarchy.CheckStrException, SyntaxError, IndentationError,
+    TabError]
+
+# Store references to open and compile, since the builtins are replaced once
+# the sandbox is running but code can still be checked and compiled
+# (createvirtualnamespace)
+_cache_open = open
+_cache_compile = compile
+
+def is_repy_library_code(code, name):
+  """
+  <Purpose>
+    Checks if code is the contents of the library file called name in the
+    repy directory (such as a library a program imports through dylink).
+    Only such code (and that preloaded by repyzygote.py) is cached, so that
+    a sandbox can't fill the caches with code of its own.
+
+  <Arguments>
+    code: The code (as given to createvirtualnamespace).
+    name: The name given for the code.
+
+  <Exceptions>
+    None.
+
+  <Return>
+    True or False.
+  """
+  # Only the file names of libraries, never paths
+  if os.path.basename(name) != name or not name.endswith(".r2py"):
+    return False
+
+  libraryfilename = os.path.join(repy_constants.REPY_START_DIR, name)
+  try:
+    libraryfileobj = _cache_open(libraryfilename, "rb")
+    try:
+      # Reading one byte more tells if the file is longer
+      librarycode = libraryfileobj.read(len(code) + 1)
+    finally:
+      libraryfileobj.close()
+  except (IOError, OSError):
+    return False
+
+  return librarycode == code
+
+
+
+# This is computed the first time it is needed
+_ruleset_hash = []
+
+def _get_ruleset_hash():
+  """
+  <Purpose>
+    Returns a hash of the checking rules.   The rules are the lists of allowed
+    nodes and strings, SAFE_CHECK_RULESET_VERSION and the Python version (since
+    the parser may produce different nodes for different versions).
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Return>
+    A hex string.
+  """
+  if not _ruleset_hash:
+    rules = repr((SAFE_CHECK_RULESET_VERSION, sys.version, sorted(_STR_OK),
+        _STR_NOT_CONTAIN, _STR_NOT_BEGIN, sorted(_STR_NOT_ALLOWED),
+        sorted(_NODE_CLASS_OK), sorted(_AST_NODE_CLASS_NAMES.items()),
+        sorted(_AST_NAME_FIELDS.items())))
+    _ruleset_hash.append(hashlib.sha1(rules).hexdigest())
+  return _ruleset_hash[0]
+
+
+
+def _get_safe_check_cache_key(code):
+  return hashlib.sha1(_get_ruleset_hash() + "\n" + code).hexdigest()
+
+
+
+# Is the error message of safe_check_pool (etc.) a verdict about the code?
+def _is_safe_check_verdict(errorstring):
+  for verdicttype in _SAFE_CHECK_VERDICT_TYPES:
+    if errorstring.startswith(str(verdicttype) + " "):
+      return True
+  return False
+
+
+
+def _read_cache_file(cachedirectory, key):
+  """
+  <Purpose>
+    Reads an entry of an on-disk cache.   Each entry is a file named key in
+    the cachedirectory subdirectory of the repy directory.   Reading an entry
+    marks it as recently used.
+
+  <Arguments>
+    cachedirectory: The name of the cache directory.
+    key: The name of the entry (a hex string).
+
+  <Exceptions>
+    None.   If the entry can't be read, this behaves like a cache miss.
+
+  <Return>
+    The contents of the entry or None if it isn't in the cache.
+  """
+  cachefilename = os.path.join(repy_constants.REPY_START_DIR, cachedirectory,
+      key)
+  try:
+    cachefileobj = _cache_open(cachefilename, "rb")
+    try:
+      data = cachefileobj.read()
+    finally:
+      cachefileobj.close()
+  except (IOError, OSError):
+    return None
+
+  # A partially written file would be empty
+  if data == "":
+    return None
+
+  # The modification time tells _trim_cache_directory when it was last used
+  try:
+    os.utime(cachefilename, None)
+  except OSError:
+    pass
+  return data
+
+
+
+def _trim_cache_directory(cachedirectory, maxsize):
+  """
+  <Purpose>
+    Removes the least recently used entries of an on-disk cache if it uses 
+    more than maxsize bytes.   Each file counts with its size plus 4K (as
+    in nonportable.compute_disk_use).   Entries are removed until the cache
+    uses at most 3/4 of maxsize.
+
+  <Arguments>
+    cachedirectory: The path of the cache directory.
+    maxsize: The most bytes the cache may use.
+
+  <Exceptions>
+    OSError if the directory can't be listed.
+
+  <Return>
+    None
+  """
+  entrylist = []
+  cachesize = 0
+  for filename in os.listdir(cachedirectory):
+    filename = os.path.join(cachedirectory, filename)
+    try:
+      fileinfo = os.stat(filename)
+    except OSError:
+      # Another repy process removed it
+      continue
+    entrylist.append((fileinfo.st_mtime, fileinfo.st_size + 4096, filename))
+    cachesize = cachesize + fileinfo.st_size + 4096
+
+  if cachesize <= maxsize:
+    return
+
+  # the oldest first
+  entrylist.sort()
+  for mtime, entrysize, filename in entrylist:
+    if cachesize <= maxsize * 3 / 4:
+      break
+    try:
+      os.remove(filename)
+    except OSError:
+      pass
+    cachesize = cachesize - entrysize
+
+
+
+def _write_cache_file(cachedirectory, key, data, maxsize):
+  """
+  <Purpose>
+    Stores an entry of an on-disk cache (see _read_cache_file).   The data is
+    written to a temporary file which is then renamed, so that other repy
+    processes never read a partial entry.   Old entries are only removed by
+    trim_caches().
+
+  <Arguments>
+    cachedirectory: The name of the cache directory.
+    key: The name of the entry (a hex string).
+    data: The contents of the entry.
+    maxsize: The most bytes the cache may use.   Entries that would use 
+        more than 1/4 of it are not stored.
+
+  <Exceptions>
+    None.   The entry is not stored if the cache can't be written.
+
+  <Return>
+    None
+  """
+  cachedirectory = os.path.join(repy_constants.REPY_START_DIR, cachedirectory)
+  cachefilename = os.path.join(cachedirectory, key)
+  tempfilename = cachefilename + "." + str(os.getpid()) + "." + \
+      str(threading.currentThread().ident) + ".tmp"
+  if len(data) + 4096 > maxsize / 4:
+    return
+
+  try:
+    if not os.path.isdir(cachedirectory):
+      os.mkdir(cachedirectory)
+
+    tempfileobj = _cache_open(tempfilename, "wb")
+    try:
+      tempfileobj.write(data)
+    finally:
+      tempfileobj.close()
+
+    # On Windows rename fails if another process stored the entry first
+    os.rename(tempfilename, cachefilename)
+  except (IOError, OSError):
+    try:
+      os.remove(tempfilename)
+    except OSError:
+      pass
+
+
+
 # Get a lock for serial_safe_check
 SAFE_CHECK_LOCK = threading.Lock()
 
-# Wraps safe_check to serialize calls
-def serial_safe_check(code):
+# Wraps safe_check to limit the number of checking processes
+def serial_safe_check(code, cacheverdict=False):
   """
   <Purpose>
-    Serializes calls to safe_check_subprocess(). This is because safe_check_subprocess()
-    creates a new process which may take many seconds to return. This prevents us from
-    creating many new python processes.
+    Checks code in the safe_check.py worker pool, which limits the number of
+    checking processes.   On Android, this serializes calls to
+    safe_check_subprocess() instead, since debugging output may be mixed
+    into the output of the worker.   If SAFE_CHECK_IN_PROCESS is set, the
+    code is checked in this process.
+
+    If cacheverdict is set and the verdict for the code is in the safety
+    check cache, no process is started.   Otherwise the verdict is added to
+    the cache (timeouts, fatal errors and errors of the checker such as a 
+    MemoryError are not verdicts and are not cached).
   
   <Arguments>
     code: See safe_check.
+    cacheverdict: Whether the verdict may be cached.   This must only be
+        set for code that isn't supplied by the sandbox (see 
+        is_repy_library_code).
     
   <Exceptions>
     As with safe_check.
@@ -407,11 +1050,36 @@ def serial_safe_check(code):
     See safe_check.
   """
 
-  SAFE_CHECK_LOCK.acquire()
+  cacheverdict = cacheverdict and SAFE_CHECK_CACHE_ENABLED
+  if cacheverdict:
+    cachekey = _get_safe_check_cache_key(code)
+    verdict = _read_cache_file(SAFE_CHECK_CACHE_DIRECTORY, cachekey)
+    if verdict == "None":
+      return True
+    elif verdict is not None:
+      raise exception_hierarchy.SafeException, verdict
+
   try:
-    return safe_check_subprocess(code)
-  finally:
-    SAFE_CHECK_LOCK.release()
+    if SAFE_CHECK_IN_PROCESS:
+      result = safe_check_in_process(code)
+    elif IS_ANDROID:
+      SAFE_CHECK_LOCK.acquire()
+      try:
+        result = safe_check_subprocess(code)
+      finally:
+        SAFE_CHECK_LOCK.release()
+    else:
+      result = safe_check_pool(code)
+  except exception_hierarchy.SafeException, e:
+    if cacheverdict and _is_safe_check_verdict(str(e)):
+      _write_cache_file(SAFE_CHECK_CACHE_DIRECTORY, cachekey, str(e),
+          SAFE_CHECK_CACHE_MAX_SIZE)
+    raise
+
+  if cacheverdict:
+    _write_cache_file(SAFE_CHECK_CACHE_DIRECTORY, cachekey, "None",
+        SAFE_CHECK_CACHE_MAX_SIZE)
+  return result
 
 #End of static analysis portion
 
@@ -618,6 +1286,96 @@ def safe_exec(code, context = None):
 
 
 
+# This portion of the code caches compiled code.
+# The bytecode cache stores the code objects of compiled code (marshalled) so
+# that libraries imported through dylink are not compiled again when repy
+# starts.   As with the safety check cache, only code that the sandbox doesn't
+# supply is cached.   The entries are in BYTECODE_CACHE_DIRECTORY (relative to
+# the repy directory) and are named after the hash of the code, the name of 
+# the code and the Python version.   The encoding header added by 
+# virtual_namespace is part of the code.   The least recently used entries are
+# removed by trim_caches() once the directory uses more than 
+# BYTECODE_CACHE_MAX_SIZE bytes.
+#
+# The cache is off unless repy.py is started with --bytecodecache (the node
+# manager does this if nodeman.cfg sets 'repy_bytecode_cache'), since some
+# nodes keep the install on flash that should not be written to.
+
+BYTECODE_CACHE_ENABLED = False
+BYTECODE_CACHE_DIRECTORY = "bytecode_cache"
+BYTECODE_CACHE_MAX_SIZE = 1024 * 1024
+
+def cached_compile(code, name, cachebytecode=False):
+  """
+  <Purpose>
+    Compiles code (in "exec" mode), using the bytecode cache if it is 
+    enabled and cachebytecode is set.   The code must already have been 
+    checked for safety.
+
+  <Arguments>
+    code: A string representation of python code
+    name: The file name for the code object (used in tracebacks)
+    cachebytecode: Whether the code may be cached.   As for
+        serial_safe_check, this must only be set for code that isn't 
+        supplied by the sandbox.
+
+  <Exceptions>
+    As with compile.
+
+  <Return>
+    A code object.
+  """
+  if not (cachebytecode and BYTECODE_CACHE_ENABLED):
+    return _cache_compile(code, name, "exec")
+
+  cachekey = hashlib.sha1(imp.get_magic() + sys.version + "\n" + name +
+      "\n" + code).hexdigest()
+  data = _read_cache_file(BYTECODE_CACHE_DIRECTORY, cachekey)
+  if data is not None:
+    try:
+      codeobj = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+      codeobj = None
+    if _type(codeobj) is _compile_type:
+      return codeobj
+
+  codeobj = _cache_compile(code, name, "exec")
+  _write_cache_file(BYTECODE_CACHE_DIRECTORY, cachekey, marshal.dumps(codeobj),
+      BYTECODE_CACHE_MAX_SIZE)
+  return codeobj
+
+
+
+def trim_caches():
+  """
+  <Purpose>
+    Removes the least recently used entries of the safety check and bytecode
+    caches if they use too much space (see _trim_cache_directory).   This
+    lists the cache directories, so it is done when repyzygote.py starts (and
+    when repy.py starts with the bytecode cache enabled) rather than when an
+    entry is added.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Return>
+    None
+  """
+  for cachedirectory, maxsize in [
+      (SAFE_CHECK_CACHE_DIRECTORY, SAFE_CHECK_CACHE_MAX_SIZE),
+      (BYTECODE_CACHE_DIRECTORY, BYTECODE_CACHE_MAX_SIZE)]:
+    try:
+      _trim_cache_directory(os.path.join(repy_constants.REPY_START_DIR,
+          cachedirectory), maxsize)
+    except OSError:
+      # There is no cache yet
+      pass
+
+
+
 # This portion of the code defines a SafeDict
 # A SafeDict prevents keys which are 'unsafe' strings from being added.
 
@@ -7,26 +7,82 @@ Description:
   The purpose of this script is to be called from the main repy.py script so that the
   memory used by the safe.safe_check() will be reclaimed when this process quits.
 
+  When started with --worker, the script checks code until stdin is closed.
+  Each request is the length of the code on a line followed by the code.  Each
+  response is a line with the length of the output and the peak memory use of
+  this process in bytes, followed by the output.  safe.py uses the memory use
+  to decide when to replace the worker with a new process.
+
 """
 
+import os
 import safe
 import sys
 
-if __name__ == "__main__":
-  # Get the user "code"
-  usercode = sys.stdin.read()
-  
+try:
+  import resource
+except ImportError:
+  # Windows doesn't have the resource module
+  resource = None
+
+
+def check_code(usercode):
   # Output buffer
   output = ""
-  
+
   # Check the code
   try:
     value = safe.safe_check(usercode)
     output += str(value)
   except Exception,e:
     output += str(type(e)) + " " + str(e)
-  
+
+  return output
+
+
+
+def get_peak_memory_use():
+  if resource is None:
+    return 0
+
+  peakrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Mac OS X reports bytes, Linux reports kilobytes
+  if sys.platform == 'darwin':
+    return peakrss
+  return peakrss * 1024
+
+
+
+def serve_checks():
+  # The lengths are in bytes, so the pipes must not translate newlines
+  if sys.platform == 'win32':
+    import msvcrt
+    msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+    msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+
+  while True:
+    header = sys.stdin.readline()
+    # Our parent closed the pipe (or exited)
+    if header == "":
+      break
+
+    usercode = sys.stdin.read(int(header))
+    output = check_code(usercode)
+
+    sys.stdout.write(str(len(output)) + " " + str(get_peak_memory_use()) + "\n" + output)
+    sys.stdout.flush()
+
+
+
+if __name__ == "__main__":
+  if sys.argv[1:] == ["--worker"]:
+    serve_checks()
+    sys.exit(0)
+
+  # Get the user "code"
+  usercode = sys.stdin.read()
+
   # Write out
-  sys.stdout.write(output)
+  sys.stdout.write(check_code(usercode))
   sys.stdout.flush()
-  
+
@@ -21,6 +21,8 @@ import os
 import loggingrepy_core
 import time
 import persist
+# the buffered log is written out when we exit through harshexit
+import harshexit
 # we need to get and process exception information
 import sys
 import traceback
@@ -31,6 +33,17 @@ import traceback
 logfile = None
 servicevessel = None
 
+# The log set up by init collects messages in a buffer of LOG_BUFFER_SIZE
+# bytes, which is written out when it fills up, every LOG_FLUSH_FREQ seconds,
+# when an exception is logged and when python exits (also through harshexit).
+# The thread that writes it out every LOG_FLUSH_FREQ seconds is started by
+# log, so that it is started again in a process that daemonized after init.
+LOG_BUFFER_SIZE = 16 * 1024
+LOG_FLUSH_FREQ = 1
+
+# Is logfile buffered (so that log needs the log flusher)?
+logbuffered = False
+
 
 # This is re-implemented here in python so that we do not have a
 # dependency to any repy code, and therefore repyportability.
@@ -163,7 +176,8 @@ def init(logname,cfgdir = '.', maxbuffersize=1024*1024):
     Exception if there is a problem reading from cfgdir/nodeman.cfg
     
   <Side Effects>
-    All future calls to log will log to the given logfile.
+    All future calls to log will log to the given logfile.   The log buffer
+    is written out when harshexit is called.
     
   <Returns>
     None
@@ -171,10 +185,47 @@ def init(logname,cfgdir = '.', maxbuffersize=1024*1024):
 
   global logfile
   global servicevessel
+  global logbuffered
   
   servicevessel = get_servicevessel(cfgdir)
   
-  logfile = loggingrepy_core.circular_logger_core(servicevessel + '/' + logname, mbs = maxbuffersize)
+  logfile = loggingrepy_core.circular_logger_core(servicevessel + '/' + logname,
+      mbs = maxbuffersize, buffersize = LOG_BUFFER_SIZE)
+  logbuffered = True
+
+  # harshexit uses os._exit, which doesn't run the atexit functions
+  if _flush_log_at_exit not in harshexit.exit_functions:
+    harshexit.exit_functions.append(_flush_log_at_exit)
+
+
+
+def _flush_log_at_exit():
+  # harshexit calls this.   Exiting must not wait long for the log in use.
+  loggingrepy_core.flush_buffered_loggers(timeout=1)
+
+
+
+def flush():
+  """
+  <Purpose>
+    Writes out the log buffer.   Call this before forking a process that 
+    keeps logging (e.g. with daemon.daemonize), so that the buffered messages
+    aren't written out by both processes.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    Exception if writing to the log fails somehow.
+
+  <Side Effects>
+    None
+
+  <Returns>
+    None
+  """
+  if logfile != None:
+    logfile.flush()
   
   
 def multi_process_log(message, logname, cfgdir):
@@ -232,7 +283,9 @@ def multi_process_log(message, logname, cfgdir):
     # be a rare case.   
     return False
   else:
-    # set up the circular logger, log the message, and return
+    # set up the circular logger, log the message, and return.   This log is
+    # not buffered because the process (e.g. repy after an internal error)
+    # is usually about to exit
     logfile = loggingrepy_core.circular_logger_core(cfgdir + '/' + servicevessel + '/' + logname)
     log(message)
 
@@ -266,6 +319,10 @@ def log(message):
 
   logfile.write(str(time.time()) + ':PID-' + str(os.getpid()) + ':' + str(message) + '\n')
 
+  # (Re)start the log flusher if this process doesn't have one yet
+  if logbuffered:
+    loggingrepy_core.start_log_flusher(LOG_FLUSH_FREQ)
+
 
 
 
@@ -283,7 +340,8 @@ def log_last_exception():
     Exception if writing to the log fails somehow.
     
   <Side Effects>
-    The exception is written to the circular log buffer.
+    The exception is written to the circular log buffer, and the buffer is
+    written out.
     
   <Returns>
     None
@@ -298,3 +356,6 @@ def log_last_exception():
     exceptionstringlist = traceback.format_exception(exceptiontype, exceptionvalue, exceptiontraceback)
     exceptionstring = ''.join(exceptionstringlist)
     log(exceptionstring)
+
+  # The process may be about to die, so don't leave this in the buffer
+  logfile.flush()
@@ -8,10 +8,18 @@
    This module stores status information about the sandbox.   Use "read_status"
    and "write_status" to set and check the status...
 
-   This module works by creating a file with an name that indicates the status.
-   The order of operations is: find old file name(s), write new file, delete 
-   old file(s).   File names contain a timestamp so that one can tell when it
-   was last updated.   The actual format is: "prefix-status-timestamp".  
+   The status is kept in a single small record file named "prefix.record" 
+   that contains "status timestamp".   A new record is written to 
+   "prefix.record.new" and then renamed over the old one, so readers always 
+   see a complete record and only need to read one file.
+
+   Older versions created a file with a name that indicates the status 
+   ("prefix-status-timestamp").   If there is no record file, read_status
+   still understands these.   The first write_status for a prefix removes
+   them.
+
+   On Linux, create_status_watch / wait_for_status_update let a reader sleep
+   until the status changes instead of polling.
 
 """
 
@@ -24,6 +32,9 @@ import threading
 # needed for listdir...
 import os
 
+# to tell if we're on Linux
+import sys
+
 # To allow access to a real fileobject 
 # call type...
 myfile = file
@@ -33,11 +44,23 @@ statusfilenameprefix = None
 # This prevents writes to the nanny's status information after we want to stop
 statuslock = threading.Lock()
 
+# The prefixes whose files from older versions were already removed
+legacycleanedprefixes = set()
+
 def init(sfnp):
   global statusfilenameprefix
   statusfilenameprefix = sfnp
 
 
+# returns the name of the record file and the directory it is in
+def _get_record_location(mystatusfilenameprefix):
+  mystatusdir = os.path.dirname(mystatusfilenameprefix)
+  if mystatusdir == '':
+    mystatusdir = '.'
+  return mystatusfilenameprefix + ".record", mystatusdir
+
+
+
 # Write out a status that can be read by another process...
 def write_status(status, mystatusfilenameprefix=None):
 
@@ -47,28 +70,45 @@ def write_status(status, mystatusfilenameprefix=None):
   # nothing set, nothing to do...
   if not mystatusfilenameprefix:
     return
-  
-  mystatusdir = os.path.dirname(mystatusfilenameprefix)
-  if mystatusdir == '':
-    mystatusdir = './'
-  else:
-    mystatusdir = mystatusdir+'/'
 
-  # BUG: Is getting a directory list atomic wrt file creation / deletion?
-  # get the current file list...
-  # Fix.   Need to prepend the directory name we're writing into...
-  existingfiles = os.listdir(mystatusdir)
+  recordfilename, mystatusdir = _get_record_location(mystatusfilenameprefix)
 
   timestamp = time.time()
 
-  # write the file
-  myfile(mystatusfilenameprefix+"-"+status+"-"+str(timestamp),"w").close()
+  # write the new record...
+  recordfo = myfile(recordfilename+".new", "w")
+  recordfo.write(status+" "+repr(timestamp))
+  recordfo.close()
+
+  # ...and put it in place.   This is atomic except on Windows, which won't
+  # rename over an existing file.   read_status copes with the gap.
+  try:
+    os.rename(recordfilename+".new", recordfilename)
+  except OSError:
+    if os.path.exists(recordfilename):
+      os.remove(recordfilename)
+    os.rename(recordfilename+".new", recordfilename)
+
+  # Only older versions create the "prefix-status-timestamp" files, so they 
+  # need to be removed once (after the record is there, so a reader always
+  # finds a status).
+  if mystatusfilenameprefix not in legacycleanedprefixes:
+    _remove_legacy_status(mystatusfilenameprefix, mystatusdir)
+    legacycleanedprefixes.add(mystatusfilenameprefix)
+
+
+
+# removes the status files written by older versions of this module
+def _remove_legacy_status(mystatusfilenameprefix, mystatusdir):
+
+  # BUG: Is getting a directory list atomic wrt file creation / deletion?
+  # get the current file list...
+  existingfiles = os.listdir(mystatusdir)
 
-  # remove the old files...
   for filename in existingfiles:
     if len(filename.split('-')) == 3 and filename.split('-')[0] == os.path.basename(mystatusfilenameprefix):
       try:
-        os.remove(mystatusdir+filename)
+        os.remove(os.path.join(mystatusdir, filename))
       except OSError, e:
         if e[0] == 2:
           # file not found, let's assume another instance removed it...
@@ -78,11 +118,46 @@ def write_status(status, mystatusfilenameprefix=None):
         raise
   
 
+
 def read_status(mystatusfilenameprefix=None):
 
   if not mystatusfilenameprefix:
     mystatusfilenameprefix = statusfilenameprefix
-  
+
+  recordfilename, mystatusdir = _get_record_location(mystatusfilenameprefix)
+
+  # On Windows the record is briefly missing while it is replaced, but the
+  # new one is already complete.
+  for filename in [recordfilename, recordfilename+".new"]:
+    try:
+      recordfo = myfile(filename)
+    except IOError, e:
+      if e[0] == 2:
+        # file not found
+        continue
+      raise
+
+    try:
+      recorddata = recordfo.read()
+    finally:
+      recordfo.close()
+
+    try:
+      status, rawtimestamp = recorddata.split(' ')
+      return (status, float(rawtimestamp))
+    except ValueError:
+      # A partially written ".new" file
+      continue
+
+  # there is no record, this must be from an older version
+  return _read_legacy_status(mystatusfilenameprefix)
+
+
+
+# reads a status written by older versions of this module (that indicated the 
+# status with the name of a file).
+def _read_legacy_status(mystatusfilenameprefix):
+
   # BUG: is getting a dir list atomic wrt file creation / deletion?
   # get the current file list...
   # Fix.   Need to prepend the directory name we're writing into...
@@ -96,7 +171,7 @@ def read_status(mystatusfilenameprefix=None):
 
   # find the newest status update...
   for filename in existingfiles:
-    if filename.split('-')[0] == mystatusfilenameprefix:
+    if len(filename.split('-')) == 3 and filename.split('-')[0] == mystatusfilenameprefix:
       thisstatus = filename.split('-',2)[1]
       thistime = float(filename.split('-',2)[2])
 
@@ -109,3 +184,39 @@ def read_status(mystatusfilenameprefix=None):
 
 
 
+# Returns an object to pass to wait_for_status_update.   Create this before 
+# reading the status you want to see change so that no update is missed.
+def create_status_watch(mystatusfilenameprefix=None):
+
+  if not mystatusfilenameprefix:
+    mystatusfilenameprefix = statusfilenameprefix
+
+  if not sys.platform.startswith('linux'):
+    return None
+
+  # only imported here since the module is Linux specific
+  import linux_api
+
+  recordfilename, mystatusdir = _get_record_location(mystatusfilenameprefix)
+  return linux_api.create_directory_watch(mystatusdir)
+
+
+
+# Waits up to timeout seconds for the status to be updated.   It may return
+# early for other reasons, so the caller should check with read_status.
+def wait_for_status_update(statuswatch, timeout):
+
+  # without inotify, just wait
+  if statuswatch is None:
+    time.sleep(timeout)
+    return
+
+  import linux_api
+  linux_api.wait_for_directory_watch(statuswatch, timeout)
+
+
+
+def close_status_watch(statuswatch):
+  if statuswatch is not None:
+    import linux_api
+    linux_api.close_directory_watch(statuswatch)
@@ -24,6 +24,7 @@ import repyhelper
 # restrictions.init_restriction_tables(filename) as well)...
 oldrestrictioncalls = {}
 oldrestrictioncalls['nanny.tattle_quantity'] = nanny.tattle_quantity
+oldrestrictioncalls['nanny.tattle_quantity_batched'] = nanny.tattle_quantity_batched
 oldrestrictioncalls['nanny.tattle_add_item'] = nanny.tattle_add_item
 oldrestrictioncalls['nanny.tattle_remove_item'] = nanny.tattle_remove_item
 oldrestrictioncalls['nanny.is_item_allowed'] = nanny.is_item_allowed
@@ -70,6 +71,7 @@ def override_restrictions():
   nonportable.get_resources = _do_nothing
 
   nanny.tattle_quantity = _do_nothing
+  nanny.tattle_quantity_batched = _do_nothing
   nanny.tattle_add_item = _do_nothing
   nanny.tattle_remove_item = _do_nothing
   nanny.is_item_allowed = _always_true
@@ -126,6 +128,7 @@ def enable_restrictions():
   """
   # JAC: THIS WILL NOT ENABLE CPU / MEMORY / DISK SPACE
   nanny.tattle_quantity = oldrestrictioncalls['nanny.tattle_quantity']
+  nanny.tattle_quantity_batched = oldrestrictioncalls['nanny.tattle_quantity_batched']
   nanny.tattle_add_item = oldrestrictioncalls['nanny.tattle_add_item'] 
   nanny.tattle_remove_item = oldrestrictioncalls['nanny.tattle_remove_item'] 
   nanny.is_item_allowed = oldrestrictioncalls['nanny.is_item_allowed'] 
@@ -176,6 +179,12 @@ openfile = emulated_open
 def getresources():
   return (default_restrictions, resource_used, [])
   
+# Code running outside of the sandbox may use native hash implementations.
+# sha.r2py looks for this builtin and falls back to pure Python (which is 
+# what happens inside the sandbox) if it doesn't exist.
+import hashlib
+__builtin__.sha_nativenew = hashlib.sha1
+
 # Needed for ticket #1038.
 # `safe._builtin_destroy()` normally removes the ability to call `import`.
 # it would be called inside of `createvirtualnamespace()`
@@ -193,7 +202,7 @@ def initialize_safe_module():
     """
 
     # Allow Import Errors.
-    safe._NODE_CLASS_OK.append("Import")
+    safe._NODE_CLASS_OK = safe._NODE_CLASS_OK | frozenset(["Import"])
 
     # needed to allow primitive marshalling to be built
     safe._BUILTIN_OK.append("__import__")
@@ -206,12 +215,10 @@ def initialize_safe_module():
       if builtin_type not in safe._BUILTIN_OK:
         safe._BUILTIN_OK.append(builtin_type)
     
-    for str_type in dir(__name__):
-      if str_type not in safe._STR_OK:
-        safe._STR_OK.append(str_type)
+    safe._STR_OK = safe._STR_OK | frozenset(dir(__name__))
 
     safe.serial_safe_check = _do_nothing
-    safe._check_node = _do_nothing
+    safe._check_ast = _do_nothing
 
 
   
@@ -0,0 +1,259 @@
+"""
+<Program Name>
+  repyzygote.py
+
+<Purpose>
+  A zygote process for starting repy sandboxes quickly.   The zygote imports
+  the repy runtime once and checks and compiles the libraries that most
+  programs import through dylink (see virtual_namespace.preload_code).   For
+  each sandbox to start, it forks a process that runs repy.main() with the
+  given arguments.   A forked sandbox does not have to start Python, import
+  the runtime or check and compile the preloaded libraries.
+
+  The libraries are evaluated by each sandbox: their namespaces belong to the
+  program that imports them and are bound to the program's API, so they can
+  not be shared.
+
+  The node manager uses this (through RepyZygote) when the 'repy_zygote'
+  configuration option is set.   The zygote needs fork(), so it is not used
+  on Windows.
+
+  The zygote reads one request per line from stdin, which is a JSON list of
+  arguments for repy.py.   It answers each request with a line "OK pid" or
+  "ERROR message".   It exits when stdin is closed.
+
+<Usage>
+  python repyzygote.py [path/to/library.r2py ...]
+"""
+
+import os
+import sys
+import json
+import threading
+import subprocess
+
+
+
+def is_supported():
+  """
+  <Purpose>
+    Tells whether repy sandboxes can be started through a zygote.
+
+  <Arguments>
+    None
+
+  <Exceptions>
+    None
+
+  <Returns>
+    True if the system supports fork(), False otherwise.
+  """
+  return hasattr(os, 'fork')
+
+
+
+class RepyZygote(object):
+  """
+  Starts and talks to a zygote process (the node manager side).   The
+  methods may be called by several threads.
+  """
+
+  def __init__(self, repydirectory, modulelist):
+    """
+    <Purpose>
+      Starts a zygote for the repy.py in repydirectory and waits until it has
+      preloaded the modules.
+
+    <Arguments>
+      repydirectory: The directory with repy.py and repyzygote.py.
+      modulelist: The files of the libraries to preload.   A library is
+          preloaded for programs that import it by its file name.
+
+    <Exceptions>
+      Exception if the zygote fails to start.
+
+    <Returns>
+      None
+    """
+    self.lock = threading.Lock()
+    self.proc = subprocess.Popen([sys.executable,
+        os.path.join(repydirectory, "repyzygote.py")] +
+        [os.path.abspath(modulefilename) for modulefilename in modulelist],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    reply = self.proc.stdout.readline()
+    if reply != "READY\n":
+      self.stop()
+      raise Exception("The repy zygote failed to start: '" + reply.strip() + "'")
+
+
+  def is_running(self):
+    return self.proc.poll() is None
+
+
+  def start_repy(self, arguments):
+    """
+    <Purpose>
+      Starts a repy sandbox.
+
+    <Arguments>
+      arguments: The command line arguments for repy.py (without repy.py).
+
+    <Exceptions>
+      Exception if the sandbox could not be started.
+
+    <Returns>
+      The process id of the sandbox.
+    """
+    self.lock.acquire()
+    try:
+      try:
+        self.proc.stdin.write(json.dumps(arguments) + "\n")
+        self.proc.stdin.flush()
+        reply = self.proc.stdout.readline()
+      except (IOError, OSError), e:
+        raise Exception("Lost the connection to the repy zygote: " + str(e))
+    finally:
+      self.lock.release()
+
+    if not reply.startswith("OK "):
+      raise Exception("The repy zygote failed to start repy: '" + reply.strip() + "'")
+    return int(reply[3:])
+
+
+  def stop(self):
+    # Closing stdin makes the zygote exit (the sandboxes keep running)
+    self.lock.acquire()
+    try:
+      for pipe in [self.proc.stdin, self.proc.stdout]:
+        try:
+          pipe.close()
+        except (IOError, OSError):
+          pass
+      self.proc.wait()
+    finally:
+      self.lock.release()
+
+
+
+# The rest of this file runs in the zygote process
+
+def _run_repy(repydirectory, arguments):
+  # Runs in the forked sandbox process and never returns
+  import repy
+  import harshexit
+  import nonportable
+  import tracebackrepy
+
+  try:
+    # Don't hold on to the pipes of the zygote (and don't block the sandbox if
+    # nobody reads its output)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in [0, 1, 2]:
+      os.dup2(devnull, fd)
+    os.close(devnull)
+
+    # The run time of the sandbox starts now, not when the zygote started
+    nonportable.init_getruntime()
+
+    sys.argv = [os.path.join(repydirectory, "repy.py")] + arguments
+
+    # This is what repy.py does when it is run
+    try:
+      repy.main()
+    except SystemExit:
+      harshexit.harshexit(4)
+    except:
+      tracebackrepy.handle_exception()
+      harshexit.harshexit(3)
+  finally:
+    os._exit(3)
+
+
+
+def _fork_repy(repydirectory, arguments):
+  # The sandbox is forked from a child which exits right away, so that the
+  # zygote doesn't have to wait for the sandboxes
+  readfd, writefd = os.pipe()
+  childpid = os.fork()
+  if childpid == 0:
+    try:
+      os.close(readfd)
+      sandboxpid = os.fork()
+      if sandboxpid == 0:
+        os.close(writefd)
+        _run_repy(repydirectory, arguments)
+      os.write(writefd, str(sandboxpid))
+    finally:
+      os._exit(0)
+
+  os.close(writefd)
+  try:
+    sandboxpid = ""
+    while True:
+      data = os.read(readfd, 32)
+      if data == "":
+        break
+      sandboxpid = sandboxpid + data
+  finally:
+    os.close(readfd)
+    os.waitpid(childpid, 0)
+
+  if sandboxpid == "":
+    raise Exception("Failed to fork the sandbox")
+  return int(sandboxpid)
+
+
+
+def main():
+  repydirectory = os.path.dirname(os.path.abspath(__file__))
+  modulelist = sys.argv[1:]
+
+  # Import the runtime the way repy.py does when it starts
+  sys.argv = [os.path.join(repydirectory, "repy.py")]
+  import repy
+  import safe
+  import virtual_namespace
+  repy.init_repy_location(repydirectory)
+
+  # The caches are trimmed here, before the sandboxes run
+  safe.trim_caches()
+
+  for modulefilename in modulelist:
+    try:
+      modulefileobj = open(modulefilename)
+      try:
+        code = modulefileobj.read()
+      finally:
+        modulefileobj.close()
+      # dylink names modules by their file name
+      virtual_namespace.preload_code(code, os.path.basename(modulefilename))
+    except Exception, e:
+      # The sandboxes will report problems with the module if it is used
+      sys.stderr.write("Failed to preload '" + modulefilename + "': " + str(e) + "\n")
+
+  # The safety check workers must not be shared with the sandboxes
+  safe.stop_safe_check_workers()
+
+  sys.stdout.write("READY\n")
+  sys.stdout.flush()
+
+  while True:
+    request = sys.stdin.readline()
+    # The node manager exited or stopped us
+    if request == "":
+      break
+
+    try:
+      arguments = [str(argument) for argument in json.loads(request)]
+      reply = "OK " + str(_fork_repy(repydirectory, arguments))
+    except Exception, e:
+      reply = "ERROR " + str(e).replace("\n", " ")
+
+    sys.stdout.write(reply + "\n")
+    sys.stdout.flush()
+
+
+
+if __name__ == '__main__':
+  main()
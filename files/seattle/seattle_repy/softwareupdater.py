@@ -148,10 +148,10 @@ def safe_log_last_exception():
 
 def get_file_hash(filename):
   fileobj = file(filename, 'rb')
-  filedata = fileobj.read()
-  fileobj.close()
-
-  return sha_hexhash(filedata)
+  try:
+    return sha_hexhashfile(fileobj)
+  finally:
+    fileobj.close()
 
 
 
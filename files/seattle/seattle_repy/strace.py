@@ -6,7 +6,7 @@ Description:
 """
 
 # These API functions do _not_ return an object, and can be handled uniformly.
-NON_OBJ_API_CALLS = ["gethostbyname","getmyip","sendmessage","listfiles","removefile",
+NON_OBJ_API_CALLS = ["gethostbyname","getmyip","sendmessage","sendmessages","listfiles","removefile",
                      "exitall","getruntime","randombytes","createthread","sleep","getthreadname",
                      "getresources","getlasterror"]
 
@@ -182,6 +182,9 @@ class UDPServerObj():
   def getmessage(self, *args,**kwargs):
     return traced_call(self.sock,"UDPServerSocket.getmessage",self.sock.getmessage,args,kwargs)
 
+  def getmessages(self, *args,**kwargs):
+    return traced_call(self.sock,"UDPServerSocket.getmessages",self.sock.getmessages,args,kwargs)
+
   def close(self, *args, **kwargs):
     return traced_call(self.sock,"UDPServerSocket.close",self.sock.close,args,kwargs,True)
 
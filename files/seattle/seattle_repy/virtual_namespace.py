@@ -17,13 +17,47 @@ import safe
 # Get the errors
 from exception_hierarchy import *
 
-# This is to work around safe...
-safe_compile = compile
+# Code that was checked and compiled ahead of time (see preload_code), keyed
+# by the code (as prepared by _prepare_code) and its name
+_preloaded_code = {}
 
 # Functional constructor for VirtualNamespace
 def createvirtualnamespace(code, name):
   return VirtualNamespace(code,name)
 
+
+# Removes windows carriage returns and adds the encoding header
+def _prepare_code(code):
+  # Remove any windows carriage returns
+  code = code.replace('\r\n','\n')
+
+  # Prepend an encoding string to protect against bugs in that code (ticket #982)
+  # Note that this will cause tracebacks to have an inaccurate line number.
+  return "# coding: utf-8\n\n" + code
+
+
+def preload_code(code, name):
+  """
+  <Purpose>
+    Checks and compiles code ahead of time, so that later VirtualNamespaces
+    with the same code and name don't need to do it again.   This is used
+    by repyzygote.py for the libraries that most programs import.
+
+  <Arguments>
+    code, name: As with VirtualNamespace.
+
+  <Exceptions>
+    As with VirtualNamespace.
+
+  <Returns>
+    None
+  """
+  # The preloaded libraries come from the node manager, not a sandbox, so
+  # they may be cached
+  _preloaded_code[(_prepare_code(code), name)] = VirtualNamespace(code, name,
+      True).code
+
+
 # This class is used to represent a namespace
 class VirtualNamespace(object):
   """
@@ -33,7 +67,7 @@ class VirtualNamespace(object):
   """
 
   # Constructor
-  def __init__(self, code, name):
+  def __init__(self, code, name, cacheable=None):
     """
     <Purpose>
       Initializes the VirtualNamespace class.
@@ -48,6 +82,11 @@ class VirtualNamespace(object):
           being executed, if there is an exception, this name will appear in
           the traceback.
 
+      cacheable:
+          (Boolean, optional) Whether the safety verdict and the bytecode
+          may be cached.   By default they are cached only if the code is a
+          library of the repy directory (see safe.is_repy_library_code).
+
     <Exceptions>
       A safety check is performed on the code, and a CodeUnsafeError exception will be raised
       if the code fails the safety check. 
@@ -62,21 +101,24 @@ class VirtualNamespace(object):
     if type(name) is not str:
       raise RepyArgumentError, "Name must be a string!"
 
-    # Remove any windows carriage returns
-    code = code.replace('\r\n','\n')
+    if cacheable is None:
+      cacheable = safe.is_repy_library_code(code, name)
+
+    code = _prepare_code(code)
 
-    # Prepend an encoding string to protect against bugs in that code (ticket #982)
-    # Note that this will cause tracebacks to have an inaccurate line number.
-    code = "# coding: utf-8\n\n" + code 
+    # Code that was preloaded was already checked and compiled
+    if (code, name) in _preloaded_code:
+      self.code = _preloaded_code[(code, name)]
+      return
 
     # Do a safety check
     try:
-      safe.serial_safe_check(code)
+      safe.serial_safe_check(code, cacheable)
     except Exception, e:
       raise CodeUnsafeError, "Code failed safety check! Error: "+str(e)
 
     # All good, store the compiled byte code
-    self.code = safe_compile(code,name,"exec")
+    self.code = safe.cached_compile(code, name, cacheable)
 
 
   # Evaluates the virtual namespace
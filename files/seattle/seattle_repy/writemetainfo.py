@@ -41,10 +41,10 @@ TIME_PORT = 51345
 
 def get_file_hash(filename):
   fileobj = file(filename, 'rb')
-  filedata = fileobj.read()
-  fileobj.close()
-
-  return sha_hexhash(filedata)
+  try:
+    return sha_hexhashfile(fileobj)
+  finally:
+    fileobj.close()
 
 
 